@@ -17,7 +17,7 @@ from numpy import exp, log, pi, zeros
 
 from netCDF4 import Dataset
 netcdf = Dataset
-from PseudoNetCDF import getvarpnc, slice_dim, extract
+from PseudoNetCDF import getvarpnc, slice_dim, extract, interpweights, applyweights
 from PseudoNetCDF.conventions.ioapi import add_cf_from_ioapi
 from PseudoNetCDF.pncgen import pncgen
 from PseudoNetCDF.geoschemfiles import bpch
@@ -1281,12 +1281,14 @@ def makeibcon(args):
                             rpress = rpress.reshape(rpress.shape[0], cpress.shape[1])
                             assert((np.diff(rpress, axis = 0).mean(1) < 0).all())
                                                 
-                            outvals = np.zeros(cpress.shape, dtype = 'f')
-                            for pi, (cp, rp, column) in enumerate(zip(cpress.T, rpress.T, temp_hour.T)):
-                                outvals[:, pi] = np.interp(cp[::-1], rp[::-1], column[::-1])[::-1]
-                                if args.verbose:
-                                    print(4*'\b',end = '')
-                                    print('%3.0f%%' % (pi/cpress.shape[1]*100),end = '')
+                            # weights are cached by pressure, so species share them
+                            weights = interpweights(rpress, cpress)
+                            column = np.asarray(temp_hour).reshape(temp_hour.shape[0], -1)
+                            outvals = applyweights(column, weights).astype('f')
+                            if args.verbose:
+                                # all columns are interpolated at once
+                                print(4*'\b',end = '')
+                                print('%3.0f%%' % 100,end = '')
                             out[toff + ti, :, :] = outvals.reshape(*out.shape[1:])
                         toff = toff + ti + 1
                     minout = np.maximum(out, minval)
@@ -10,7 +10,7 @@ __doc__ = r"""
 .. moduleauthor:: Barron Henderson <barronh@unc.edu>
 """
 
-__all__ = ['add_derived', 'time_avg_new_unit', 'window', 'newresolution', 'MetaNetCDF', 'WindowFromFile', 'file_master']
+__all__ = ['add_derived', 'time_avg_new_unit', 'window', 'newresolution', 'MetaNetCDF', 'WindowFromFile', 'file_master', 'mfdataset']
 
 HeadURL = "$HeadURL$"
 ChangeDate = "$LastChangedDate$"
@@ -18,6 +18,11 @@ RevisionNum= "$LastChangedRevision$"
 ChangedBy  = "$LastChangedBy$"
 __version__ = RevisionNum
 
+import os
+import json
+from collections import OrderedDict
+from warnings import warn
+import unittest
 from numpy import array, where, logical_or, repeat, mean, sum, zeros
 #This Package modules
 from PseudoNetCDF.sci_var import PseudoNetCDFFile, \
@@ -178,6 +183,7 @@ class newresolution(PseudoNetCDFFile):
         if not logical_or((self.__mesh % 1) == 0, (1. / self.__mesh) % 1 ==0).any():
             raise ValueError("One resolution must be a factor of the other.")
 
+        from PseudoNetCDF.sci_var import Pseudo2NetCDF
         Pseudo2NetCDF().addDimensions(self.__file, self)
         any_non_time_key = [k for k in self.__file.variables.keys() if 'TFLAG' not in k][0]
         for dk, dfactor in zip(self.__dimension, 1./self.__mesh):
@@ -211,6 +217,7 @@ class newresolution(PseudoNetCDFFile):
         else:
             ov = self.__file.variables[k]
             v = self.__method(ov)
+            from PseudoNetCDF.sci_var import Pseudo2NetCDF
             Pseudo2NetCDF().addVariableProperties(ov, v)
             return v
                 
@@ -288,6 +295,235 @@ class MetaNetCDF(PseudoNetCDFFile):
         raise KeyError('%s not in any files' % k)
 file_master = MetaNetCDF
 
+class mfdataset(PseudoNetCDFFile):
+    """
+    mfdataset presents many files as one file stacked along their
+    time dimension. Times are read from time, TFLAG or tau0 once per
+    file and kept in an index of time to file and record offset. The
+    index can be saved to indexpath (JSON) and is reused for files
+    whose size and modification time are unchanged. Time queries open
+    only the files that they need, variables without the time
+    dimension are read from the first file, and at most maxopen files
+    are kept open (the least recently used are closed).
+    
+    ex:
+        >>> mf = mfdataset(sorted(glob('CAMx.*.avrg')), format = 'uamiv', indexpath = 'avrg.idx')
+        >>> mf.dimensions['TSTEP']
+        744
+        >>> mf.getpaths(datetime(2010, 7, 4), datetime(2010, 7, 5))
+        [('CAMx.20100704.avrg', 0, 24)]
+        >>> july4 = mf.timeslice(datetime(2010, 7, 4), datetime(2010, 7, 5))
+        >>> july4.variables['O3'].shape
+        (24, 1, 65, 83)
+    """
+    @classmethod
+    def isMine(cls, *args, **kwds):
+        return False
+    
+    def __init__(self, paths, format = None, indexpath = None, maxopen = 16, **kwds):
+        """
+        paths - iterable of paths in time order
+        format - reader name passed to pncopen (None to detect)
+        indexpath - path of a JSON index to reuse and update (optional)
+        maxopen - files to keep open (the first file is always open)
+        kwds - passed to pncopen for each file
+        """
+        PseudoNetCDFFile.__init__(self)
+        self.__paths = [os.path.abspath(path) for path in paths]
+        if len(self.__paths) == 0:
+            raise ValueError('mfdataset requires at least one path')
+        self.__format = format
+        self.__kwds = kwds
+        self.__indexpath = indexpath
+        self.__maxopen = max(1, maxopen)
+        self.__files = OrderedDict()
+        self.__stacked = None
+        self.__index = self.__getindex()
+        tmpf = self.__openfile(self.__paths[0])
+        self.__timedim = timedim = self.__index[self.__paths[0]]['timedim']
+        self.__keys = list(tmpf.variables.keys())
+        from PseudoNetCDF.sci_var import Pseudo2NetCDF
+        p2p = Pseudo2NetCDF(verbose = 0)
+        p2p.addDimensions(tmpf, self)
+        p2p.addGlobalProperties(tmpf, self)
+        ntimes = len(self.times)
+        self.createDimension(timedim, ntimes).setunlimited(True)
+        self.variables = PseudoNetCDFVariables(self.__variables, self.__keys)
+    
+    def __openfile(self, path):
+        files = self.__files
+        if path in files:
+            files[path] = files.pop(path)
+        else:
+            from PseudoNetCDF._getreader import pncopen
+            files[path] = pncopen(path, format = self.__format, **self.__kwds)
+            # the first file provides headers and variables without time
+            for oldpath in list(files.keys()):
+                if len(files) <= self.__maxopen:
+                    break
+                if oldpath != self.__paths[0]:
+                    self.__closefile(files.pop(oldpath))
+        return files[path]
+    
+    @staticmethod
+    def __closefile(ifile):
+        try:
+            ifile.close()
+        except Exception as e:
+            warn('Could not close %s; %s' % (ifile, e))
+    
+    def close(self):
+        """
+        Close all open files
+        """
+        while len(self.__files) > 0:
+            self.__closefile(self.__files.popitem()[1])
+    
+    @property
+    def openpaths(self):
+        """
+        paths of the files that are open, least recently used first
+        """
+        return list(self.__files.keys())
+    
+    def __member(self, path):
+        """
+        Returns a file with the dimensions and variables of path that
+        opens path (through the open file pool) only when a variable
+        is read
+        """
+        member = PseudoNetCDFFile()
+        for dk, dv in self.dimensions.items():
+            if dk == self.__timedim:
+                member.createDimension(dk, len(self.__index[path]['times'])).setunlimited(True)
+            else:
+                member.createDimension(dk, len(dv))
+        member.variables = PseudoNetCDFVariables(lambda k: self.__openfile(path).variables[k], self.__keys)
+        return member
+    
+    def __scan(self, path, stat):
+        from PseudoNetCDF.coordutil import gettimes
+        ifile = self.__openfile(path)
+        for timekey in ['time', 'TFLAG', 'tau0']:
+            if timekey in ifile.variables:
+                timedim = ifile.variables[timekey].dimensions[0]
+                break
+        else:
+            raise ValueError('cannot understand time for %s' % path)
+        
+        times = []
+        for t in gettimes(ifile):
+            if t.tzinfo is not None:
+                t = t.replace(tzinfo = None) - t.utcoffset()
+            times.append(t.strftime('%Y-%m-%dT%H:%M:%S'))
+        return dict(size = stat.st_size, mtime_ns = stat.st_mtime_ns, timedim = timedim, times = times)
+    
+    def __getindex(self):
+        indexpath = self.__indexpath
+        saved = {}
+        if indexpath is not None and os.path.exists(indexpath):
+            try:
+                with open(indexpath, 'r') as indexfile:
+                    saved = json.load(indexfile)['files']
+            except Exception as e:
+                warn('Ignoring unreadable index %s; %s' % (indexpath, e))
+        
+        index = OrderedDict()
+        changed = False
+        for path in self.__paths:
+            stat = os.stat(path)
+            entry = saved.get(path)
+            if entry is None or entry.get('size') != stat.st_size or entry.get('mtime_ns') != stat.st_mtime_ns:
+                entry = self.__scan(path, stat)
+                changed = True
+            index[path] = entry
+        
+        if indexpath is not None and changed:
+            saved.update(index)
+            tmppath = indexpath + '.%d.tmp' % os.getpid()
+            try:
+                with open(tmppath, 'w') as tmpfile:
+                    json.dump(dict(files = saved), tmpfile, indent = 1)
+                os.replace(tmppath, indexpath)
+            except Exception as e:
+                warn('Could not save index %s: %s' % (indexpath, e))
+                if os.path.exists(tmppath):
+                    os.remove(tmppath)
+        
+        return index
+    
+    @property
+    def times(self):
+        """
+        datetime for every record in the stacked time dimension
+        """
+        from datetime import datetime
+        times = []
+        for path in self.__paths:
+            times.extend([datetime.strptime(t, '%Y-%m-%dT%H:%M:%S') for t in self.__index[path]['times']])
+        return array(times)
+    
+    def getpaths(self, start = None, end = None):
+        """
+        Returns a list of (path, first, last) for files with records
+        where start <= time < end; first and last are record offsets
+        (last is exclusive). None leaves the bound open.
+        """
+        if start is not None:
+            start = start.strftime('%Y-%m-%dT%H:%M:%S')
+        if end is not None:
+            end = end.strftime('%Y-%m-%dT%H:%M:%S')
+        
+        out = []
+        for path in self.__paths:
+            # ISO strings sort as times
+            times = self.__index[path]['times']
+            keep = [i for i, t in enumerate(times) if (start is None or t >= start) and (end is None or t < end)]
+            if len(keep) > 0:
+                out.append((path, keep[0], keep[-1] + 1))
+        return out
+    
+    def timeslice(self, start = None, end = None):
+        """
+        Returns a file with only records where start <= time < end;
+        only files with those records are opened.
+        """
+        from PseudoNetCDF.core._functions import slice_dim, _stackedvariable
+        timedim = self.__timedim
+        fs = []
+        for path, first, last in self.getpaths(start, end):
+            ifile = self.__member(path)
+            if first != 0 or last != len(self.__index[path]['times']):
+                ifile = slice_dim(ifile, '%s,%d,%d' % (timedim, first, last), fuzzydim = False)
+            fs.append(ifile)
+        if len(fs) == 0:
+            raise ValueError('No times from %s to %s' % (start, end))
+        
+        outf = PseudoNetCDFFile()
+        for dk, dv in self.dimensions.items():
+            if dk == timedim:
+                outf.createDimension(dk, sum([len(f.dimensions[dk]) for f in fs])).setunlimited(True)
+            else:
+                outf.createDimension(dk, len(dv))
+        for pk in self.ncattrs():
+            setattr(outf, pk, getattr(self, pk))
+        firstf = self.__openfile(self.__paths[0])
+        def getvar(k):
+            # variables without time are the same in every file
+            var = firstf.variables[k]
+            if timedim not in var.dimensions:
+                return var
+            return _stackedvariable(outf, k, fs, list(var.dimensions).index(timedim))
+        outf.variables = PseudoNetCDFVariables(getvar, self.__keys)
+        # reads go through the open file pool of this file
+        outf._sourcefiles = (self,)
+        return outf
+    
+    def __variables(self, k):
+        if self.__stacked is None:
+            self.__stacked = self.timeslice()
+        return self.__stacked.variables[k]
+
 def WindowFromFile(WindowThis, WindowFrom):
     """
     WindowFromFile creates a bounding box to window one file
@@ -331,4 +567,95 @@ def WindowFromFile(WindowThis, WindowFrom):
         outf.addMetaVariable(k, lambda self: self.childvariables(k)[:, :, jslice, islice])
     for k in WindowThis.variables.keys():
         AddMetaVar(k, jslice, islice)
-    return outf
\ No newline at end of file
+    return outf
+
+
+class TestMetaNetCDF(unittest.TestCase):
+    def runTest(self):
+        pass
+    def setUp(self):
+        from tempfile import mkdtemp
+        import numpy as np
+        from PseudoNetCDF.pncgen import pncgen
+        self.tmpdir = mkdtemp()
+        self.paths = []
+        for day in range(3):
+            f = PseudoNetCDFFile()
+            f.createDimension('time', 4).setunlimited(True)
+            f.createDimension('x', 2)
+            t = f.createVariable('time', 'd', ('time',))
+            t.units = 'hours since 2010-07-0%d 00:00:00 UTC' % (day + 1)
+            t[:] = np.arange(4) * 6
+            o3 = f.createVariable('O3', 'f', ('time', 'x'))
+            o3.units = 'ppb'
+            o3[:] = day * 8 + np.arange(8).reshape(4, 2)
+            x = f.createVariable('x', 'd', ('x',))
+            x[:] = [10, 20]
+            path = os.path.join(self.tmpdir, 'day%d.nc' % day)
+            pncgen(f, path, format = 'NETCDF3_CLASSIC', verbose = 0).close()
+            self.paths.append(path)
+    
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree(self.tmpdir)
+    
+    def testMfdataset(self):
+        from datetime import datetime
+        import numpy as np
+        indexpath = os.path.join(self.tmpdir, 'index.json')
+        mf = mfdataset(self.paths, format = 'netcdf', indexpath = indexpath)
+        self.assertEqual(len(mf.dimensions['time']), 12)
+        self.assertEqual(mf.times[5], datetime(2010, 7, 2, 6))
+        self.assert_((mf.variables['O3'][:] == np.arange(24).reshape(12, 2)).all())
+        self.assert_(os.path.exists(indexpath))
+        
+        mf = mfdataset(self.paths, format = 'netcdf', indexpath = indexpath)
+        self.assertEqual(len(mf.openpaths), 1)
+        start, end = datetime(2010, 7, 3, 6), datetime(2010, 7, 3, 18)
+        self.assertEqual(mf.getpaths(start, end), [(self.paths[2], 1, 3)])
+        sub = mf.timeslice(start, end)
+        self.assertEqual(mf.openpaths, [self.paths[0]])
+        self.assert_((sub.variables['O3'][:] == [[18, 19], [20, 21]]).all())
+        self.assertEqual(sorted(mf.openpaths), [self.paths[0], self.paths[2]])
+        sub = mf.timeslice(datetime(2010, 7, 1, 18), datetime(2010, 7, 2, 6))
+        self.assert_((sub.variables['O3'][:] == [[6, 7], [8, 9]]).all())
+        self.assert_((sub.variables['x'][:] == [10, 20]).all())
+        self.assertRaises(ValueError, mf.timeslice, datetime(2011, 1, 1))
+        mf.close()
+        self.assertEqual(len(mf.openpaths), 0)
+        
+        # variables without time come from the first file; only maxopen
+        # files stay open and closed files are reopened when read
+        mf = mfdataset(self.paths, format = 'netcdf', indexpath = indexpath, maxopen = 2)
+        self.assert_((mf.variables['x'][:] == [10, 20]).all())
+        self.assertEqual(mf.openpaths, [self.paths[0]])
+        o3 = mf.variables['O3']
+        self.assert_((o3[:] == np.arange(24).reshape(12, 2)).all())
+        self.assertEqual(mf.openpaths, [self.paths[0], self.paths[2]])
+        self.assert_((o3[4:6] == [[8, 9], [10, 11]]).all())
+        self.assertEqual(mf.openpaths, [self.paths[0], self.paths[1]])
+        mf.close()
+    
+    def testIndex(self):
+        import json
+        from datetime import datetime
+        indexpath = os.path.join(self.tmpdir, 'index.json')
+        mfdataset(self.paths, format = 'netcdf', indexpath = indexpath).close()
+        self.assertEqual([p for p in os.listdir(self.tmpdir) if p.endswith('.tmp')], [])
+        with open(indexpath, 'r') as indexfile:
+            saved = json.load(indexfile)['files']
+        stat = os.stat(self.paths[1])
+        self.assertEqual(saved[self.paths[1]]['mtime_ns'], stat.st_mtime_ns)
+        self.assertEqual(saved[self.paths[1]]['size'], stat.st_size)
+        
+        # unchanged files reuse saved times; changed files are rescanned
+        saved[self.paths[1]]['times'][0] = '2000-01-01T00:00:00'
+        with open(indexpath, 'w') as indexfile:
+            json.dump(dict(files = saved), indexfile)
+        mf = mfdataset(self.paths, format = 'netcdf', indexpath = indexpath)
+        self.assertEqual(mf.times[4], datetime(2000, 1, 1))
+        mf.close()
+        os.utime(self.paths[1], ns = (stat.st_atime_ns, stat.st_mtime_ns + 1))
+        mf = mfdataset(self.paths, format = 'netcdf', indexpath = indexpath)
+        self.assertEqual(mf.times[4], datetime(2010, 7, 2))
+        mf.close()
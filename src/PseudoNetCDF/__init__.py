@@ -33,19 +33,28 @@ from PseudoNetCDF import sci_var
 from .sci_var import *
 __all__ += sci_var.__all__
 
-from . import camxfiles
-from . import cmaqfiles
-from . import racmfiles
-from . import geoschemfiles
-from . import noaafiles
-from . import epafiles
-from . import MetaNetCDF
-from . import ArrayTransforms
-from . import units
-from . import icarttfiles
-from . import aermodfiles
-from . import textfiles
-from . import coordutil
-from . import test
 from ._getreader import anyfile, pncopen
-from .pncparse import PNC, pnc
+
+# Format packages, utilities and the command line parser are imported on
+# first attribute access (PEP 562); readers are registered by name in
+# _getreader and imported when pncopen or getreader needs them
+_lazymodules = ['camxfiles', 'cmaqfiles', 'racmfiles', 'geoschemfiles',
+                'noaafiles', 'epafiles', 'MetaNetCDF', 'ArrayTransforms',
+                'units', 'icarttfiles', 'aermodfiles', 'textfiles',
+                'coordutil', 'test', 'pncdump', 'toms', 'conventions']
+_lazyattrs = {'PNC': 'pncparse', 'pnc': 'pncparse'}
+
+def __getattr__(name):
+    from importlib import import_module
+    if name in _lazymodules:
+        return import_module('.' + name, __name__)
+    elif name in _lazyattrs:
+        return getattr(import_module('.' + _lazyattrs[name], __name__), name)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+def __dir__():
+    return sorted(set(list(globals().keys()) + _lazymodules + list(_lazyattrs)))
+
+if sys.version_info < (3, 7):
+    for _name in _lazymodules + list(_lazyattrs):
+        globals()[_name] = __getattr__(_name)
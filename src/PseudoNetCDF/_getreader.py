@@ -2,10 +2,135 @@ __all__ = ['getreader']
 
 import unittest
 import os
+from collections import OrderedDict
+from importlib import import_module
 from warnings import warn
 from PseudoNetCDF.netcdf import NetCDFFile
 
 _readers = [('netcdf', NetCDFFile)]
+
+# Built-in reader classes as 'module:class' in registration order (the
+# last entry has the highest priority). Modules are imported on first
+# use, which registers every reader they define; until then, names are
+# resolved with the same rule as the PseudoNetCDFType metaclass
+# (see _readernames). testREADERTABLE checks the table against _readers.
+_builtinreaders = ['PseudoNetCDF.camxfiles.cloud_rain.Memmap:cloud_rain',
+                   'PseudoNetCDF.MetaNetCDF:add_derived',
+                   'PseudoNetCDF.MetaNetCDF:time_avg_new_unit',
+                   'PseudoNetCDF.MetaNetCDF:window',
+                   'PseudoNetCDF.MetaNetCDF:newresolution',
+                   'PseudoNetCDF.MetaNetCDF:MetaNetCDF',
+                   'PseudoNetCDF.MetaNetCDF:mfdataset',
+                   'PseudoNetCDF.camxfiles.cloud_rain.Transforms:cloud_rain_center_time',
+                   'PseudoNetCDF.camxfiles.cloud_rain.Transforms:cloud_rain_plus',
+                   'PseudoNetCDF.camxfiles.cloud_rain.Transforms:cloud_rain_center_time_plus',
+                   'PseudoNetCDF.camxfiles.height_pressure.Memmap:height_pressure',
+                   'PseudoNetCDF.camxfiles.height_pressure.Read:height_pressure',
+                   'PseudoNetCDF.camxfiles.height_pressure.Transforms:height_pressure_plus',
+                   'PseudoNetCDF.camxfiles.height_pressure.Transforms:height_pressure_center_time_plus',
+                   'PseudoNetCDF.camxfiles.height_pressure.Transforms:height_pressure_center_time',
+                   'PseudoNetCDF.camxfiles.one3d.Memmap:one3d',
+                   'PseudoNetCDF.camxfiles.one3d.Read:one3d',
+                   'PseudoNetCDF.camxfiles.humidity.Memmap:humidity',
+                   'PseudoNetCDF.camxfiles.humidity.Read:humidity',
+                   'PseudoNetCDF.camxfiles.humidity.Transforms:humidity_center_time',
+                   'PseudoNetCDF.camxfiles.ipr.Memmap:ipr',
+                   'PseudoNetCDF.camxfiles.ipr.Read:ipr',
+                   'PseudoNetCDF.camxfiles.irr.Memmap:irr',
+                   'PseudoNetCDF.camxfiles.irr.Read:irr',
+                   'PseudoNetCDF.camxfiles.landuse.Memmap:landuse',
+                   'PseudoNetCDF.camxfiles.point_source.Memmap:point_source',
+                   'PseudoNetCDF.camxfiles.point_source.Read:point_source',
+                   'PseudoNetCDF.camxfiles.temperature.Memmap:temperature',
+                   'PseudoNetCDF.camxfiles.temperature.Read:temperature',
+                   'PseudoNetCDF.camxfiles.temperature.Transforms:temperature_center_time',
+                   'PseudoNetCDF.camxfiles.uamiv.Memmap:uamiv',
+                   'PseudoNetCDF.camxfiles.uamiv.Read:uamiv',
+                   'PseudoNetCDF.camxfiles.uamiv.Read:uamiv_new',
+                   'PseudoNetCDF.camxfiles.uamiv.Transforms:osat',
+                   'PseudoNetCDF.camxfiles.vertical_diffusivity.Memmap:vertical_diffusivity',
+                   'PseudoNetCDF.camxfiles.vertical_diffusivity.Read:vertical_diffusivity',
+                   'PseudoNetCDF.camxfiles.vertical_diffusivity.Transforms:vertical_diffusivity_center_time',
+                   'PseudoNetCDF.camxfiles.wind.Memmap:wind',
+                   'PseudoNetCDF.camxfiles.wind.Read:wind',
+                   'PseudoNetCDF.camxfiles.wind.Transforms:wind_center_time_cell',
+                   'PseudoNetCDF.camxfiles.lateral_boundary.Memmap:lateral_boundary',
+                   'PseudoNetCDF.camxfiles.finst.Memmap:finst',
+                   'PseudoNetCDF.geoschemfiles._bpch:_diag_group',
+                   'PseudoNetCDF.geoschemfiles._bpch:bpch',
+                   'PseudoNetCDF.geoschemfiles._newbpch:bpch2',
+                   'PseudoNetCDF.geoschemfiles._geos:geos',
+                   'PseudoNetCDF.geoschemfiles._planelog:flightlogs',
+                   'PseudoNetCDF.icarttfiles.ffi1001:ffi1001',
+                   'PseudoNetCDF.textfiles._delimited:csv',
+                   'PseudoNetCDF.cmaqfiles._jtable:jtable',
+                   'PseudoNetCDF.cmaqfiles.profile:icon_profile',
+                   'PseudoNetCDF.cmaqfiles.profile:bcon_profile',
+                   'PseudoNetCDF.noaafiles._arl:arlpackedbit',
+                   'PseudoNetCDF.epafiles._aqsraw:aqsraw',
+                   'PseudoNetCDF.aermodfiles._aermod_plotfile:reader',
+                   'PseudoNetCDF.net_balance:sum_reader',
+                   'PseudoNetCDF.net_balance:ctb_reader',
+                   'PseudoNetCDF.net_balance:net_reader',
+                   'PseudoNetCDF.net_balance:mrgaloft']
+
+def _readernames(qualname):
+    """
+    Return the short and long names for the reader class qualname
+    (e.g., PseudoNetCDF.camxfiles.uamiv.Memmap.uamiv gives uamiv and
+    camxfiles.uamiv.Memmap.uamiv); private and core modules are omitted
+    """
+    pieces = qualname.split('.')
+    longname = '.'.join([p for p in pieces[1:-1]  if '_' != p[0] and p not in ('core',)] + [pieces[-1]])
+    return pieces[-1], longname
+
+def _builtinentries():
+    """
+    Return (name, 'module:class') pairs for _builtinreaders; like
+    registerreader, the first class to claim a name keeps it
+    """
+    entries = []
+    claimed = set()
+    for entry in _builtinreaders:
+        for name in _readernames(entry.replace(':', '.')):
+            if name not in claimed:
+                claimed.add(name)
+                entries.append((name, entry))
+    return entries
+
+# netcdf is registered above with the lowest priority
+_entrypoints = [('netcdf', 'PseudoNetCDF.netcdf:NetCDFFile')] + _builtinentries()
+
+def _camxname(name):
+    """
+    CAMx headers store names as 4-byte characters
+    """
+    return ''.join([c.ljust(4) for c in name]).encode('ASCII')
+
+# Format hints are (offset, magic bytes, reader name) and are checked
+# before any reader is tried; a hint only reorders candidates, the
+# reader must still recognize the file
+_magichints = [(0, b'CDF\x01', 'netcdf'),
+               (0, b'CDF\x02', 'netcdf'),
+               (0, b'CDF\x05', 'netcdf'),
+               (0, b'\x89HDF\r\n\x1a\n', 'netcdf'),
+               (4, b'CTM bin', 'bpch'),
+               (4, b'CTM bin', 'bpch2'),
+               (4, _camxname('AVERAGE'), 'uamiv'),
+               (4, _camxname('INSTANT'), 'uamiv'),
+               (4, _camxname('AIRQUALITY'), 'uamiv'),
+               (4, _camxname('EMISSIONS'), 'uamiv'),
+               (4, _camxname('PTSOURCE'), 'point_source'),
+               (4, _camxname('BOUNDARY'), 'lateral_boundary')]
+_extensionhints = {'.nc': ['netcdf'], '.nc4': ['netcdf'], '.ncf': ['netcdf'],
+                   '.bpch': ['bpch', 'bpch2'], '.ict': ['ffi1001'],
+                   '.ffi1001': ['ffi1001']}
+
+# Readers found for (path, mtime, size) keys; the least recently
+# used entries are dropped beyond _readercachesize
+_readercache = OrderedDict()
+_readercachesize = 256
+
 def testreader(reader, *args, **kwds):
     try:
         reader(*args, **kwds)
@@ -13,27 +138,210 @@ def testreader(reader, *args, **kwds):
     except:
         return False
 
+def registerhint(name, magic = None, offset = 0, extension = None):
+    """
+    Suggest reader (name) for files that have magic bytes at
+    offset or that end with extension
+    """
+    if magic is not None:
+        _magichints.insert(0, (offset, magic, name))
+    if extension is not None:
+        _extensionhints.setdefault(extension.lower(), []).insert(0, name)
+
+def _sniff(path):
+    """
+    Return names of readers suggested by magic bytes or extension
+    """
+    names = []
+    try:
+        with open(path, 'rb') as inf:
+            head = inf.read(max([o + len(m) for o, m, n in _magichints]))
+    except Exception:
+        head = b''
+    for offset, magic, name in _magichints:
+        if head[offset:offset + len(magic)] == magic:
+            names.append(name)
+    names.extend(_extensionhints.get(os.path.splitext(path)[1].lower(), []))
+    return names
+
+def _cachekey(path):
+    try:
+        stat = os.stat(path)
+        return (os.path.realpath(path), stat.st_mtime, stat.st_size)
+    except Exception:
+        return None
+
+def _ismine(reader, *args, **kwds):
+    try:
+        return getattr(reader, 'isMine', lambda *args, **kwds: testreader(reader, *args, **kwds))(*args, **kwds)
+    except Exception:
+        return False
+
+def _loadreader(name):
+    """
+    Return the reader registered as name, importing its
+    module from the built-in entry points if necessary
+    """
+    for k, v in _readers:
+        if k == name:
+            return v
+    for k, entry in _entrypoints:
+        if k == name:
+            modname, attr = entry.split(':')
+            reader = import_module(modname)
+            for a in attr.split('.'):
+                reader = getattr(reader, a)
+            return reader
+    raise KeyError(name)
+
+def _registered():
+    """
+    Return (name, reader) pairs that have been registered in priority
+    order without importing anything; readers registered outside the
+    built-in modules come first
+    """
+    registered = dict(_readers)
+    builtin = set([k for k, e in _entrypoints])
+    return ([(k, v) for k, v in _readers if k not in builtin] +
+            [(k, registered[k]) for k, e in _entrypoints[::-1] if k in registered])
+
+# Built-in modules that could not be imported (warned once)
+_unavailable = set()
+def _importreaders(modname):
+    """
+    Import the built-in reader module modname (registering its readers);
+    returns False, with one warning, if it cannot be imported
+    """
+    if modname in _unavailable:
+        return False
+    try:
+        import_module(modname)
+        return True
+    except ImportError as e:
+        _unavailable.add(modname)
+        warn('Readers from %s are unavailable; %s' % (modname, e))
+        return False
+
+_loadedall = False
+def _loadreaders():
+    """
+    Import all built-in reader modules and return (name, reader)
+    pairs in priority order
+    """
+    global _loadedall
+    if not _loadedall:
+        for k, entry in _entrypoints:
+            _importreaders(entry.split(':')[0])
+        _loadedall = True
+    return _registered()
+
+def _iterreaders():
+    """
+    Yield readers in priority order; a built-in module is imported
+    only when its first reader is reached
+    """
+    builtin = set([k for k, e in _entrypoints])
+    for k, v in list(_readers):
+        if k not in builtin:
+            yield v
+    for k, entry in _entrypoints[::-1]:
+        if _importreaders(entry.split(':')[0]):
+            yield _loadreader(k)
+
+def _findreader(candidates, tried, parallel, *args, **kwds):
+    """
+    Return first reader in candidates that is not in tried and
+    recognizes the file; every reader tested is added to tried.
+    Serial tests consume candidates (any iterable) only up to the
+    reader that is found.
+    """
+    if parallel:
+        try:
+            from concurrent.futures import ThreadPoolExecutor
+        except ImportError:
+            warn('concurrent.futures is not available; testing readers serially')
+            parallel = False
+    
+    # Readers are registered with short and long names; test each once
+    if parallel:
+        untried = []
+        for reader in candidates:
+            if not any([reader is c for c in tried + untried]):
+                untried.append(reader)
+        tried.extend(untried)
+        with ThreadPoolExecutor() as executor:
+            mine = executor.map(lambda reader: _ismine(reader, *args, **kwds), untried)
+            matches = [reader for reader, ismine in zip(untried, mine) if ismine]
+        for reader in matches:
+            return reader
+        return None
+    
+    for reader in candidates:
+        if any([reader is c for c in tried]):
+            continue
+        tried.append(reader)
+        if _ismine(reader, *args, **kwds):
+            return reader
+    return None
+
 def getreader(*args, **kwds):
     """
     args - arguments for opening file
     kwds - keywords for file opener and optional format
     format - name of reader (optional)
+    parallel - test candidate readers concurrently (default False)
+    
+    Without format, readers suggested by magic bytes or extension are
+    tried first and the result is cached for the path, modification
+    time and size. Other reader modules are only imported when the
+    suggested readers do not recognize the file and, unless parallel,
+    only until a reader recognizes it.
     """
-    global _readers
     format = kwds.pop('format', None)
+    parallel = kwds.pop('parallel', False)
     if not os.path.isfile(args[0]):
         warn('The first argument (%s) does not exist as a file.  First arguments are usually paths' % (args[0],))
     
-    if format is None:
-        _myreaders = _readers
+    tried = []
+    reader = None
+    if format is not None:
+        try:
+            reader = _findreader([_loadreader(format)], tried, parallel, *args, **kwds)
+        except KeyError:
+            pass
     else:
-        _myreaders = [(k, v) for k, v in _readers if format == k]
+        cachekey = None
+        if len(kwds) == 0 and len(args) == 1 and isinstance(args[0], str):
+            cachekey = _cachekey(args[0])
+            if cachekey in _readercache:
+                reader = _readercache.pop(cachekey)
+                _readercache[cachekey] = reader
+                return reader
+            # Hinted readers go first, but keep their registry order
+            hints = _sniff(args[0])
+            for name in hints:
+                try:
+                    _loadreader(name)
+                except (KeyError, ImportError):
+                    pass
+            hinted = [v for k, v in _registered() if k in hints]
+            reader = _findreader(hinted, tried, parallel, *args, **kwds)
+        
+        if reader is None:
+            if parallel:
+                candidates = [v for k, v in _loadreaders()]
+            else:
+                candidates = _iterreaders()
+            reader = _findreader(candidates, tried, parallel, *args, **kwds)
+        
+        if reader is not None and cachekey is not None:
+            _readercache[cachekey] = reader
+            while len(_readercache) > _readercachesize:
+                _readercache.popitem(last = False)
     
-    for rn, reader in _myreaders:
-        if getattr(reader, 'isMine', lambda *args, **kwds: testreader(reader, *args, **kwds))(*args, **kwds):
-            return reader
-    else:
+    if reader is None:
         raise TypeError('No reader could open a file with these arguments %s %s' % (args, kwds))
+    return reader
 
 def registerreader(name, reader):
     global _readers
@@ -53,13 +361,15 @@ def pncopen(*args, **kwds):
     kwds - keywords for file opener and optional format and addcf
     format - name of reader (not passed to reader)
     addcf - boolean to add CF conventions (not passed to reader)
+    parallel - test readers concurrently when format is None (not passed to reader)
     """
     format = kwds.pop('format', None)
     addcf = kwds.pop('addcf', True)
+    parallel = kwds.pop('parallel', False)
     if format is None:
-        reader =  getreader(*args, format = format, **kwds)
+        reader =  getreader(*args, format = format, parallel = parallel, **kwds)
     else:
-        reader = getreaderdict()[format]
+        reader = _loadreader(format)
     
     outfile = reader(*args, **kwds)
     if addcf:
@@ -73,7 +383,7 @@ def pncopen(*args, **kwds):
 anyfile = pncopen
 
 def getreaderdict():
-    return dict(_readers)
+    return dict(_loadreaders())
     
 class TestPNCOPEN(unittest.TestCase):
     def runTest(self):
@@ -92,3 +402,121 @@ class TestPNCOPEN(unittest.TestCase):
             print('Test open unspecified ', path)
             f = pncopen(path)
 
+
+    def testGETREADERSNIFF(self):
+        import PseudoNetCDF.testcase
+        paths = PseudoNetCDF.testcase.self_described_paths
+        self.assert_('uamiv' in _sniff(paths['uamiv']))
+        self.assert_('point_source' in _sniff(paths['point_source']))
+        self.assert_('bpch' in _sniff(paths['bpch']))
+        self.assertEqual(_sniff(paths['ffi1001']), ['ffi1001'])
+
+    def testGETREADERCACHE(self):
+        import PseudoNetCDF.testcase
+        # formats that several readers share (e.g., humidity) may be
+        # found by another reader; these must be found by their own
+        ownreader = ('uamiv', 'point_source', 'lateral_boundary', 'bpch', 'ffi1001')
+        for format, path in PseudoNetCDF.testcase.self_described_paths.items():
+            _loadreader(format)(path)
+            _readercache.clear()
+            reader = getreader(path)
+            self.assert_(_ismine(reader, path))
+            if format in ownreader:
+                self.assert_(reader is _loadreader(format))
+            self.assert_(_readercache[_cachekey(path)] is reader)
+            self.assert_(getreader(path) is reader)
+            self.assert_(getreader(path, parallel = True) is reader)
+            _readercache.clear()
+            self.assert_(getreader(path, parallel = True) is reader)
+
+    def testGETREADERCACHESIZE(self):
+        import PseudoNetCDF.testcase
+        global _readercachesize
+        path = PseudoNetCDF.testcase.self_described_paths['uamiv']
+        oldsize = _readercachesize
+        _readercache.clear()
+        try:
+            _readercachesize = 2
+            _readercache[('a', 0, 0)] = None
+            _readercache[('b', 0, 0)] = None
+            reader = getreader(path)
+            self.assertEqual(list(_readercache.keys()), [('b', 0, 0), _cachekey(path)])
+            self.assert_(getreader(path) is reader)
+        finally:
+            _readercachesize = oldsize
+            _readercache.clear()
+
+    def testREADERTABLE(self):
+        import sys
+        import subprocess
+        # In a fresh interpreter, the readers registered by importing the
+        # built-in modules must match the table names, classes and order
+        script = '''
+import PseudoNetCDF._getreader as g
+g._loadreaders()
+registered = [(k, v) for k, v in g._readers[::-1] if v.__module__ not in g._unavailable]
+expected = [(k, g._loadreader(k)) for k, e in g._entrypoints if e.split(':')[0] not in g._unavailable]
+extra = [k for k, v in registered if k not in dict(expected)]
+missing = [k for k, v in expected if k not in dict(registered)]
+print(','.join(extra))
+print(','.join(missing))
+print(registered == expected)
+'''
+        env = dict(os.environ)
+        srcpath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join([srcpath] + [p for p in [env.get('PYTHONPATH')] if p])
+        out = subprocess.check_output([sys.executable, '-W', 'ignore', '-c', script], env = env)
+        extra, missing, same = (out.decode().split('\n') + ['', '', ''])[:3]
+        self.assertEqual(extra.strip(), '')
+        self.assertEqual(missing.strip(), '')
+        self.assertEqual(same.strip(), 'True')
+    
+    def testLAZYIMPORT(self):
+        import sys
+        import shutil
+        import subprocess
+        import tempfile
+        import PseudoNetCDF.testcase
+        # In a fresh interpreter, importing the package must not import
+        # format packages or their heavy dependencies; without a format,
+        # pncopen imports reader modules only until one opens the file
+        # (icarttfiles comes before geoschemfiles and camxfiles). The
+        # deferred imports must cost more than the package import
+        # itself (measured 0.2 s vs 0.4 s; the eager import took 0.6 s)
+        script = '''
+import sys
+import time
+t0 = time.time()
+import PseudoNetCDF
+t1 = time.time()
+print(','.join([k for k in ('pandas', 'matplotlib', 'PseudoNetCDF.camxfiles', 'PseudoNetCDF.geoschemfiles', 'PseudoNetCDF.icarttfiles', 'PseudoNetCDF.pncparse') if k in sys.modules]))
+for path in sys.argv[1:]:
+    f = PseudoNetCDF.pncopen(path)
+    print(type(f).__name__, ','.join([k for k in ('PseudoNetCDF.camxfiles', 'PseudoNetCDF.geoschemfiles', 'PseudoNetCDF.net_balance') if k in sys.modules]))
+if len(sys.argv) == 1:
+    t2 = time.time()
+    PseudoNetCDF._getreader.getreaderdict()
+    t3 = time.time()
+    print('PseudoNetCDF.camxfiles' in sys.modules)
+    print(t1 - t0 < t3 - t2)
+'''
+        env = dict(os.environ)
+        srcpath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join([srcpath] + [p for p in [env.get('PYTHONPATH')] if p])
+        out = subprocess.check_output([sys.executable, '-W', 'ignore', '-c', script], env = env)
+        heavy, loaded, faster = (out.decode().split('\n') + [''] * 3)[:3]
+        self.assertEqual(heavy.strip(), '')
+        self.assertEqual(loaded.strip(), 'True')
+        self.assertEqual(faster.strip(), 'True')
+        
+        hinted = PseudoNetCDF.testcase.self_described_paths['ffi1001']
+        tmpdir = tempfile.mkdtemp()
+        try:
+            unhinted = os.path.join(tmpdir, 'test.txt')
+            shutil.copy(hinted, unhinted)
+            out = subprocess.check_output([sys.executable, '-W', 'ignore', '-c', script, hinted, unhinted], env = env)
+        finally:
+            shutil.rmtree(tmpdir)
+        heavy, openhinted, openunhinted = (out.decode().split('\n') + [''] * 3)[:3]
+        self.assertEqual(openhinted.strip(), 'ffi1001')
+        self.assertEqual(openunhinted.strip(), 'ffi1001 PseudoNetCDF.net_balance')
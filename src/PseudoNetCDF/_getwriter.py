@@ -1,9 +1,15 @@
 __all__ = ['getwriterdict', 'registerwriter']
 
 import os
+from importlib import import_module
 from warnings import warn
 
 _writers = []
+
+# Built-in modules that register writers when imported
+_writermodules = ['PseudoNetCDF.camxfiles', 'PseudoNetCDF.geoschemfiles',
+                  'PseudoNetCDF.icarttfiles', 'PseudoNetCDF.textfiles',
+                  'PseudoNetCDF.noaafiles']
 def testwriter(writer, *args, **kwds):
     try:
         writer(*args, **kwds)
@@ -16,4 +22,9 @@ def registerwriter(name, writer):
     _writers.insert(0, (name, writer))
 
 def getwriterdict():
+    for modname in _writermodules:
+        try:
+            import_module(modname)
+        except ImportError as e:
+            warn('Writers from %s are unavailable; %s' % (modname, e))
     return dict(_writers)
\ No newline at end of file
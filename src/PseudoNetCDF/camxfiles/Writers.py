@@ -25,13 +25,13 @@ __all__ = ['cloud_rain',
     'wind',
     'lateral_boundary']
     
-from .uamiv.Write import ncf2uamiv
+from .uamiv.Write import ncf2uamiv, uamivwriter
 from .cloud_rain.Write import ncf2cloud_rain
 from .height_pressure.Write import ncf2height_pressure
 from .point_source.Write import ncf2point_source
 from .humidity.Write import ncf2humidity
 from .landuse.Write import ncf2landuse
-from .lateral_boundary.Write import ncf2lateral_boundary
+from .lateral_boundary.Write import ncf2lateral_boundary, lateral_boundarywriter
 from .temperature.Write import ncf2temperature
 from .wind.Write import ncf2wind
 from .vertical_diffusivity.Write import ncf2vertical_diffusivity
@@ -271,6 +271,29 @@ class TestMemmap(unittest.TestCase):
         new = open(outpath, 'rb').read()
         assert(orig == new)
         os.remove(outpath)    
+    
+    def testLBWriter(self):
+        import PseudoNetCDF.testcase
+        from PseudoNetCDF.camxfiles.lateral_boundary.Write import lateral_boundarywriter, _emiss_hdr_fmt
+        import numpy as np
+        import os
+        inpath = PseudoNetCDF.testcase.camxfiles_paths['lateral_boundary']
+        outpath = inpath + '.stream'
+        infile = lateral_boundary(inpath)
+        varkeys = [k for k in infile.variables.keys() if k.split('_')[0] in ('WEST', 'EAST', 'SOUTH', 'NORTH')]
+        try:
+            writer = lateral_boundarywriter(infile, outpath)
+            for di, tflag in enumerate(infile.variables['TFLAG'][:, 0]):
+                writer.append(dict([(k, infile.variables[k][di]) for k in varkeys]), tflag)
+            writer.close()
+            self.assert_(open(inpath, 'rb').read() == open(outpath, 'rb').read())
+            
+            with lateral_boundarywriter(infile, outpath, tstep = 3000) as writer:
+                writer.append(dict([(k, infile.variables[k][0]) for k in varkeys]), [2002154, 10000])
+            emiss_hdr = np.fromfile(outpath, dtype = _emiss_hdr_fmt, count = 1)[0]
+            self.assert_(emiss_hdr['iedate'] == 2154 and emiss_hdr['etime'] == np.float32(1.3))
+        finally:
+            os.remove(outpath)
        
        
 if __name__ == '__main__':
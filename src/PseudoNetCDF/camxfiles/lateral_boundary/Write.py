@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 import numpy as np
+from PseudoNetCDF.camxfiles.util import timeheaders
 _emiss_hdr_fmt=np.dtype(dict(names=['SPAD','name','note','itzon','nspec','ibdate','btime','iedate','etime','EPAD'],formats=['>i','(10,4)>S1','(60,4)>S1','>i','>i','>i','>f','>i','>f','>i']))
 
 _grid_hdr_fmt=np.dtype(dict(names=['SPAD','plon','plat','iutm','xorg','yorg','delx','dely','nx','ny','nz','iproj','istag','tlat1','tlat2','rdum5','EPAD'],formats=['>i','>f','>f','>i','>f','>f','>f','>f','>i','>i','>i','>i','>i','>f','>f','>f','>i']))
@@ -10,7 +11,14 @@ _time_hdr_fmt=np.dtype(dict(names=['SPAD','ibdate','btime','iedate','etime','EPA
 
 _spc_fmt=np.dtype("(10,4)>S1")
 
-def ncf2lateral_boundary(ncffile, outpath):
+_edges = [('WEST', 1), ('EAST', 2), ('SOUTH', 3), ('NORTH', 4)]
+
+def _lateral_boundary_headers(ncffile):
+    """
+    Return the emiss, grid, cell and species header records, species
+    names (S10) and boundary definition bytes for a lateral_boundary
+    file with the properties of ncffile (see ncf2lateral_boundary)
+    """
     emiss_hdr = np.zeros(shape = (1,), dtype = _emiss_hdr_fmt)
     emiss_hdr[0]['name'][:, :] = ' '
     emiss_hdr[0]['name'][:, 0] = np.array(ncffile.NAME, dtype = '>c')
@@ -18,13 +26,10 @@ def ncf2lateral_boundary(ncffile, outpath):
     emiss_hdr[0]['note'][:, 0] = np.array(ncffile.NOTE, dtype = '>c')
     gdtype = getattr(ncffile, 'GDTYPE', -999)
     emiss_hdr['itzon'][0] = ncffile.ITZON
-    nspec = len(ncffile.dimensions['VAR']) / 4
+    nspec = len(ncffile.dimensions['VAR']) // 4
     emiss_hdr['nspec'] = nspec
-    emiss_hdr['ibdate'] = ncffile.SDATE%(ncffile.SDATE/100000*100000)
+    emiss_hdr['ibdate'] = ncffile.SDATE%(ncffile.SDATE//100000*100000)
     emiss_hdr['btime'] = ncffile.STIME / 100.
-    EDATE, ETIME = ncffile.variables['TFLAG'][-1,0,:]
-    emiss_hdr['iedate'] = EDATE%(EDATE/100000*100000)
-    emiss_hdr['etime'] = ETIME / 10000. + 1.
     emiss_hdr['SPAD'] = _emiss_hdr_fmt.itemsize - 8
     emiss_hdr['EPAD'] = _emiss_hdr_fmt.itemsize - 8
     
@@ -57,26 +62,6 @@ def ncf2lateral_boundary(ncffile, outpath):
     cell_hdr['nx'] = grid_hdr['nx']
     cell_hdr['ny'] = grid_hdr['ny']
 
-    time_hdr = np.zeros(shape = (len(ncffile.dimensions['TSTEP']),), dtype = _time_hdr_fmt)
-    time_hdr['SPAD'] = 16
-    time_hdr['EPAD'] = 16
-    date, time = ncffile.variables['TFLAG'][:, 0].T
-    time = time.astype('>f') / 10000.
-    date = date%(date//100000*100000)
-    time_hdr['ibdate'] = date
-    time_hdr['btime'] = time
-    time_hdr['iedate'] = date
-    time_hdr['etime'] = time + 1.
-    time_hdr['iedate'] += (time_hdr['etime'] // 24).astype('i')
-    time_hdr['etime'] -= (time_hdr['etime'] // 24) * 24
-    emiss_hdr['ibdate'] = time_hdr['ibdate'][0]
-    emiss_hdr['btime'] = time_hdr['btime'][0]
-    emiss_hdr['iedate'] = time_hdr['iedate'][-1]
-    emiss_hdr['etime'] = time_hdr['etime'][-1]
-    emiss_hdr['SPAD'] = _emiss_hdr_fmt.itemsize - 8
-    emiss_hdr['EPAD'] = _emiss_hdr_fmt.itemsize - 8
-    
-    
     spc_hdr = np.zeros(shape = (1,), dtype = dict(names = ['SPAD1', 'DATA', 'EPAD1'], formats = ['>i', np.dtype("(%d,10,4)>S1" % nspec), '>i']))
     spc_hdr['SPAD1'] = nspec * 40
     spc_hdr['EPAD1'] = nspec * 40
@@ -84,15 +69,11 @@ def ncf2lateral_boundary(ncffile, outpath):
     spc_hdr[0]['DATA'][:] = ' '
     spc_hdr[0]['DATA'][:, :, 0] = spc_names
     spc_names = spc_names.view('>S10')
-    nz = len(ncffile.dimensions['LAY'])
-    outfile = open(outpath, 'wb')
-    emiss_hdr.tofile(outfile)
-    grid_hdr.tofile(outfile)
-    cell_hdr.tofile(outfile)
-    spc_hdr.tofile(outfile)
-    for ename, ei in [('WEST', 1), ('EAST', 2), ('SOUTH', 3), ('NORTH', 4)]:
+    
+    boundary_defs = b''
+    for ename, ei in _edges:
         if hasattr(ncffile, '_boundary_def'):
-            ncffile._boundary_def[ename].tofile(outfile)
+            boundary_defs += ncffile._boundary_def[ename].tobytes()
         else:
             nbcell = dict(WEST = NROWS, EAST = NROWS,
                           SOUTH = NCOLS, NORTH = NCOLS)[ename]
@@ -104,18 +85,57 @@ def ncf2lateral_boundary(ncffile, outpath):
             elif ename == 'NORTH':
                 icell = NROWS - 1
             else: raise KeyError('WEST, EAST, SOUTH, or NORTH: received %s' % ename)
-            np.array([buf, 1, ei, nbcell, 0, 0, 0, 0] + [icell, 0, 0, 0] * (nbcell - 2) + [0, 0, 0, 0, buf]).astype('>i').tofile(outfile)
-    try:
-        from io import BytesIO
-    except:
-        from StringIO import StringIO as BytesIO
-    for di, (d, t) in enumerate(ncffile.variables['TFLAG'][:, 0]):
-        tempout = b''
-        tempout += time_hdr[di].tobytes()
-        for spc_key, spc_name in zip(spc_names, spc_hdr[0]['DATA']):
-            for ename, ei in [('WEST', 1), ('EAST', 2), ('SOUTH', 3), ('NORTH', 4)]:
-                var = ncffile.variables[ename + '_' + spc_key[0].decode().strip()]
-                data = var[di].astype('>f')
+            boundary_defs += np.array([buf, 1, ei, nbcell, 0, 0, 0, 0] + [icell, 0, 0, 0] * (nbcell - 2) + [0, 0, 0, 0, buf]).astype('>i').tobytes()
+    return emiss_hdr, grid_hdr, cell_hdr, spc_hdr, spc_names, boundary_defs
+
+class lateral_boundarywriter(object):
+    """
+    lateral_boundarywriter writes a lateral_boundary file one time step
+    at a time. Headers and boundary definitions are written when the
+    writer is created and the file header end date is updated to the
+    last appended step by flush and close.
+    
+    ex:
+        >>> writer = lateral_boundarywriter(template, 'out.lateral_boundary')
+        >>> for tflag, edgevals in steps:
+        ...     writer.append(edgevals, tflag)
+        >>> writer.close()
+    """
+    def __init__(self, ncffile, outpath, tstep = None):
+        """
+        ncffile - PseudoNetCDF-like object with the properties of a
+                  lateral_boundary file (see ncf2lateral_boundary); only
+                  metadata is used
+        outpath - path to create
+        tstep - HHMMSS duration of steps appended without etflag
+                (default ncffile.TSTEP or 10000)
+        """
+        if tstep is None:
+            tstep = getattr(ncffile, 'TSTEP', 10000)
+        self.tstep = tstep
+        self.emiss_hdr, grid_hdr, cell_hdr, self.spc_hdr, self.spc_names, boundary_defs = _lateral_boundary_headers(ncffile)
+        self.spc_keys = [spc_key[0].decode().strip() for spc_key in self.spc_names]
+        self.nsteps = 0
+        self.outpath = outpath
+        self.outfile = open(outpath, 'wb')
+        self.emiss_hdr.tofile(self.outfile)
+        grid_hdr.tofile(self.outfile)
+        cell_hdr.tofile(self.outfile)
+        self.spc_hdr.tofile(self.outfile)
+        self.outfile.write(boundary_defs)
+    
+    def append(self, values, tflag, etflag = None):
+        """
+        values - mapping of edge species keys (e.g., WEST_O3) to one time
+                 step of values (e.g., variables of a one step file)
+        tflag - (YYYYJJJ, HHMMSS) start of the step
+        etflag - (YYYYJJJ, HHMMSS) end of the step (default tflag + tstep)
+        """
+        time_hdr = timeheaders(tflag, etflag, self.tstep)
+        tempout = time_hdr[0].tobytes()
+        for spc_key, spc_name in zip(self.spc_keys, self.spc_hdr[0]['DATA']):
+            for ename, ei in _edges:
+                data = np.asarray(values[ename + '_' + spc_key]).astype('>f')
                 buf = np.array(4+40+4+data.size*4).astype('>i')
                 tempout += buf.tobytes()
                 tempout += np.array(1).astype('>i').tobytes()
@@ -123,9 +143,40 @@ def ncf2lateral_boundary(ncffile, outpath):
                 tempout += np.array(ei).astype('>i').tobytes()
                 tempout += data.tobytes()
                 tempout += buf.tobytes()
-        outfile.write(tempout)
-    outfile.flush()
-    return outfile
+        self.outfile.write(tempout)
+        if self.nsteps == 0:
+            self.emiss_hdr['ibdate'] = time_hdr['ibdate'][0]
+            self.emiss_hdr['btime'] = time_hdr['btime'][0]
+        self.emiss_hdr['iedate'] = time_hdr['iedate'][0]
+        self.emiss_hdr['etime'] = time_hdr['etime'][0]
+        self.nsteps += 1
+    
+    def flush(self):
+        """
+        Write the file header with current dates and flush the file
+        """
+        self.outfile.seek(0, 0)
+        self.emiss_hdr.tofile(self.outfile)
+        self.outfile.seek(0, 2)
+        self.outfile.flush()
+    
+    def close(self):
+        self.flush()
+        self.outfile.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+
+def ncf2lateral_boundary(ncffile, outpath):
+    writer = lateral_boundarywriter(ncffile, outpath)
+    varkeys = [ename + '_' + spc_key for spc_key in writer.spc_keys for ename, ei in _edges]
+    for di, tflag in enumerate(ncffile.variables['TFLAG'][:, 0]):
+        writer.append(dict([(varkey, ncffile.variables[varkey][di]) for varkey in varkeys]), tflag)
+    writer.flush()
+    return writer.outfile
 
 from PseudoNetCDF._getwriter import registerwriter
 registerwriter('camxfiles.lateral_boundary', ncf2lateral_boundary)
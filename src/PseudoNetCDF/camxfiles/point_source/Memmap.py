@@ -29,8 +29,10 @@ import numpy as np
 #This Package modules
 from PseudoNetCDF.camxfiles.timetuple import timediff,timeadd
 from PseudoNetCDF.camxfiles.FortranFileUtil import OpenRecordFile
+from PseudoNetCDF.camxfiles.util import loadindex, saveindex
 from PseudoNetCDF.sci_var import PseudoNetCDFFile, PseudoNetCDFVariable, PseudoNetCDFVariables
 from PseudoNetCDF.ArrayTransforms import ConvertCAMxTime
+from PseudoNetCDF.core._variables import PseudoNetCDFLazyVariable
 
 #for use in identifying uncaught nan
 listnan=struct.unpack('>f',b'\xff\xc0\x00\x00')[0]
@@ -38,6 +40,42 @@ checkarray=zeros((1,),'f')
 checkarray[0]=listnan
 array_nan=checkarray[0]
 
+def _hour_block_fmt(nspec, nstk, ep = '>'):
+    """
+    Return the dtype of one hour of point_source data: the time header,
+    stack count, hourly stack properties (PROPS) and one emission record
+    per species (SPC0, SPC1, ...; ep is the endian prefix)
+    """
+    i, f = ep + 'i', ep + 'f'
+    date_fmt = dtype(dict(names=['SPAD','IBDATE','BTIME','IEDATE','ETIME','EPAD'],formats=[i,i,f,i,f,i]))
+    nstk_fmt = dtype(dict(names=['SPAD','IONE','NSTK','EPAD'],formats=[i,i,i,i]))
+    stk_time_prop_fmt = dtype(dict(names=['IONE','ITWO','KCELL','FLOW','PLMHT'],formats=[i,i,i,f,f]))
+    props_fmt = dtype([('SPAD', i), ('DATA', stk_time_prop_fmt, (nstk,)), ('EPAD', i)])
+    spc_fmt = dtype([('SPAD', i), ('IONE', i), ('SPC', ep + 'S1', (10, 4)), ('DATA', f, (nstk,)), ('EPAD', i)])
+    return dtype([('DATE', date_fmt), ('NSTK', nstk_fmt), ('PROPS', props_fmt)] + [('SPC%d' % si, spc_fmt) for si in range(nspec)])
+
+class _stkvariable(PseudoNetCDFLazyVariable):
+    """
+    Read-only hourly point_source variable (TSTEP, NSTK); indexing reads
+    only the selected hours and stacks from the file records and returns
+    native-endian values (e.g., v[:, stkidx] is a stack time series)
+    """
+    def __init__(self, parent, name, values, **props):
+        self._parent = parent
+        self._name = name
+        self._values = values
+        self.dimensions = ('TSTEP', 'NSTK')
+        self.shape = values.shape
+        self.dtype = values.dtype.newbyteorder('=')
+        for k, v in props.items():
+            setattr(self, k, v)
+    
+    def _getitem(self, item):
+        out = self._values[item]
+        if isinstance(out, np.ndarray):
+            out = np.array(out, dtype = self.dtype)
+        return self._wrap(out)
+
 class point_source(PseudoNetCDFFile):
     """
     point_source provides a PseudoNetCDF interface for CAMx
@@ -71,6 +109,8 @@ class point_source(PseudoNetCDFFile):
         >>> point_sourcefile.dimensions
         {'TSTEP': 25, 'NSTK': 38452}
     """
+    # variables are read from the memory map
+    threadsafe = True
     @classmethod
     def isMine(cls, path):
         try:
@@ -78,14 +118,20 @@ class point_source(PseudoNetCDFFile):
             return True
         except:
             return False
-    def __init__(self, rf, endian = 'big', mode = 'r', **kwds):
+    def __init__(self, rf, endian = 'big', mode = 'r', index = False, **kwds):
         """
         Initialization included reading the header and learning
         about the format.
         
+        index - if True (rf + '.pncidx') or a path, hourly dates and stack
+                counts are read from a sidecar index that is (re)written
+                when missing or when rf has changed (see camxfiles.util)
+        
         see __readheader and __gettimestep() for more info
         """
         self.__rffile=rf
+        self.__index = index
+        self.__mode = mode
 
         ep = self.__endianprefix = dict(big = '>', little = '<')[endian]
         self.variables={}
@@ -160,6 +206,7 @@ class point_source(PseudoNetCDFFile):
         spc_names=[np.char.strip(spc[:,0].copy().view('S10'))[0] for spc in self.__spc_hdr]
         spc_names=[spc.decode() if hasattr(spc, 'decode') else spc for spc in spc_names]
         self.__spc_names = spc_names
+        self.__spc_ids = dict([(spc, si) for si, spc in enumerate(spc_names)])
         self.__nstk_hdr=self.__memmap[offset:offset+self.__nstk_hdr_fmt.itemsize//4].view(self.__nstk_hdr_fmt)
         offset+=self.__nstk_hdr.nbytes//4+1
         assert((self.__nstk_hdr['SPAD'] == self.__nstk_hdr['EPAD']).all())
@@ -178,43 +225,33 @@ class point_source(PseudoNetCDFFile):
         self.ETIME=self.__emiss_hdr['etime']
         
     def __getspcidx(self,spc):
-        return self.__spc_names.index(spc)
+        return self.__spc_ids[spc]
 
     def __time_stks(self):
         ep = self.__endianprefix
-        i=offset=0
         nspcs=len(self.__spc_names)
         nstks=len(self.dimensions['NSTK'])
-        date_block_size=6
-        stk_block_size=4
-        stk_props_size=2+nstks*5
-        emiss_block_size=nspcs*(nstks+13)
-        hour_block_size=date_block_size+stk_block_size+stk_props_size+emiss_block_size
+        hour_fmt = _hour_block_fmt(nspcs, nstks, ep)
         data=self.__memmap[self.__data_start:]
-        data=data.reshape(data.size//hour_block_size,hour_block_size)
-        ntimes=data.shape[0]
+        if (data.size * 4) % hour_fmt.itemsize != 0:
+            raise ValueError("Incorrect shape")
+        # one record per hour; fields are views, so nothing is read here
+        self.__hours = data.view(hour_fmt)
+        ntimes=self.__hours.shape[0]
         self.createDimension('TSTEP',ntimes)
         self.createDimension('DATE-TIME', 2)
-        start=0
-        end=date_block_size
-        date_times=data[:,start:end]
-        dates=date_times[:,[1,3]].view(ep+'i')
-        times=date_times[:,[2,4]]
-        
-        start=end
-        end=start+stk_block_size
-        nstk_hdr=data[:,start:end].view(ep+'i')
-        if not (nstks==nstk_hdr[:,2:3]).all():
-            raise ValueError("Number of stacks varies with time")
-        start=end
-        end=start+stk_props_size
-        self.__hourly_stk_props=data[:,start:end][:,1:-1].reshape(ntimes,nstks,5)
-        
-        start=end
-        end=start+emiss_block_size
-        if not end==data.shape[1]:
-            raise ValueError("Incorrect shape")
-        self.__emiss_data=data[:,start:].reshape(ntimes,nspcs,13+nstks)[:,:,12:-1]
+        stkindex = None if not self.__index else loadindex(self.__rffile, 'point_source', self.__index)
+        if stkindex is None:
+            date_times = self.__hours['DATE']
+            dates = np.array([date_times['IBDATE'], date_times['IEDATE']]).T
+            times = np.array([date_times['BTIME'], date_times['ETIME']]).T
+            hourly_nstks = np.array(self.__hours['NSTK']['NSTK'])
+            if not (nstks==hourly_nstks).all():
+                raise ValueError("Number of stacks varies with time")
+            if self.__index:
+                saveindex(self.__rffile, 'point_source', self.__index, DATES = dates, TIMES = times, NSTKS = hourly_nstks)
+        else:
+            dates, times, hourly_nstks = stkindex['DATES'], stkindex['TIMES'], stkindex['NSTKS']
         bdates=dates[:,0]
         btimes=times[:,0]
         edates=dates[:,1]
@@ -225,7 +262,7 @@ class point_source(PseudoNetCDFFile):
         
         self.variables['TFLAG']=ConvertCAMxTime(bdates,btimes,len(self.dimensions['VAR']))
         self.variables['ETFLAG']=ConvertCAMxTime(edates,etimes,len(self.dimensions['VAR']))
-        v=self.variables['NSTKS']=PseudoNetCDFVariable(self,'NSTKS','i',('TSTEP',),values=array(nstk_hdr[:, 2]))
+        v=self.variables['NSTKS']=PseudoNetCDFVariable(self,'NSTKS','i',('TSTEP',),values=array(hourly_nstks))
         v.units='#'.ljust(16)
         v.long_name='NSTKS'.ljust(16)
         v.var_desc=v.long_name
@@ -240,22 +277,87 @@ class point_source(PseudoNetCDFFile):
             v.var_desc=k.ljust(16)
             return v
         elif k in ['IONE', 'ITWO', 'KCELL','FLOW','PLMHT']:
-            data_type={'IONE':'i', 'ITWO':'i', 'KCELL':'i','FLOW':'f','PLMHT':'f'}[k]
-            v=self.createVariable(k,data_type,('TSTEP','NSTK'))
-            v.units={'IONE':'#', 'ITWO':'#', 'KCELL':'#', 'FLOW':'m**3/hr', 'PLMHT':'m'}[k]
-            v.long_name=k.ljust(16)
-            v.var_desc=k.ljust(16)
-            vals = self.__hourly_stk_props[:,:,['IONE','ITWO','KCELL','FLOW','PLMHT'].index(k)]
-            v[:] = vals.view('>' + data_type)
-            return v
-        elif k in self.__spc_names:
-            v=PseudoNetCDFVariable(self,k,'f',('TSTEP','NSTK'),values=self.__emiss_data[:,self.__getspcidx(k),:])
-            v.units='mole/hr'.ljust(16)
-            v.long_name=k.ljust(16)
-            v.var_desc=k.ljust(16)
-            return v
+            units={'IONE':'#', 'ITWO':'#', 'KCELL':'#', 'FLOW':'m**3/hr', 'PLMHT':'m'}[k]
+            vals = self.__hours['PROPS']['DATA'][k]
+        elif k in self.__spc_ids:
+            units='mole/hr'.ljust(16)
+            vals = self.__hours['SPC%d' % self.__getspcidx(k)]['DATA']
         else:
             raise KeyError("Unknown key %s" % k)
+        if self.__mode == 'r':
+            return _stkvariable(self, k, vals, units = units, long_name = k.ljust(16), var_desc = k.ljust(16))
+        v=PseudoNetCDFVariable(self,k,vals.dtype.char,('TSTEP','NSTK'),values=vals)
+        v.units=units
+        v.long_name=k.ljust(16)
+        v.var_desc=k.ljust(16)
+        return v
+    
+    def stackcells(self):
+        """
+        Returns:
+           row, col - 0-based grid cell of each stack from XSTK and YSTK
+                      (same units as XORIG/XCELL); stacks outside the
+                      grid have -1 for both
+        """
+        col = np.floor((self.__stk_props['XSTK'].ravel() - self.XORIG) / self.XCELL).astype('i')
+        row = np.floor((self.__stk_props['YSTK'].ravel() - self.YORIG) / self.YCELL).astype('i')
+        outside = (col < 0) | (col >= self.NCOLS) | (row < 0) | (row >= self.NROWS)
+        col[outside] = -1
+        row[outside] = -1
+        return row, col
+    
+    def findstacks(self, **ranges):
+        """
+        Arguments:
+           ranges - key = (min, max) for stack properties (XSTK, YSTK, HSTK,
+                    DSTK, TSTK, VSTK) or hourly variables (e.g., PLMHT,
+                    FLOW, NO); None leaves that side open. Hourly variables
+                    match if any hour is within the range.
+        Returns:
+           stkidx - indices of stacks that match all ranges
+        
+        ex:
+            >>> # stacks in a window with plumes reaching 500 m
+            >>> stkidx = psfile.findstacks(XSTK = (x0, x1), YSTK = (y0, y1), PLMHT = (500, None))
+            >>> psfile.variables['NO'][:, stkidx]
+        """
+        match = np.ones(len(self.dimensions['NSTK']), dtype = 'bool')
+        for k, (lo, hi) in ranges.items():
+            # (NSTK,) or (TSTEP, NSTK) values; a stack matches if any
+            # hour is within the range
+            vals = np.asarray(self.variables[k][...])
+            inrange = np.ones(vals.shape, dtype = 'bool')
+            if lo is not None:
+                inrange &= vals >= lo
+            if hi is not None:
+                inrange &= vals <= hi
+            match &= inrange.reshape(-1, match.size).any(0)
+        return np.flatnonzero(match)
+    
+    def gridemissions(self, key, tidx = slice(None), stkidx = None):
+        """
+        Arguments:
+           key - species (or other hourly variable) to sum
+           tidx - hours to include
+           stkidx - stacks to include (default all; see findstacks)
+        Returns:
+           out - (TSTEP, ROW, COL) sum of key for stacks in each grid cell
+                 (see stackcells); stacks outside the grid are ignored
+        """
+        var = self.variables[key]
+        row, col = self.stackcells()
+        inside = row >= 0
+        if stkidx is not None:
+            inside[np.setdiff1d(np.arange(inside.size), stkidx)] = False
+        stks = np.flatnonzero(inside)
+        ncells = int(self.NROWS) * int(self.NCOLS)
+        cells = row[stks] * int(self.NCOLS) + col[stks]
+        times = np.atleast_1d(np.arange(var.shape[0])[tidx])
+        vals = np.asarray(var[times])[:, stks]
+        # one sum over flattened (time, cell) bins
+        bins = (np.arange(times.size)[:, None] * ncells + cells).ravel()
+        out = np.bincount(bins, weights = vals.ravel(), minlength = times.size * ncells)
+        return out.astype(var.dtype).reshape(times.size, int(self.NROWS), int(self.NCOLS))
 
 class TestMemmap(unittest.TestCase):
     def runTest(self):
@@ -269,6 +371,46 @@ class TestMemmap(unittest.TestCase):
         v = emissfile.variables['NO2']
         self.assert_((v[:] == np.array([  0.00000000e+00, 3.12931000e+02, 1.23599997e+01, 0.00000000e+00, 5.27999992e+01, 0.00000000e+00, 3.12931000e+02, 1.23599997e+01, 0.00000000e+00, 5.27999992e+01], dtype = 'f').reshape(2,5)).all())
 
+    def testStacks(self):
+        import PseudoNetCDF.testcase
+        emissfile=point_source(PseudoNetCDF.testcase.camxfiles_paths['point_source'])
+        v = emissfile.variables['NO2']
+        self.assert_(v[:].dtype.isnative and v.shape == (2, 5))
+        self.assert_(v[:].units == v.units and v[:, 1].dimensions == v.dimensions)
+        self.assert_(type(v[:].array()) is np.ndarray and v[0, 1] == v[:].array()[0, 1])
+        self.assert_((v[:, 1] == np.array([312.931, 312.931], dtype = 'f')).all())
+        self.assert_((emissfile.variables['KCELL'][:] == 1).all())
+        self.assert_(emissfile.findstacks(HSTK = (None, 20)).tolist() == [0])
+        self.assert_(emissfile.findstacks(XSTK = (9e5, 1.3e6), PLMHT = (50, None)).tolist() == [1, 4])
+        row, col = emissfile.stackcells()
+        self.assert_(row.tolist() == [20, 24, 11, 42, 44] and col.tolist() == [48, 49, 62, 38, 56])
+        gridded = emissfile.gridemissions('NO2')
+        self.assert_(gridded.shape == (2, emissfile.NROWS, emissfile.NCOLS))
+        self.assert_(gridded[1, 24, 49] == v[1, 1] and np.allclose(gridded.sum((1, 2)), v[:].sum(1)))
+        self.assert_(emissfile.gridemissions('NO2', tidx = [1], stkidx = [4]).sum() == v[1, 4])
+        self.assert_((emissfile.gridemissions('NO2', tidx = 1) == gridded[[1]]).all())
+        self.assert_(emissfile.gridemissions('NO2', stkidx = []).sum() == 0)
+        self.assert_(emissfile.findstacks(NO2 = (300, None), KCELL = (1, 1)).tolist() == [1])
+
+    def testIndex(self):
+        import os, shutil, tempfile
+        import PseudoNetCDF.testcase
+        from PseudoNetCDF.camxfiles.util import loadindex
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'test.point_source')
+            shutil.copy(PseudoNetCDF.testcase.camxfiles_paths['point_source'], path)
+            indexpath = os.path.join(tmpdir, 'other.pncidx')
+            nofile = point_source(path)
+            first = point_source(path, index = indexpath)
+            self.assert_(os.path.exists(indexpath))
+            self.assert_(loadindex(path, 'point_source', indexpath)['NSTKS'].tolist() == [5, 5])
+            second = point_source(path, index = indexpath)
+            for k in ('TFLAG', 'ETFLAG', 'NSTKS', 'NO2', 'FLOW'):
+                self.assert_((second.variables[k][:] == nofile.variables[k][:]).all())
+        finally:
+            shutil.rmtree(tmpdir)
+
     def testNCF2PT(self):
         import PseudoNetCDF.testcase
         from PseudoNetCDF.pncgen import pncgen
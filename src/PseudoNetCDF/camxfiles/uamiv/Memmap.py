@@ -21,19 +21,72 @@ __version__ = RevisionNum
 import unittest
 import struct
 from warnings import warn
+from collections import OrderedDict
+from threading import Lock
 
 #Site-Packages
-from numpy import zeros, array, where, memmap, newaxis, dtype, nan, linspace
+from numpy import zeros, array, where, memmap, newaxis, dtype, nan, linspace, arange, atleast_1d, broadcast_to, empty, ascontiguousarray, integer
 
 #This Package modules
 from PseudoNetCDF.camxfiles.timetuple import timediff, timeadd
 from PseudoNetCDF.camxfiles.FortranFileUtil import OpenRecordFile
+from PseudoNetCDF.camxfiles.util import loadindex, saveindex
 from PseudoNetCDF.sci_var import PseudoNetCDFFile, PseudoIOAPIVariable, PseudoNetCDFVariables
 from PseudoNetCDF.ArrayTransforms import ConvertCAMxTime
 from PseudoNetCDF.camxfiles.units import get_uamiv_units, get_chemparam_names
 from PseudoNetCDF.conventions.ioapi import add_cf_from_ioapi
+from PseudoNetCDF.core._variables import PseudoNetCDFLazyVariable
 #for use in identifying uncaught nan
 
+def _data_block_fmt(var_names, nz, ny, nx, ep = '>'):
+    """
+    Return the dtype of one time step of uamiv data: a DATE record
+    followed by nz layer records (SPAD, IONE, SPC, DATA, EPAD) for each
+    species in var_names (ep is the endian prefix)
+    """
+    date_time_fmt=dtype(dict(names=['SPAD', 'BDATE', 'BTIME', 'EDATE', 'ETIME', 'EPAD'], formats=[ep + 'i', ep + 'i', ep + 'f', ep + 'i', ep + 'f', ep + 'i']))
+    spc_1_lay_fmt=dtype(dict(names=['SPAD', 'IONE', 'SPC', 'DATA', 'EPAD'], formats=[ep + 'i', ep + 'i', '(10,4)%sS1' % ep, '(%d,%d)%sf' % (ny, nx, ep), ep + 'i']))
+    spc_3d_fmt=dtype((spc_1_lay_fmt, (nz,)))
+    return dtype(dict(names=['DATE']+list(var_names), formats=[date_time_fmt]+[spc_3d_fmt]*len(var_names)))
+
+class _uamivvariable(PseudoNetCDFLazyVariable):
+    """
+    Read-only uamiv species variable with native-endian float32 values.
+    Indexing reads only the selected time steps; each (species, time)
+    slab is converted from the interleaved file records once and kept in
+    the parent's slab cache (see uamiv.cachebytes). Reads of a subset of
+    layers convert only those layers unless the slab is already cached.
+    Items with index arrays are applied to all values so that numpy
+    places the advanced dimensions.
+    """
+    def __init__(self, parent, name, **props):
+        self._parent = parent
+        self._name = name
+        self.dimensions = ('TSTEP', 'LAY', 'ROW', 'COL')
+        self.shape = tuple([len(parent.dimensions[dk]) for dk in self.dimensions])
+        self.dtype = dtype('f')
+        for k, v in props.items():
+            setattr(self, k, v)
+    
+    def _getitem(self, item):
+        item = self._expanditem(item)
+        if len(item) != self.ndim or \
+           any([i is None or not isinstance(i, (slice, int, integer)) for i in item]):
+            return self[...][item]
+        tidx = arange(self.shape[0])[item[0]]
+        rest = item[1:]
+        alllayers = isinstance(rest[0], slice) and rest[0] == slice(None)
+        restshape = broadcast_to(0, self.shape[1:])[rest].shape
+        out = empty((atleast_1d(tidx).size,) + restshape, dtype = self.dtype)
+        for oi, ti in enumerate(atleast_1d(tidx)):
+            slab = self._parent._getslab(self._name, ti, cache = alllayers)
+            if slab is None:
+                slab = self._parent._rawslab(self._name, ti)
+            out[oi] = slab[rest]
+        if tidx.ndim == 0:
+            out = out[0]
+        return self._wrap(out)
+
 class uamiv(PseudoNetCDFFile):
     """
     uamiv provides a PseudoNetCDF interface for CAMx
@@ -67,6 +120,11 @@ class uamiv(PseudoNetCDFFile):
     __ione=1
     __idum=0
     __rdum=0.
+    # maximum bytes of native-endian (species, time) slabs kept per file
+    cachebytes = 2**28
+    # variables are read from the memory map and the slab cache is
+    # updated under a lock
+    threadsafe = True
     def _make_header_fmt(self, ep = None):
         if ep is None:
             ep = self.__endianprefix
@@ -76,13 +134,24 @@ class uamiv(PseudoNetCDFFile):
         self.__time_hdr_fmt=dtype(dict(names=['SPAD', 'ibdate', 'btime', 'iedate', 'etime', 'EPAD'], formats=[ep + 'i', ep + 'i', ep + 'f', ep + 'i', ep + 'f', ep + 'i']))
         self.__spc_fmt=dtype("(10,4)%sS1" % ep)
             
-    def __init__(self, rf, mode='r', P_ALP = None, P_BET = None, P_GAM = None, XCENT = None, YCENT = None, GDTYP = None, endian = 'big', chemparam = None):
+    def __init__(self, rf, mode='r', P_ALP = None, P_BET = None, P_GAM = None, XCENT = None, YCENT = None, GDTYP = None, endian = 'big', chemparam = None, cachebytes = None, index = False):
         """
         Initialization included reading the header and learning
         about the format.
         
+        cachebytes - bytes of converted species slabs to keep (default
+                     uamiv.cachebytes; 0 disables the cache)
+        index - if True (rf + '.pncidx') or a path, species names and time
+                flags are read from a sidecar index that is (re)written
+                when missing or when rf has changed (see camxfiles.util)
+        
         see __readheader and __gettimestep() for more info
         """
+        if cachebytes is not None:
+            self.cachebytes = cachebytes
+        self._slabcache = OrderedDict()
+        self._slabcachebytes = 0
+        self._slabcachelock = Lock()
         if chemparam is None:
             self._aerosol_names = None
         else:
@@ -92,6 +161,7 @@ class uamiv(PseudoNetCDFFile):
         self._make_header_fmt()
         self.__rffile=rf
         self.__mode=mode
+        self.__index = None if not index else loadindex(rf, 'uamiv', index)
         
         self.createDimension('DATE-TIME', 2)
 
@@ -116,8 +186,14 @@ class uamiv(PseudoNetCDFFile):
         self.FILEDESC = "CAMx            ";
         # Create variables
         self.variables=PseudoNetCDFVariables(self.__variables, ['TFLAG', 'ETFLAG'] + self.__var_names__)
-        tflag = ConvertCAMxTime(self.__memmap__['DATE']['BDATE'], self.__memmap__['DATE']['BTIME'], self.NVARS)
-        etflag = ConvertCAMxTime(self.__memmap__['DATE']['EDATE'], self.__memmap__['DATE']['ETIME'], self.NVARS)
+        if self.__index is None:
+            dates = dict([(dk, array(self.__memmap__['DATE'][dk])) for dk in ('BDATE', 'BTIME', 'EDATE', 'ETIME')])
+            if index:
+                saveindex(rf, 'uamiv', index, VARNAMES = self.__var_names__, **dates)
+        else:
+            dates = self.__index
+        tflag = ConvertCAMxTime(dates['BDATE'], dates['BTIME'], self.NVARS)
+        etflag = ConvertCAMxTime(dates['EDATE'], dates['ETIME'], self.NVARS)
         tflagv = self.createVariable('TFLAG', 'i', ('TSTEP', 'VAR', 'DATE-TIME'), values = tflag, units = 'DATE-TIME', long_name = 'TFLAG'.ljust(16), var_desc = 'TFLAG'.ljust(80))
         etflagv = self.createVariable('ETFLAG', 'i', ('TSTEP', 'VAR', 'DATE-TIME'), values = etflag, units = 'DATE-TIME', long_name = 'ETFLAG'.ljust(16), var_desc = 'Ending TFLAG'.ljust(80))
         
@@ -231,19 +307,18 @@ class uamiv(PseudoNetCDFFile):
         offset+=self.__spc_hdr.dtype.itemsize*self.__spc_hdr.size+4
         
         
-        date_time_fmt=dtype(dict(names=['SPAD', 'BDATE', 'BTIME', 'EDATE', 'ETIME', 'EPAD'], formats=[ep + 'i', ep + 'i', ep + 'f', ep + 'i', ep + 'f', ep + 'i']))
         date_time_block_size=6
-        spc_1_lay_fmt=dtype(dict(names=['SPAD', 'IONE', 'SPC', 'DATA', 'EPAD'], formats=[ep + 'i', ep + 'i', '(10,4)%sS1' % ep, '(%d,%d)%sf' % (ny, nx, ep), ep + 'i']))
         spc_1_lay_block_size=13+nx*ny
-        spc_3d_fmt=dtype((spc_1_lay_fmt, (nz,)))
-        spc_3d_block_size=spc_1_lay_block_size*nz
         
         # Get species names from spc_hdr
-        var_names=[spc[:,0].copy().view('S10')[0] for spc in self.__spc_hdr]
-        var_names = [v.decode() if hasattr(v, 'decode') else v for v in var_names]
-        self.__var_names__ = [''.join(v).strip() for v in var_names]
+        if self.__index is None:
+            var_names=[spc[:,0].copy().view('S10')[0] for spc in self.__spc_hdr]
+            var_names = [v.decode() if hasattr(v, 'decode') else v for v in var_names]
+            self.__var_names__ = [''.join(v).strip() for v in var_names]
+        else:
+            self.__var_names__ = self.__index['VARNAMES'].tolist()
 
-        data_block_fmt=dtype(dict(names=['DATE']+self.__var_names__, formats=[date_time_fmt]+[spc_3d_fmt]*nspec))
+        data_block_fmt=_data_block_fmt(self.__var_names__, nz, ny, nx, ep)
         
         data_block_size=date_time_block_size+nspec*nz*spc_1_lay_block_size
         f=open(self.__rffile)
@@ -265,12 +340,45 @@ class uamiv(PseudoNetCDFFile):
         
         self.__memmap__=memmap(self.__rffile, mode=self.__mode, dtype=data_block_fmt, offset=offset)
 
+    def _rawslab(self, k, t):
+        """
+        Return the (LAY, ROW, COL) file view of species k at time t
+        """
+        return self.__memmap__[t][k]['DATA']
+    
+    def _getslab(self, k, t, cache = True):
+        """
+        Return species k at time t as a native-endian contiguous float32
+        array (LAY, ROW, COL). Converted slabs are kept (least recently
+        used first out) while they fit in cachebytes; if cache is False,
+        only an already cached slab is returned (or None).
+        """
+        key = (k, t)
+        slabcache = self._slabcache
+        with self._slabcachelock:
+            if key in slabcache:
+                slabcache.move_to_end(key)
+                return slabcache[key]
+        if not cache:
+            return None
+        slab = ascontiguousarray(self._rawslab(k, t), dtype = 'f')
+        if slab.nbytes <= self.cachebytes:
+            with self._slabcachelock:
+                if key not in slabcache:
+                    slabcache[key] = slab
+                    self._slabcachebytes += slab.nbytes
+                while self._slabcachebytes > self.cachebytes:
+                    self._slabcachebytes -= slabcache.popitem(last = False)[1].nbytes
+        return slab
+    
     def __variables(self, k):
         spc_index=self.__var_names__.index(k)
         dimensions=('TSTEP', 'LAY', 'ROW', 'COL')
-        outvals=self.__memmap__[k]['DATA']
         units = get_uamiv_units(self.NAME, k, self._aerosol_names)
+        if self.__mode == 'r':
+            return _uamivvariable(self, k, units = units, long_name = k.ljust(16), var_desc = k.ljust(80))
         
+        outvals=self.__memmap__[k]['DATA']
         return PseudoIOAPIVariable(self, k, 'f', dimensions, values=outvals, units = units)
 
     def sync(self):
@@ -278,6 +386,9 @@ class uamiv(PseudoNetCDFFile):
     
     def close(self):
         self.sync()
+        with self._slabcachelock:
+            self._slabcache.clear()
+            self._slabcachebytes = 0
         self.__memmap__.close()
         
 
@@ -293,6 +404,64 @@ class TestMemmap(unittest.TestCase):
         emissfile.variables['TFLAG']
         v=emissfile.variables['NO2']
         self.assert_((v==array([ 0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 1.24175494e-04, 2.79196858e-04, 1.01672206e-03, 4.36782313e-04, 0.00000000e+00, 1.54810550e-04, 3.90250643e-04, 6.18023798e-04, 3.36963218e-04, 0.00000000e+00, 1.85579920e-04, 1.96825975e-04, 2.16468165e-04, 2.19882189e-04], dtype='f').reshape(1, 1, 4, 5)).all())
+    
+    def testNativeSlabs(self):
+        from numpy import ndarray
+        from PseudoNetCDF.sci_var import PseudoNetCDFVariable
+        import PseudoNetCDF.testcase
+        emissfile=uamiv(PseudoNetCDF.testcase.camxfiles_paths['uamiv'])
+        v=emissfile.variables['NO2']
+        raw=emissfile._rawslab('NO2', 0)
+        self.assert_(raw.dtype.byteorder == '>')
+        vals=v[:]
+        self.assert_(vals.dtype.isnative and vals.flags['C_CONTIGUOUS'])
+        self.assert_((vals[0] == raw).all())
+        self.assert_(isinstance(vals, PseudoNetCDFVariable))
+        self.assert_(vals.units == v.units and vals.dimensions == v.dimensions)
+        self.assert_(type(vals.array()) is ndarray)
+        # a layer subset does not fill the cache
+        self.assert_((v[:, 0, 1:3] == raw[0, 1:3]).all())
+        # index arrays are placed as numpy places them
+        allvals = vals.array()
+        for item in [(slice(None), 0, slice(1, 3), [0, 2]), ([0], 0, slice(None), [0, 2]), (0, slice(None), [1, 2], [0, 2])]:
+            self.assert_(v[item].shape == allvals[item].shape)
+            self.assert_((v[item] == allvals[item]).all())
+        self.assert_(v[:, 0, 1:3, [0, 2]].shape == (2, 1, 2))
+        self.assert_(v[0, 0, 1, 2] == raw[0, 1, 2])
+        self.assert_(list(emissfile._slabcache) == [('NO2', 0)])
+        self.assert_((emissfile.variables['NO'][0] == emissfile._getslab('NO', 0)).all())
+        self.assert_(list(emissfile._slabcache) == [('NO2', 0), ('NO', 0)])
+        self.assert_(emissfile._slabcachebytes == 2 * raw.size * 4)
+        # slabs larger than the budget are converted, but not kept
+        smallfile=uamiv(PseudoNetCDF.testcase.camxfiles_paths['uamiv'], cachebytes = 0)
+        self.assert_((smallfile.variables['NO2'][...] == vals).all())
+        self.assert_(len(smallfile._slabcache) == 0)
+    
+    def testIndex(self):
+        import os, shutil, tempfile
+        import PseudoNetCDF.testcase
+        from PseudoNetCDF.camxfiles.util import loadindex
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'test.uamiv')
+            shutil.copy(PseudoNetCDF.testcase.camxfiles_paths['uamiv'], path)
+            nofile = uamiv(path)
+            self.assert_(not os.path.exists(path + '.pncidx'))
+            first = uamiv(path, index = True)
+            self.assert_(loadindex(path, 'uamiv')['VARNAMES'].tolist() == getattr(nofile, 'VAR-LIST').split())
+            self.assert_(loadindex(path, 'point_source') is None)
+            second = uamiv(path, index = True)
+            self.assert_(second.variables.keys() == nofile.variables.keys())
+            for k in ('TFLAG', 'ETFLAG', 'NO2'):
+                self.assert_((second.variables[k][:] == nofile.variables[k][:]).all())
+            # a changed file invalidates the index
+            stat = os.stat(path)
+            os.utime(path, ns = (stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            self.assert_(loadindex(path, 'uamiv') is None)
+            third = uamiv(path, index = True)
+            self.assert_(loadindex(path, 'uamiv') is not None)
+        finally:
+            shutil.rmtree(tmpdir)
 
 if __name__ == '__main__':
     unittest.main()
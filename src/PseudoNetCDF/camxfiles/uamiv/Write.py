@@ -1,5 +1,5 @@
 from __future__ import print_function, unicode_literals
-__all__ = ['ncf2uamiv', 'write_emissions_ncf', 'write_emissions']
+__all__ = ['ncf2uamiv', 'uamivwriter', 'write_emissions_ncf', 'write_emissions']
 __doc__ = """
 .. _Write
 :mod:`Write` -- CAMx uamiv  writer
@@ -35,6 +35,8 @@ import numpy as np
 from PseudoNetCDF.camxfiles.timetuple import timediff,timeadd,timerange
 from PseudoNetCDF.camxfiles.FortranFileUtil import OpenRecordFile,read_into,writeline,Int2Asc,Asc2Int
 from PseudoNetCDF.sci_var import PseudoNetCDFFile, PseudoNetCDFVariable
+from PseudoNetCDF.camxfiles.uamiv.Memmap import _data_block_fmt
+from PseudoNetCDF.camxfiles.util import timeheaders
 
 _emiss_hdr_fmt=np.dtype(dict(names=['SPAD','name','note','itzon','nspec','ibdate','btime','iedate','etime','EPAD'],formats=['>i','(10,4)>S1','(60,4)>S1','>i','>i','>i','>f','>i','>f','>i']))
 
@@ -46,7 +48,160 @@ _time_hdr_fmt=np.dtype(dict(names=['SPAD','ibdate','btime','iedate','etime','EPA
 
 _spc_fmt=np.dtype("(10,4)>S1")
 
-def ncf2uamiv(ncffile, outpath):
+def _uamiv_headers(ncffile):
+    """
+    Return the emiss, grid, cell and species header records and the
+    species keys for a uamiv file with the properties of ncffile (see
+    ncf2uamiv); emiss header dates come from TFLAG/ETFLAG when ncffile
+    has times and are otherwise left for the caller to set
+    """
+    emiss_hdr = np.zeros(shape = (1,), dtype = _emiss_hdr_fmt)
+    emiss_hdr[0]['name'][:, :] = ' '
+    emiss_hdr[0]['name'][:, 0] = np.array(ncffile.NAME, dtype = '>c')
+    emiss_hdr[0]['note'][:, :] = ' '
+    emiss_hdr[0]['note'][:, 0] = np.array(ncffile.NOTE, dtype = '>c')
+    gdtype = getattr(ncffile, 'GDTYP', -999)
+    emiss_hdr['itzon'][0] = ncffile.ITZON
+    nspec = len(ncffile.dimensions['VAR'])
+    emiss_hdr['nspec'] = nspec
+    emiss_hdr['SPAD'] = _emiss_hdr_fmt.itemsize - 8
+    emiss_hdr['EPAD'] = _emiss_hdr_fmt.itemsize - 8
+    
+    NCOLS = len(ncffile.dimensions['COL'])
+    NROWS = len(ncffile.dimensions['ROW'])
+    NLAYS = len(ncffile.dimensions['LAY'])
+    grid_hdr = np.zeros(shape = (1,), dtype = _grid_hdr_fmt)
+    grid_hdr['SPAD'] = grid_hdr.itemsize - 8
+    grid_hdr['plon'] = ncffile.PLON
+    grid_hdr['plat'] = ncffile.PLAT
+    grid_hdr['iutm'][0] = ncffile.IUTM
+    grid_hdr['xorg'] = ncffile.XORIG
+    grid_hdr['yorg'] = ncffile.YORIG
+    grid_hdr['delx'] = ncffile.XCELL
+    grid_hdr['dely'] = ncffile.YCELL
+    grid_hdr['nx'] = NCOLS
+    grid_hdr['ny'] = NROWS
+    grid_hdr['nz'] = NLAYS
+    grid_hdr['iproj'] = ncffile.CPROJ
+    grid_hdr['tlat1'] = ncffile.TLAT1
+    grid_hdr['tlat2'] = ncffile.TLAT2
+    grid_hdr['istag'] = ncffile.ISTAG
+    grid_hdr['rdum5'] = 0.
+    grid_hdr['EPAD'] = grid_hdr.itemsize - 8
+
+    cell_hdr = np.zeros(shape = (1,), dtype = _cell_hdr_fmt)
+    cell_hdr['SPAD'] = cell_hdr.itemsize - 8
+    cell_hdr['ione1'] = 1
+    cell_hdr['ione2'] = 1
+    cell_hdr['nx'] = NCOLS
+    cell_hdr['ny'] = NROWS
+    cell_hdr['EPAD'] = cell_hdr.itemsize - 8
+
+    spc_hdr = np.zeros(shape = (1,), dtype = dict(names = ['SPAD1', 'DATA', 'EPAD1'], formats = ['>i', np.dtype("(%d,10,4)>S1" % nspec), '>i']))
+    spc_hdr['SPAD1'] = nspec * 40
+    spc_hdr['EPAD1'] = nspec * 40
+    spc_names = np.array(getattr(ncffile, 'VAR-LIST'), dtype = '>c').reshape(-1, 16)[:, :10].copy()
+    spc_hdr[0]['DATA'][:] = ' '
+    spc_hdr[0]['DATA'][:, :, 0] = spc_names
+    spc_names = [s.decode() if hasattr(s, 'decode') else s for s in spc_names.view('>S10')[:, 0]]
+    spc_keys = [str(np.char.strip(spc_key)) for spc_key in spc_names]
+    return emiss_hdr, grid_hdr, cell_hdr, spc_hdr, spc_keys
+
+def _uamiv_block(spc_hdr, nz, ny, nx, nsteps = 1, outpath = None, offset = 0):
+    """
+    Return nsteps uamiv time step records (see uamiv.Memmap) with pads,
+    IONE and species names filled; if outpath is provided, the records
+    are a memory map of outpath starting at offset
+    """
+    nspec = spc_hdr[0]['DATA'].shape[0]
+    block_fmt = _data_block_fmt(['SPC%d' % si for si in range(nspec)], nz, ny, nx)
+    if outpath is None:
+        blocks = np.zeros((nsteps,), dtype = block_fmt)
+    else:
+        blocks = np.memmap(outpath, mode = 'r+', dtype = block_fmt, offset = offset, shape = (nsteps,))
+    for si, spc_name in enumerate(spc_hdr[0]['DATA']):
+        spc_block = blocks['SPC%d' % si]
+        spc_block['SPAD'] = 4 + 40 + ny * nx * 4
+        spc_block['EPAD'] = 4 + 40 + ny * nx * 4
+        spc_block['IONE'] = 1
+        spc_block['SPC'] = spc_name
+    return blocks
+
+class uamivwriter(object):
+    """
+    uamivwriter writes a uamiv file one time step at a time. Headers are
+    written when the writer is created and the file header dates are
+    updated to the first and last appended steps by flush and close.
+    
+    ex:
+        >>> writer = uamivwriter(template, 'out.uamiv')
+        >>> for tflag, spcvals in steps:
+        ...     writer.append(spcvals, tflag)
+        >>> writer.close()
+    """
+    def __init__(self, ncffile, outpath, tstep = None):
+        """
+        ncffile - PseudoNetCDF-like object with the properties of a uamiv
+                  file (see ncf2uamiv); only metadata (dimensions other
+                  than TSTEP and global properties) is used
+        outpath - path to create
+        tstep - HHMMSS duration of steps appended without etflag
+                (default ncffile.TSTEP or 10000)
+        """
+        if tstep is None:
+            tstep = getattr(ncffile, 'TSTEP', 10000)
+        self.tstep = tstep
+        self.emiss_hdr, grid_hdr, cell_hdr, self.spc_hdr, self.spc_keys = _uamiv_headers(ncffile)
+        self.shape = tuple([len(ncffile.dimensions[dk]) for dk in ('LAY', 'ROW', 'COL')])
+        self.nsteps = 0
+        self.outpath = outpath
+        self.outfile = open(outpath, 'wb')
+        self.emiss_hdr.tofile(self.outfile)
+        grid_hdr.tofile(self.outfile)
+        cell_hdr.tofile(self.outfile)
+        self.spc_hdr.tofile(self.outfile)
+        self._block = _uamiv_block(self.spc_hdr, *self.shape)
+        
+    def append(self, values, tflag, etflag = None):
+        """
+        values - mapping of species key to (LAY, ROW, COL) values (e.g.,
+                 variables of a one time step file)
+        tflag - (YYYYJJJ, HHMMSS) start of the step
+        etflag - (YYYYJJJ, HHMMSS) end of the step (default tflag + tstep)
+        """
+        block = self._block
+        time_hdr = timeheaders(tflag, etflag, self.tstep)
+        block['DATE'] = time_hdr.view(block.dtype['DATE'])
+        for si, spc_key in enumerate(self.spc_keys):
+            block['SPC%d' % si]['DATA'][0] = np.ma.filled(values[spc_key]).reshape(self.shape)
+        block.tofile(self.outfile)
+        if self.nsteps == 0:
+            self.emiss_hdr['ibdate'] = time_hdr['ibdate'][0]
+            self.emiss_hdr['btime'] = time_hdr['btime'][0]
+        self.emiss_hdr['iedate'] = time_hdr['iedate'][0]
+        self.emiss_hdr['etime'] = time_hdr['etime'][0]
+        self.nsteps += 1
+    
+    def flush(self):
+        """
+        Write the file header with current dates and flush the file
+        """
+        self.outfile.seek(0, 0)
+        self.emiss_hdr.tofile(self.outfile)
+        self.outfile.seek(0, 2)
+        self.outfile.flush()
+    
+    def close(self):
+        self.flush()
+        self.outfile.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+
+def ncf2uamiv(ncffile, outpath, usememmap = False):
     """
     ncf2uamiv converts a ncffile to a uamiv file
     
@@ -60,6 +215,10 @@ def ncf2uamiv(ncffile, outpath):
                                             TLAT1 TLAT2 ISTAG
     outpath : string
             path to create a uamiv file output
+    usememmap : bool
+            if True, records are written directly into a memory map
+            of the output file; otherwise, each time step is written
+            by a uamivwriter (one structured record block per step)
     
     Returns
     -------
@@ -104,101 +263,52 @@ def ncf2uamiv(ncffile, outpath):
 
     """
     
-    emiss_hdr = np.zeros(shape = (1,), dtype = _emiss_hdr_fmt)
-    emiss_hdr[0]['name'][:, :] = ' '
-    emiss_hdr[0]['name'][:, 0] = np.array(ncffile.NAME, dtype = '>c')
-    emiss_hdr[0]['note'][:, :] = ' '
-    emiss_hdr[0]['note'][:, 0] = np.array(ncffile.NOTE, dtype = '>c')
-    gdtype = getattr(ncffile, 'GDTYP', -999)
-    emiss_hdr['itzon'][0] = ncffile.ITZON
-    nspec = len(ncffile.dimensions['VAR'])
-    emiss_hdr['nspec'] = nspec
-    
-    NCOLS = len(ncffile.dimensions['COL'])
-    NROWS = len(ncffile.dimensions['ROW'])
-    NLAYS = len(ncffile.dimensions['LAY'])
-    grid_hdr = np.zeros(shape = (1,), dtype = _grid_hdr_fmt)
-    grid_hdr['SPAD'] = grid_hdr.itemsize - 8
-    grid_hdr['plon'] = ncffile.PLON
-    grid_hdr['plat'] = ncffile.PLAT
-    grid_hdr['iutm'][0] = ncffile.IUTM
-    grid_hdr['xorg'] = ncffile.XORIG
-    grid_hdr['yorg'] = ncffile.YORIG
-    grid_hdr['delx'] = ncffile.XCELL
-    grid_hdr['dely'] = ncffile.YCELL
-    grid_hdr['nx'] = NCOLS
-    grid_hdr['ny'] = NROWS
-    grid_hdr['nz'] = NLAYS
-    grid_hdr['iproj'] = ncffile.CPROJ
-    grid_hdr['tlat1'] = ncffile.TLAT1
-    grid_hdr['tlat2'] = ncffile.TLAT2
-    grid_hdr['istag'] = ncffile.ISTAG
-    grid_hdr['rdum5'] = 0.
-    grid_hdr['EPAD'] = grid_hdr.itemsize - 8
-
-    cell_hdr = np.zeros(shape = (1,), dtype = _cell_hdr_fmt)
-    cell_hdr['SPAD'] = cell_hdr.itemsize - 8
-    cell_hdr['ione1'] = 1
-    cell_hdr['ione2'] = 1
-    cell_hdr['nx'] = NCOLS
-    cell_hdr['ny'] = NROWS
-    cell_hdr['EPAD'] = cell_hdr.itemsize - 8
-
-    time_hdr = np.zeros(shape = (len(ncffile.dimensions['TSTEP']),), dtype = _time_hdr_fmt)
-    time_hdr['SPAD'] = 16
-    time_hdr['EPAD'] = 16
-    date_s, time_s = ncffile.variables['TFLAG'][:, 0].T
-    time_s = time_s.astype('>f') / 10000.
-    date_s = date_s%(date_s//100000*100000)
+    tflag = ncffile.variables['TFLAG'][:, 0]
     if 'ETFLAG' in ncffile.variables.keys():
-        date_e, time_e = ncffile.variables['ETFLAG'][:, 0].T
-        time_e = time_e.astype('>f') / 10000.
-        date_e = date_e%(date_e//100000*100000)
+        etflag = ncffile.variables['ETFLAG'][:, 0]
+        tstep = None
     else:
+        etflag = None
         if hasattr(ncffile, 'TSTEP'):
-            tincr = ncffile.TSTEP / 10000
+            tstep = ncffile.TSTEP
         else:
-            tincr = np.diff(time_s)[0]
-        date_e = date_s.copy()
-        time_e = time_s.copy() + tincr
-        date_e += (time_e // 24).astype('i')
-        time_e -= (time_e // 24) * 24
-    time_hdr['ibdate'] = date_s
-    time_hdr['btime'] = time_s
-    time_hdr['iedate'] = date_e
-    time_hdr['etime'] = time_e
-    emiss_hdr['ibdate'] = date_s[0]
-    emiss_hdr['btime'] = time_s[0]
-    emiss_hdr['iedate'] = date_e[-1]
-    emiss_hdr['etime'] = time_e[-1]
-    emiss_hdr['SPAD'] = _emiss_hdr_fmt.itemsize - 8
-    emiss_hdr['EPAD'] = _emiss_hdr_fmt.itemsize - 8
+            tstep = np.diff(tflag[:, 1])[0]
+    
+    if not usememmap:
+        writer = uamivwriter(ncffile, outpath, tstep = tstep)
+        for di in range(tflag.shape[0]):
+            values = dict([(spc_key, ncffile.variables[spc_key][di]) for spc_key in writer.spc_keys])
+            writer.append(values, tflag[di], None if etflag is None else etflag[di])
+        writer.flush()
+        return writer.outfile
+    
+    emiss_hdr, grid_hdr, cell_hdr, spc_hdr, spc_keys = _uamiv_headers(ncffile)
+    time_hdr = timeheaders(tflag, etflag, tstep or 10000)
+    emiss_hdr['ibdate'] = time_hdr['ibdate'][0]
+    emiss_hdr['btime'] = time_hdr['btime'][0]
+    emiss_hdr['iedate'] = time_hdr['iedate'][-1]
+    emiss_hdr['etime'] = time_hdr['etime'][-1]
     
-    spc_hdr = np.zeros(shape = (1,), dtype = dict(names = ['SPAD1', 'DATA', 'EPAD1'], formats = ['>i', np.dtype("(%d,10,4)>S1" % nspec), '>i']))
-    spc_hdr['SPAD1'] = nspec * 40
-    spc_hdr['EPAD1'] = nspec * 40
-    spc_names = np.array(getattr(ncffile, 'VAR-LIST'), dtype = '>c').reshape(-1, 16)[:, :10].copy()
-    spc_hdr[0]['DATA'][:] = ' '
-    spc_hdr[0]['DATA'][:, :, 0] = spc_names
-    spc_names = [s.decode() if hasattr(s, 'decode') else s for s in spc_names.view('>S10')[:, 0]]
-    nz = len(ncffile.dimensions['LAY'])
     outfile = open(outpath, 'wb')
     emiss_hdr.tofile(outfile)
     grid_hdr.tofile(outfile)
     cell_hdr.tofile(outfile)
     spc_hdr.tofile(outfile)
-    for di, (d, t) in enumerate(ncffile.variables['TFLAG'][:, 0]):
-        time_hdr[di].tofile(outfile)
-        for spc_key, spc_name in zip(spc_names, spc_hdr[0]['DATA']):
-            for zi in range(nz):
-                var = ncffile.variables[str(np.char.strip(spc_key))]
-                data = var[di, zi].astype('>f')
-                buf = np.array(4+40+data.size*4).astype('>i')
-                buf.tofile(outfile)
-                np.array(1).astype('>i').tofile(outfile)
-                spc_name.tofile(outfile)
-                np.ma.filled(data).tofile(outfile)
-                buf.tofile(outfile)
+    
+    nz, ny, nx = [len(ncffile.dimensions[dk]) for dk in ('LAY', 'ROW', 'COL')]
+    nsteps = time_hdr.shape[0]
+    outfile.flush()
+    offset = outfile.tell()
+    outfile.truncate(offset + _data_block_fmt(['SPC%d' % si for si in range(len(spc_keys))], nz, ny, nx).itemsize * nsteps)
+    blocks = _uamiv_block(spc_hdr, nz, ny, nx, nsteps, outpath, offset)
+    blocks['DATE'] = time_hdr.view(blocks.dtype['DATE'])
+    for si, spc_key in enumerate(spc_keys):
+        var = ncffile.variables[spc_key]
+        for di in range(nsteps):
+            blocks['SPC%d' % si]['DATA'][di] = np.ma.filled(var[di])
+    blocks.flush()
+    del blocks
+    outfile.seek(0, 2)
     outfile.flush()
     return outfile
 
@@ -301,3 +411,47 @@ class TestMemmaps(unittest.TestCase):
         assert(check)
         os.remove(self.uamivpath+'.check')
          
+    
+    def testNCF2UAMIVMemmap(self):
+        import filecmp
+        from PseudoNetCDF.camxfiles.Memmaps import uamiv
+        uamivfile=uamiv(self.uamivpath)
+        ncf2uamiv(uamivfile, self.uamivpath + '.check').close()
+        ncf2uamiv(uamivfile, self.uamivpath + '.checkmm', usememmap = True).close()
+        try:
+            self.assert_(filecmp.cmp(self.uamivpath, self.uamivpath + '.check', shallow = False))
+            self.assert_(filecmp.cmp(self.uamivpath + '.check', self.uamivpath + '.checkmm', shallow = False))
+        finally:
+            os.remove(self.uamivpath + '.check')
+            os.remove(self.uamivpath + '.checkmm')
+    
+    def testUAMIVWriter(self):
+        from PseudoNetCDF.camxfiles.Memmaps import uamiv
+        uamivfile=uamiv(self.uamivpath)
+        outpath = self.uamivpath + '.stream'
+        tflag = uamivfile.variables['TFLAG'][0, 0]
+        try:
+            with uamivwriter(uamivfile, outpath) as writer:
+                for di in range(3):
+                    stflag = [tflag[0], tflag[1] + di * 10000]
+                    writer.append(dict([(k, uamivfile.variables[k][0] * (di + 1)) for k in writer.spc_keys]), stflag)
+            emiss_hdr = np.fromfile(outpath, dtype = _emiss_hdr_fmt, count = 1)[0]
+            self.assert_(emiss_hdr['btime'] == tflag[1] / 10000. and emiss_hdr['etime'] == tflag[1] / 10000. + 3)
+            streamfile = uamiv(outpath)
+            self.assert_(len(streamfile.dimensions['TSTEP']) == 3)
+            self.assert_((streamfile.variables['TFLAG'][:, 0, 1] == tflag[1] + np.arange(3) * 10000).all())
+            for k in writer.spc_keys:
+                self.assert_((streamfile.variables[k][2] == uamivfile.variables[k][0] * 3).all())
+            
+            # HHMMSS steps are hours, minutes and seconds
+            with uamivwriter(uamivfile, outpath, tstep = 3000) as writer:
+                writer.append(dict([(k, uamivfile.variables[k][0]) for k in writer.spc_keys]), [2002154, 233000])
+            time_hdr = np.fromfile(outpath, dtype = _emiss_hdr_fmt, count = 1)[0]
+            self.assert_(time_hdr['ibdate'] == 2154 and time_hdr['btime'] == np.float32(23.3))
+            self.assert_(time_hdr['iedate'] == 2155 and time_hdr['etime'] == 0.)
+            with uamivwriter(uamivfile, outpath, tstep = 13000) as writer:
+                writer.append(dict([(k, uamivfile.variables[k][0]) for k in writer.spc_keys]), [2002154, 3000])
+            time_hdr = np.fromfile(outpath, dtype = _emiss_hdr_fmt, count = 1)[0]
+            self.assert_(time_hdr['iedate'] == 2154 and time_hdr['etime'] == 2.)
+        finally:
+            os.remove(outpath)
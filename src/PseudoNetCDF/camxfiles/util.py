@@ -1,4 +1,4 @@
-__all__ = ['cartesian', 'sliceit']
+__all__ = ['cartesian', 'sliceit', 'hhmmss2hours', 'timeheaders', 'loadindex', 'saveindex']
 __doc__ = """
 .. _util
 :mod:`util` -- CAMx basic util
@@ -9,6 +9,10 @@ __doc__ = """
    :synopsis: Provides simple utilites for camxfiles
 .. moduleauthor:: Barron Henderson <barronh@unc.edu>
 """
+import os
+from warnings import warn
+
+import numpy as np
 
 def cartesian(x, y):
     """Iterator for an 'outer' or cartesian join of
@@ -31,3 +35,105 @@ def sliceit(args):
     except TypeError:
         return slice(args,args+1)
 
+def hhmmss2hours(hhmmss):
+    """
+    Return hours (float) for IOAPI HHMMSS durations or times
+    (e.g., 13000 is 1.5)
+    """
+    hh, mmss = np.divmod(np.asarray(hhmmss, dtype = 'i'), 10000)
+    mm, ss = np.divmod(mmss, 100)
+    return hh + mm / 60. + ss / 3600.
+
+_time_hdr_fmt=np.dtype(dict(names=['SPAD','ibdate','btime','iedate','etime','EPAD'],formats=['>i','>i','>f','>i','>f','>i']))
+
+def timeheaders(tflag, etflag = None, tstep = 10000):
+    """
+    Arguments:
+       tflag - IOAPI (YYYYJJJ, HHMMSS) step starts (n, 2)
+       etflag - IOAPI step ends (n, 2) or None
+       tstep - HHMMSS step duration used when etflag is None
+    Returns:
+       time_hdr - CAMx time header records (n,) with times as HHMMSS / 10000
+    """
+    tflag = np.asarray(tflag).reshape(-1, 2)
+    time_hdr = np.zeros(shape = (tflag.shape[0],), dtype = _time_hdr_fmt)
+    time_hdr['SPAD'] = 16
+    time_hdr['EPAD'] = 16
+    date_s, time_s = tflag.T
+    if etflag is not None:
+        date_e, time_e = np.asarray(etflag).reshape(-1, 2).T
+    else:
+        hours_e = hhmmss2hours(time_s) + hhmmss2hours(tstep)
+        date_e = date_s + (hours_e // 24).astype('i')
+        seconds_e = np.round((hours_e % 24) * 3600).astype('i')
+        time_e = seconds_e // 3600 * 10000 + seconds_e % 3600 // 60 * 100 + seconds_e % 60
+    time_hdr['ibdate'] = date_s%(date_s//100000*100000)
+    time_hdr['btime'] = time_s.astype('>f') / 10000.
+    time_hdr['iedate'] = date_e%(date_e//100000*100000)
+    time_hdr['etime'] = time_e.astype('>f') / 10000.
+    return time_hdr
+
+def _indexpath(path, index):
+    """
+    Return the sidecar index path for path; index is True (path +
+    '.pncidx') or a path
+    """
+    if index is True:
+        return path + '.pncidx'
+    return index
+
+def _filekey(path):
+    stat = os.stat(path)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype = 'int64')
+
+def loadindex(path, kind, index = True):
+    """
+    Arguments:
+       path - CAMx file path
+       kind - reader name that saved the index (e.g., uamiv)
+       index - True (path + '.pncidx') or sidecar index path
+    Returns:
+       out - dictionary of arrays saved by saveindex, or None if there is
+             no readable index for kind or path has changed size or
+             modification time since it was saved
+    """
+    indexpath = _indexpath(path, index)
+    try:
+        record = np.load(indexpath, allow_pickle = False)[0]
+        out = dict([(k, record[k]) for k in record.dtype.names])
+    except Exception:
+        return None
+    if str(out.pop('KIND', '')) != kind or \
+       not np.array_equal(out.pop('FILEKEY', None), _filekey(path)):
+        return None
+    return out
+
+def saveindex(path, kind, index = True, **arrays):
+    """
+    Arguments:
+       path - CAMx file path
+       kind - reader name (see loadindex)
+       index - True (path + '.pncidx') or sidecar index path
+       arrays - values (array_like, no objects) to store
+    Returns:
+       None; failures to write (e.g., read-only directories) are warnings
+    
+    The index is one structured record (a field per array) so that
+    loading it parses a single .npy header
+    """
+    indexpath = _indexpath(path, index)
+    tmppath = indexpath + '.%d.tmp' % os.getpid()
+    arrays = dict([(k, np.asarray(v)) for k, v in arrays.items()])
+    arrays['KIND'] = np.asarray(kind)
+    arrays['FILEKEY'] = _filekey(path)
+    record = np.zeros(1, dtype = [(k, v.dtype, v.shape) for k, v in sorted(arrays.items())])
+    for k, v in arrays.items():
+        record[k][0] = v
+    try:
+        with open(tmppath, 'wb') as tmpfile:
+            np.save(tmpfile, record, allow_pickle = False)
+        os.replace(tmppath, indexpath)
+    except Exception as e:
+        warn('Could not save index %s: %s' % (indexpath, e))
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
@@ -268,6 +268,7 @@ def add_lcc_coordinates(ifileo, lccname = 'LambertConformalProjection'):
         except:
             pass
         olddims = list(var.dimensions)
+        dims = olddims
         if _withlatlon:
             dims = map(lambda x: {'ROW': 'latitude', 'COL': 'longitude', 'TSTEP': 'time', 'LAY': 'level'}.get(x, x), olddims)
         dims = [d for d in dims] # Why was I excluding time  if d != 'time'
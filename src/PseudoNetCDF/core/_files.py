@@ -1,5 +1,5 @@
 import unittest
-from PseudoNetCDF._getreader import registerreader
+from PseudoNetCDF._getreader import registerreader, _readernames
 from PseudoNetCDF.netcdf import NetCDFFile
 from collections import OrderedDict
 from ._dimensions import PseudoNetCDFDimension
@@ -27,8 +27,7 @@ class PseudoNetCDFType(type):
     Create a PseudoNetCDFType meta-class
     """
     def __init__(cls, name, bases, clsdict):
-        pieces = str(cls).split('\'')[1].split('.')
-        longname = '.'.join([p for p in pieces[1:-1]  if '_' != p[0] and p not in ('core',)] + [pieces[-1]])
+        longname = _readernames(str(cls).split('\'')[1])[1]
         if len(cls.mro()) > 2:
             if name not in ('PseudoNetCDFFile', 'PseudoNetCDFFileMemmap', 'WrapPnc'):
                 shortl = registerreader(name, cls)
@@ -45,6 +44,9 @@ class PseudoNetCDFFile(PseudoNetCDFSelfReg):
     methods that a file should present to act like a netCDF file
     using the Scientific.IO.NetCDF.NetCDFFile interface.
     """
+    # readers whose variables can be read from several threads at once
+    # (e.g., by pncgen workers) set threadsafe = True
+    threadsafe = False
     
     def __repr__(self):
         from PseudoNetCDF.pncdump import pncdump
@@ -220,7 +222,7 @@ class PseudoNetCDFVariables(OrderedDefaultDict):
         """
         super(PseudoNetCDFVariables, self).__init__()
         self.__func = func
-        self.__keys = keys
+        self.__keys = keys if isinstance(keys, list) else list(keys)
     def __missing__(self, k):
         """
         If the dictionary does not have a key, check if the
@@ -243,7 +245,29 @@ class PseudoNetCDFVariables(OrderedDefaultDict):
     def keys(self):
         return tuple(self.__keys + [k for k in dict.keys(self) if k not in self.__keys])
 
-    
+    def __contains__(self, k):
+        return k in self.__keys or dict.__contains__(self, k)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __delitem__(self, k):
+        """
+        Remove a key whether or not it has been created yet
+        """
+        if not k in self:
+            raise KeyError('missing "%s"' % (k, ))
+        if k in self.__keys:
+            self.__keys.remove(k)
+        if dict.__contains__(self, k):
+            super(PseudoNetCDFVariables, self).__delitem__(k)
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
     def items(self):
         return [(k, self[k]) for k in self.keys()]
     
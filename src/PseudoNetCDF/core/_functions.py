@@ -7,13 +7,15 @@ else:
 
 from warnings import warn
 import re
+import unittest
 import numpy as np
 from collections import defaultdict, OrderedDict
 
 
-from ._files import PseudoNetCDFFile
-from ._variables import PseudoNetCDFMaskedVariable, PseudoNetCDFVariable
+from ._files import PseudoNetCDFFile, PseudoNetCDFVariables
+from ._variables import PseudoNetCDFMaskedVariable, PseudoNetCDFVariable, PseudoNetCDFLazyVariable
 from ..userfuncs import *
+from .. import userfuncs
 
 import datetime
 
@@ -69,7 +71,52 @@ def removesingleton(f, rd, coordkeys = []):
         ov[...] = outvals[...]
     return outf
     
+def _cowview(vals):
+    """
+    Return a copy-on-write view of vals when it is backed by a file
+    memmap (only pages that are written are copied); otherwise return
+    a copy
+    """
+    import mmap
+    if isinstance(vals, np.ma.MaskedArray):
+        mask = np.ma.getmask(vals)
+        if mask is not np.ma.nomask:
+            mask = mask.copy()
+        return np.ma.MaskedArray(_cowview(np.ma.getdata(vals)), mask = mask, fill_value = vals.fill_value)
+    
+    mm = None
+    root = vals
+    while getattr(root, 'base', None) is not None:
+        if mm is None and isinstance(root, np.memmap):
+            mm = root
+        root = root.base
+    
+    # A private map of the file only matches vals if the original map
+    # has no private changes of its own (i.e., mode is not 'c')
+    if mm is None or mm.mode == 'c' or mm.filename is None or \
+       not isinstance(root, mmap.mmap) or vals.size == 0:
+        return vals.copy()
+    try:
+        mapaddr = np.frombuffer(root, dtype = 'u1').__array_interface__['data'][0]
+        addr = vals.__array_interface__['data'][0]
+        extents = [s * (n - 1) for s, n in zip(vals.strides, vals.shape)]
+        low = addr + sum([e for e in extents if e < 0])
+        high = addr + sum([e for e in extents if e > 0]) + vals.itemsize
+        mapstart = mm.offset - mm.offset % mmap.ALLOCATIONGRANULARITY
+        cow = np.memmap(mm.filename, dtype = 'u1', mode = 'c', offset = mapstart + low - mapaddr, shape = (high - low,))
+        return np.ndarray(vals.shape, dtype = vals.dtype, buffer = cow, offset = addr - low, strides = vals.strides)
+    except Exception as e:
+        warn('Copying instead of mapping; %s' % e)
+        return vals.copy()
+
 def getvarpnc(f, varkeys, coordkeys = [], copy = True):
+    """
+    f - PseudoNetCDFFile or netCDF file
+    varkeys - variables to keep (None for all)
+    coordkeys - coordinate variables to keep in addition to dimensions
+    copy - when True, values are copied or, for memmap backed values,
+           mapped copy-on-write so that unused data is never read
+    """
     coordkeys = set(coordkeys)
     if varkeys is None:
         varkeys = list(set(f.variables.keys()).difference(coordkeys))
@@ -108,9 +155,10 @@ def getvarpnc(f, varkeys, coordkeys = [], copy = True):
                 if f.dimensions[coordk].isunlimited():
                     newdimv.setunlimited(True)
     
+        vals = var[...]
         propd = dict([(k, getattr(var, k)) for k in var.ncattrs()])
-        if hasattr(var[...], 'fill_value') and 'fill_value' not in propd:
-            propd['fill_value'] = var[...].fill_value
+        if hasattr(vals, 'fill_value') and 'fill_value' not in propd:
+            propd['fill_value'] = vals.fill_value
         
         if 'values' in propd:
             propd['pvalues'] = propd['values']
@@ -119,9 +167,8 @@ def getvarpnc(f, varkeys, coordkeys = [], copy = True):
             if not 'standard_name' in propd:
                 propd['standard_name'] = propd['name']
             del propd['name']
-        vals = var[...]
         if copy:
-            vals = vals.copy()
+            vals = _cowview(vals)
         outf.createVariable(varkey, var.dtype.char, var.dimensions, values = vals, **propd)
     for coordkey in coordkeys:
         if coordkey in f.variables.keys():
@@ -135,10 +182,173 @@ def getvarpnc(f, varkeys, coordkeys = [], copy = True):
     return outf
 
 
+# Sparse interpolation weights for recently used coordinate pairs; the
+# least recently used are dropped while they exceed _interpweightcachebytes
+_interpweightcache = OrderedDict()
+_interpweightcachebytes = 2**28
+_interpweightcacheused = 0
+
+def _cachedweights(key):
+    """
+    Return cached weights for key (or None) and mark them as recently used
+    """
+    if key not in _interpweightcache:
+        return None
+    _interpweightcache.move_to_end(key)
+    return _interpweightcache[key]
+
+def _cacheweights(key, weights):
+    global _interpweightcacheused
+    nbytes = sum([w.nbytes for w in weights])
+    if nbytes > _interpweightcachebytes:
+        return weights
+    _interpweightcache[key] = weights
+    _interpweightcacheused += nbytes
+    while _interpweightcacheused > _interpweightcachebytes:
+        _interpweightcacheused -= sum([w.nbytes for w in _interpweightcache.popitem(last = False)[1]])
+    return weights
+
+def interpweights(oldcoord, newcoord, axis = 0):
+    """
+    oldcoord - coordinate (e.g., pressure or sigma) of the old levels;
+               monotonic along axis
+    newcoord - coordinate of the new levels; other dimensions of
+               oldcoord and newcoord broadcast (one set of weights for
+               each column)
+    axis - level axis of oldcoord and newcoord
+    Returns:
+       index, weight - arrays with shape (new, 2) + column shape where
+                       new level i is sum(weight[i, k] * old[index[i, k]]).
+                       New levels outside oldcoord use the nearest old
+                       level (like np.interp). Weights are cached for
+                       each coordinate pair (up to _interpweightcachebytes)
+    """
+    import hashlib
+    oldcoord = np.moveaxis(np.asarray(np.ma.getdata(oldcoord), dtype = 'd'), axis, 0)
+    newcoord = np.moveaxis(np.asarray(np.ma.getdata(newcoord), dtype = 'd'), axis, 0)
+    key = ('coord', oldcoord.shape, newcoord.shape, hashlib.md5(oldcoord.tobytes()).hexdigest(), hashlib.md5(newcoord.tobytes()).hexdigest())
+    cached = _cachedweights(key)
+    if cached is not None:
+        return cached
+    
+    nold, nnew = oldcoord.shape[0], newcoord.shape[0]
+    colshape = np.broadcast(oldcoord[0], newcoord[0]).shape
+    oldc = np.broadcast_to(oldcoord, (nold,) + colshape).reshape(nold, -1)
+    newc = np.broadcast_to(newcoord, (nnew,) + colshape).reshape(nnew, -1)
+    # decreasing coordinates (e.g., pressure) are negated
+    sign = np.where(oldc[-1] < oldc[0], -1., 1.)
+    oldc = oldc * sign
+    newc = newc * sign
+    if nold == 1:
+        lower = np.zeros(newc.shape, dtype = 'intp')
+        upper = lower
+        frac = np.zeros(newc.shape)
+    else:
+        # one pass per old level; no (new, old, column) temporary
+        nbelow = np.zeros(newc.shape, dtype = 'intp')
+        for level in oldc:
+            nbelow += level <= newc
+        lower = np.clip(nbelow - 1, 0, nold - 2)
+        upper = lower + 1
+        x0 = np.take_along_axis(oldc, lower, 0)
+        dx = np.take_along_axis(oldc, upper, 0) - x0
+        frac = np.clip((newc - x0) / np.where(dx == 0, 1, dx), 0, 1)
+    index = np.stack([lower, upper], axis = 1).reshape((nnew, 2) + colshape)
+    weight = np.stack([1 - frac, frac], axis = 1).reshape((nnew, 2) + colshape)
+    return _cacheweights(key, (index, weight))
+
+def _sparseweights(weights):
+    """
+    Return the (index, weight) form of weights; weights can be a dense
+    array dim(new, old), a scipy.sparse matrix or an (index, weight)
+    pair (see interpweights). Dense weights are cached.
+    """
+    import hashlib
+    if isinstance(weights, tuple):
+        index, weight = weights
+        return np.asarray(index, dtype = 'intp'), np.asarray(weight, dtype = 'd')
+    if hasattr(weights, 'tocsr'):
+        csr = weights.tocsr()
+        counts = np.diff(csr.indptr)
+        rows = np.repeat(np.arange(csr.shape[0]), counts)
+        cols, vals = csr.indices, csr.data
+        key = None
+    else:
+        weights = np.asarray(weights, dtype = 'd')
+        key = ('dense', weights.shape, hashlib.md5(weights.tobytes()).hexdigest())
+        cached = _cachedweights(key)
+        if cached is not None:
+            return cached
+        rows, cols = np.nonzero(weights)
+        vals = weights[rows, cols]
+        counts = np.bincount(rows, minlength = weights.shape[0])
+    starts = np.cumsum(counts) - counts
+    nnz = max(1, counts.max() if counts.size else 1)
+    index = np.zeros((len(counts), nnz), dtype = 'intp')
+    weight = np.zeros((len(counts), nnz), dtype = 'd')
+    order = np.arange(len(rows)) - np.repeat(starts, counts)
+    index[rows, order] = cols
+    weight[rows, order] = vals
+    if key is None:
+        return index, weight
+    return _cacheweights(key, (index, weight))
+
+def applyweights(values, weights, axis = 0, loginterp = False):
+    """
+    values - array with levels on axis
+    weights - dense array dim(new, old), scipy.sparse matrix or
+              (index, weight) pair from interpweights; column dimensions
+              of index and weight broadcast against the dimensions of
+              values after axis
+    axis - level axis of values
+    loginterp - interpolate on log scale
+    Returns:
+       out - values on the new levels; only nonzero weights are visited
+             so no (new, old, ...) temporary is made. New values are
+             masked only when all contributing values are masked
+    """
+    index, weight = _sparseweights(weights)
+    vals = np.moveaxis(np.asanyarray(values), axis, 0)
+    mask = np.ma.getmask(vals)
+    data = np.ma.getdata(vals)
+    if loginterp:
+        if mask is np.ma.nomask and (data > 0).all():
+            data = np.log(data)
+        else:
+            logvals = np.ma.log(vals)
+            mask = np.ma.getmaskarray(logvals)
+            data = logvals.filled(0)
+    elif mask is not np.ma.nomask:
+        data = np.where(mask, 0, data)
+    colndim = index.ndim - 2
+    shape = (index.shape[0],) + (1,) * (data.ndim - 1 - colndim) + index.shape[2:]
+    def gather(arr, idx):
+        if colndim == 0:
+            return arr[idx]
+        return np.take_along_axis(arr, idx.reshape(shape), 0)
+    out = None
+    valid = None
+    for k in range(index.shape[1]):
+        idx = index[:, k]
+        wgt = weight[:, k].reshape(shape)
+        term = gather(data, idx) * wgt
+        out = term if out is None else out + term
+        if mask is not np.ma.nomask:
+            kvalid = ~gather(mask, idx) & (wgt != 0)
+            valid = kvalid if valid is None else valid | kvalid
+    if loginterp:
+        out = np.exp(out)
+    if valid is not None:
+        out = np.ma.masked_where(~valid, out)
+    return np.moveaxis(out, 0, axis)
+
 def interpvars(f, weights, dimension, loginterp = []):
     """
     f - PseudoNetCDFFile
-    weights - weights for new dimensions from old dimension dim(new, old)
+    weights - weights for new dimensions from old dimension dim(new, old);
+              a scipy.sparse matrix dim(new, old) or (index, weight) pair
+              from interpweights is also accepted and applied along
+              dimension with applyweights (only nonzero weights are read)
     dimension - which dimensions will be reduced
     loginterp - iterable of keys to interp on log scale
     """
@@ -147,12 +357,22 @@ def interpvars(f, weights, dimension, loginterp = []):
     if hasattr(f, 'groups'):
         outf.groups = OrderedDict()
         for grpk, grpv in f.groups.items():
-            outf.groups[grpk] = interpvars(grpv, weights, dimension)
+            outf.groups[grpk] = interpvars(grpv, weights, dimension, loginterp)
     
     oldd = f.dimensions[dimension]
-    didx, = [i for i, l in enumerate(weights.shape) if len(oldd) == l]
+    sparse = isinstance(weights, tuple) or hasattr(weights, 'tocsr')
+    if sparse:
+        if hasattr(weights, 'tocsr') and weights.shape[1] != len(oldd):
+            raise ValueError('weights have %d old levels; %s has %d' % (weights.shape[1], dimension, len(oldd)))
+        weights = _sparseweights(weights)
+        if weights[0].size > 0 and (weights[0].min() < 0 or weights[0].max() >= len(oldd)):
+            raise ValueError('weights index levels outside %s (0-%d)' % (dimension, len(oldd) - 1))
+        newlen = weights[0].shape[0]
+    else:
+        didx, = [i for i, l in enumerate(weights.shape) if len(oldd) == l]
+        newlen = weights.shape[didx - 1]
     
-    newd = outf.createDimension(dimension, weights.shape[didx - 1])
+    newd = outf.createDimension(dimension, newlen)
     newd.setunlimited(oldd.isunlimited())
     for vark, oldvar in f.variables.items():
         if dimension in oldvar.dimensions:
@@ -164,6 +384,9 @@ def interpvars(f, weights, dimension, loginterp = []):
             newvar = outf.createVariable(vark, oldvar.dtype.char, oldvar.dimensions, **kwds)
             for ak in oldvar.ncattrs():
                 setattr(newvar, ak, getattr(oldvar, ak))
+            if sparse:
+                newvar[:] = applyweights(oldvar[...], weights, dimidx, loginterp = vark in loginterp)
+                continue
             if len(weights.shape) <= len(oldvar.dimensions):
                 weightslice = (None,) * (dimidx) + (Ellipsis,) + (None,) * len(oldvar.dimensions[dimidx + 1:])
             else:
@@ -174,7 +397,10 @@ def interpvars(f, weights, dimension, loginterp = []):
             if not (weightsv.ndim - 1) == oldvar.ndim:
                 warn('Wrong number of dimensions for %s' % (vark,))
             elif vark in loginterp:
-                logv = np.ma.exp((weightsv * np.ma.log(oldvarv)).sum(dimidx + 1))
+                if np.ma.getmask(oldvarv) is np.ma.nomask and (np.asarray(oldvarv) > 0).all():
+                    logv = np.exp((weightsv * np.log(np.ma.getdata(oldvarv))).sum(dimidx + 1))
+                else:
+                    logv = np.ma.exp((weightsv * np.ma.log(oldvarv)).sum(dimidx + 1))
                 newvar[:] = logv
             else:
                 linv = (weightsv * oldvarv).sum(dimidx + 1)
@@ -183,6 +409,133 @@ def interpvars(f, weights, dimension, loginterp = []):
             outf.variables[vark] = oldvar
     return outf
 
+# Nearest neighbor indices for recently used grids keyed by their coordinates
+_lonlatindexcache = OrderedDict()
+_lonlatindexcachesize = 8
+
+def _lonlatindex(longitude, latitude, greatcircle = False):
+    """
+    Return a function that maps longitudes and latitudes to flat indices
+    of the nearest longitude/latitude points. Distance is in degrees or,
+    with greatcircle, along the sphere. The index (a KDTree when scipy
+    is available) is cached for the grid, so it is built once for all
+    files and times on that grid.
+    """
+    import hashlib
+    longitude = np.asarray(np.ma.getdata(longitude), dtype = 'd')
+    latitude = np.asarray(np.ma.getdata(latitude), dtype = 'd')
+    key = (greatcircle, longitude.shape, hashlib.md5(longitude.tobytes()).hexdigest(), hashlib.md5(latitude.tobytes()).hexdigest())
+    if key in _lonlatindexcache:
+        return _lonlatindexcache[key]
+    
+    def topoints(lons, lats):
+        lons = np.asarray(lons, dtype = 'd').ravel()
+        lats = np.asarray(lats, dtype = 'd').ravel()
+        if greatcircle:
+            # chord length increases with great circle distance
+            lonr, latr = np.radians(lons), np.radians(lats)
+            return np.array([np.cos(latr) * np.cos(lonr), np.cos(latr) * np.sin(lonr), np.sin(latr)]).T
+        else:
+            return np.array([lats, lons]).T
+    
+    gridpoints = topoints(longitude, latitude)
+    try:
+        from scipy.spatial import cKDTree
+        tree = cKDTree(gridpoints)
+        def query(lons, lats):
+            return tree.query(topoints(lons, lats))[1].astype('intp')
+    except ImportError:
+        # Brute force in blocks of points to bound memory
+        blocksize = max(1, 2**23 // max(1, gridpoints.shape[0]))
+        def query(lons, lats):
+            points = topoints(lons, lats)
+            idxs = np.zeros(points.shape[0], dtype = 'intp')
+            for start in range(0, points.shape[0], blocksize):
+                block = points[start:start + blocksize]
+                dists = ((gridpoints[:, None, :] - block[None, :, :])**2).sum(-1)
+                idxs[start:start + blocksize] = dists.argmin(0)
+            return idxs
+    
+    _lonlatindexcache[key] = query
+    while len(_lonlatindexcache) > _lonlatindexcachesize:
+        _lonlatindexcache.popitem(last = False)
+    return query
+
+# Delaunay triangulations of recently used grids keyed by their coordinates
+_lonlattriangulationcache = OrderedDict()
+
+def _lonlattriangulation(longitude, latitude):
+    """
+    Return the Delaunay triangulation of longitude/latitude points;
+    triangulations are cached for the grid
+    """
+    import hashlib
+    from scipy.spatial import Delaunay
+    longitude = np.asarray(np.ma.getdata(longitude), dtype = 'd').ravel()
+    latitude = np.asarray(np.ma.getdata(latitude), dtype = 'd').ravel()
+    key = (hashlib.md5(longitude.tobytes()).hexdigest(), hashlib.md5(latitude.tobytes()).hexdigest())
+    if key not in _lonlattriangulationcache:
+        _lonlattriangulationcache[key] = Delaunay(np.array([longitude, latitude]).T)
+        while len(_lonlattriangulationcache) > _lonlatindexcachesize:
+            _lonlattriangulationcache.popitem(last = False)
+    return _lonlattriangulationcache[key]
+
+def _lonlatweights(tri, lons, lats):
+    """
+    Return a sparse (points x grid) matrix of barycentric weights for
+    linear interpolation from the triangulation tri to lons, lats and
+    a boolean array of points outside the triangulation
+    """
+    from scipy.sparse import csr_matrix
+    xi = np.array([lons, lats], dtype = 'd').T
+    simplex = tri.find_simplex(xi)
+    outside = simplex == -1
+    transform = tri.transform[simplex]
+    bary = np.einsum('ijk,ik->ij', transform[:, :2], xi - transform[:, 2])
+    weights = np.concatenate([bary, 1 - bary.sum(1, keepdims = True)], axis = 1)
+    weights[outside] = 0
+    rows = np.repeat(np.arange(xi.shape[0]), weights.shape[1])
+    cols = tri.simplices[simplex].ravel()
+    return csr_matrix((weights.ravel(), (rows, cols)), shape = (xi.shape[0], tri.points.shape[0])), outside
+
+# Interpolators for recently used grid and point sets
+_lonlatinterpcache = OrderedDict()
+
+def _lonlatinterpolator(longitude, latitude, lons, lats, method = 'linear'):
+    """
+    Return a function that interpolates values (with the flattened
+    longitude/latitude grid as the last axis) to lons, lats; points
+    outside the grid are nan. Linear weights are computed once for
+    each grid and point set and cached with the interpolator. Cubic
+    (Clough-Tocher) gradients depend on the values, so only the
+    triangulation is shared between variables.
+    """
+    import hashlib
+    longitude = np.asarray(np.ma.getdata(longitude), dtype = 'd').ravel()
+    latitude = np.asarray(np.ma.getdata(latitude), dtype = 'd').ravel()
+    xi = np.array([lons, lats], dtype = 'd').T
+    key = (method, hashlib.md5(longitude.tobytes()).hexdigest(), hashlib.md5(latitude.tobytes()).hexdigest(), hashlib.md5(xi.tobytes()).hexdigest())
+    if key in _lonlatinterpcache:
+        return _lonlatinterpcache[key]
+    
+    tri = _lonlattriangulation(longitude, latitude)
+    if method == 'linear':
+        weights, outside = _lonlatweights(tri, xi[:, 0], xi[:, 1])
+        def interp(vals):
+            out = weights.dot(vals.reshape(-1, vals.shape[-1]).T).T.reshape(vals.shape[:-1] + (xi.shape[0],))
+            out[..., outside] = np.nan
+            return out
+    else:
+        from scipy.interpolate import CloughTocher2DInterpolator
+        def interp(vals):
+            i2df = CloughTocher2DInterpolator(tri, np.moveaxis(vals, -1, 0))
+            return np.moveaxis(i2df(xi), 0, -1)
+    
+    _lonlatinterpcache[key] = interp
+    while len(_lonlatinterpcache) > _lonlatindexcachesize:
+        _lonlatinterpcache.popitem(last = False)
+    return interp
+
 def extract_from_file(f, lonlatfs, unique = False, gridded = None, method = 'nn', passthrough = True):
     from ..coordutil import getlonlatcoordstr
     lonlatcoordstr = ""
@@ -235,50 +588,26 @@ def extract_lonlat(f, lonlat, unique = False, gridded = None, method = 'nn', pas
         raise e
     outf.lonlatcoords = lonlat
     latlon1d = longitude.ndim == 1 and latitude.ndim == 1
-    if method == 'nn':
+    if method in ('nn', 'KDTree', 'gc'):
         if latlon1d and gridded:
-            latitude = latitude[(slice(None), None, None)]
-            longitude = longitude[(None, slice(None), None)]
+            gridlon, gridlat = np.meshgrid(longitude, latitude)
         else:
-            latitude = latitude[Ellipsis, None]
-            longitude = longitude[Ellipsis, None]
-    
-        lonlatdims = latitude.ndim - 1
-        londists = longitude - lons[(None,) * lonlatdims]
-        latdists = latitude - lats[(None,) * lonlatdims]
-        totaldists = ((latdists**2 + londists**2)**.5)
+            gridlon, gridlat = longitude, latitude
+        idxs = _lonlatindex(gridlon, gridlat, greatcircle = method == 'gc')(lons, lats)
         if latlon1d and not gridded:
-            latidxs, = lonidxs, = np.unravel_index(totaldists.reshape(-1, latdists.shape[-1]).argmin(0), totaldists.shape[:-1])
+            latidxs = lonidxs = idxs
         else:
-            latidxs, lonidxs = np.unravel_index(totaldists.reshape(-1, latdists.shape[-1]).argmin(0), totaldists.shape[:-1])
+            latidxs, lonidxs = np.unravel_index(idxs, gridlat.shape)
         def extractfunc(v, thiscoords):
             newslice = tuple([{'latitude': latidxs, 'longitude': lonidxs, 'points': latidxs, 'PERIM': latidxs}.get(d, slice(None)) for d in thiscoords])
             if newslice == ():
                 return v
             else:
                 return v[:][newslice]
-    elif method == 'KDTree':
-        if latlon1d and gridded:
-            longitude, latitude = np.meshgrid(longitude, latitude)
-        from scipy.spatial import KDTree
-        tree = KDTree(np.ma.array([latitude.ravel(), longitude.ravel()]).T)
-        dists, idxs = tree.query(np.ma.array([lats, lons]).T)
-        if latlon1d and not gridded:
-            latidxs, = lonidxs, = np.unravel_index(idxs, latitude.shape)
-        else:
-            latidxs, lonidxs = np.unravel_index(idxs, latitude.shape)
-        def extractfunc(v, thiscoords):
-            newslice = tuple([{'latitude': latidxs, 'longitude': lonidxs, 'points': latidxs, 'PERIM': latidxs}.get(d, slice(None)) for d in thiscoords])
-            return v[newslice]
     elif method in ('linear', 'cubic'):
-        from scipy.interpolate import LinearNDInterpolator, CloughTocher2DInterpolator
-        if method == 'cubic':
-            interpclass = CloughTocher2DInterpolator
-        else:
-            interpclass = LinearNDInterpolator
         if latlon1d and gridded:
             longitude, latitude = np.meshgrid(longitude, latitude)
-        points = np.array([longitude.ravel(), latitude.ravel()]).T
+        interp = _lonlatinterpolator(longitude, latitude, lons, lats, method = method)
         def extractfunc(v, thiscoords):
             if not 'latitude' in thiscoords or not 'longitude' in thiscoords:
                 return v
@@ -288,9 +617,9 @@ def extract_lonlat(f, lonlat, unique = False, gridded = None, method = 'nn', pas
                 i2 = newshape.index(-1, i1 + 1)
                 assert(i1 == (i2 - 1))
                 newshape.pop(i2)
-            i2df = interpclass(points, np.rollaxis(v.reshape(*newshape), i1, 0))
-            out = np.rollaxis(np.ma.array([i2df(lon, lat) for lat, lon in zip(lats, lons)]), 0, len(newshape))
-            return out
+            # grid is last, so all other dimensions are interpolated at once
+            vals = np.moveaxis(np.asarray(v[...]).reshape(*newshape), i1, -1)
+            return np.ma.array(interp(vals))
         latidxs = extractfunc(latitude, ('latitude', 'longitude'))
     elif method in ('cubic', 'quintic'):
         from scipy.interpolate import interp2d
@@ -301,7 +630,7 @@ def extract_lonlat(f, lonlat, unique = False, gridded = None, method = 'nn', pas
             return np.ma.array([i2df(lat, lon) for lat, lon in zip(lats, lons)])
         latidxs = extractfunc(latitude, '')
     else:
-        raise ValueError('method must be: nn, KDTree')
+        raise ValueError('method must be: nn, KDTree, gc, linear, cubic, quintic')
     if unique:
         tmpx = OrderedDict()
         for lon, lat, lonlatstr in zip(lonidxs, latidxs, outf.lonlatcoords.split('/')):
@@ -350,7 +679,134 @@ def extract_lonlat(f, lonlat, unique = False, gridded = None, method = 'nn', pas
 
 extract = extract_lonlat
 
+def _varprops(var):
+    """
+    Return the properties of var as keywords for a new variable
+    """
+    propd = dict([(pk, getattr(var, pk)) for pk in var.ncattrs()])
+    if 'values' in propd:
+        propd['pvalues'] = propd.pop('values')
+    return propd
+
+def _castvalues(values, dtype):
+    """
+    Return values cast to dtype when both are numeric (e.g., float64
+    statistics of float32 or integer variables); otherwise, values are
+    returned as is
+    """
+    dtype = np.dtype(dtype)
+    vdtype = getattr(values, 'dtype', None)
+    if vdtype is not None and vdtype != dtype and vdtype.kind in 'biufc' and dtype.kind in 'biufc':
+        values = values.astype(dtype)
+    return values
+
+def _unmasked(values):
+    """
+    Return the data of masked arrays that have no masked elements
+    (ndarray methods are much faster than MaskedArray methods)
+    """
+    if isinstance(values, np.ma.MaskedArray) and np.ma.getmask(values) is np.ma.nomask:
+        return np.ma.getdata(values)
+    return values
+
+def _isbasic(item):
+    """
+    True if item is a tuple of slices and integers
+    """
+    return all([isinstance(i, (int, np.integer, slice)) for i in item])
+
+def _composeitem(shape, item, subitem):
+    """
+    Return one index equal to [item][subitem] for an array with shape,
+    where item has one slice per dimension and subitem has one slice or
+    integer per dimension
+    """
+    out = []
+    for n, i, si in zip(shape, item, subitem):
+        r = range(n)[i][si]
+        if isinstance(r, range):
+            r = slice(r.start, r.stop if r.stop >= 0 else None, r.step)
+        out.append(r)
+    return tuple(out)
+
+def _readslab(var, item):
+    """
+    Return var[item] for a tuple of slices and integers; slices with
+    negative strides, which netCDF4 variables do not support, are read
+    in ascending order and reversed
+    """
+    readitem = []
+    flipaxes = []
+    for n, i in zip(var.shape, item):
+        if isinstance(i, slice) and i.step is not None and i.step < 0:
+            r = range(n)[i]
+            if len(r) == 0:
+                i = slice(0, 0)
+            else:
+                flipaxes.append(len([ri for ri in readitem if isinstance(ri, slice)]))
+                i = slice(r[-1], r[0] + 1, -r.step)
+        readitem.append(i)
+    values = var[tuple(readitem)]
+    if len(flipaxes) > 0:
+        values = values[tuple([slice(None, None, -1) if ai in flipaxes else slice(None) for ai in range(max(flipaxes) + 1)])]
+    return values
+
+def _viewvar(outf, varkey, var, item = None):
+    """
+    Return a _slicedvariable of outf with values var[item] (default:
+    all values); views of unmodified _slicedvariables index their
+    source directly
+    """
+    if item is None:
+        item = (slice(None),) * len(var.shape)
+    props = _varprops(var)
+    if isinstance(var, _slicedvariable) and var._copy is None:
+        item = _composeitem(var._var.shape, var._item, item)
+        var = var._var
+    return _slicedvariable(outf, varkey, var, item, **props)
+
+def _lazyfile(inf, func, dimensions = True):
+    """
+    Create a PseudoNetCDFFile with the global properties (and optionally
+    dimensions) of inf whose variables are created by func(outf, varkey)
+    only when requested
+    """
+    from PseudoNetCDF.sci_var import Pseudo2NetCDF
+    p2p = Pseudo2NetCDF(verbose = 0)
+    outf = PseudoNetCDFFile()
+    outf._sourcefiles = (inf,)
+    if dimensions:
+        p2p.addDimensions(inf, outf)
+    p2p.addGlobalProperties(inf, outf)
+    outf.variables = _lazyvariables(outf, func, list(inf.variables.keys()))
+    return outf
+
+def _lazyvariables(outf, func, keys):
+    """
+    Create PseudoNetCDFVariables that build each variable with
+    func(outf, varkey) on first request and keep it, so that
+    attributes set on a variable persist. func should return variables
+    that compute values when read (e.g., _funcvariable), so that the
+    define and populate phases of Pseudo2NetCDF neither repeat the
+    slice/reduce/mask chain nor keep the values of the whole file
+    """
+    def getvar(k):
+        var = func(outf, k)
+        outf.variables[k] = var
+        return var
+    return PseudoNetCDFVariables(getvar, keys)
+
 def mask_vals(f, maskdef, metakeys = 'time layer level latitude longitude time_bounds latitude_bounds longitude_bounds ROW COL LAY TFLAG ETFLAG'.split()):
+    """
+    Mask values of variables other than metakeys using 'type,value',
+    where np.ma.masked_<type> is applied (e.g., 'less,0' or
+    'outside,0,100'), or 'where,expression' with an expression of
+    variables (e.g., 'where,O3 > 100').
+    
+    Returns a new file; f is not modified. Variables are masked as they
+    are read (see _funcvariable) and assignments modify a copy of the
+    masked values. metakeys are the variables of f.
+    """
     mtype = maskdef.split(',')[0]
     mval = ','.join(maskdef.split(',')[1:])
     if mtype == 'where':
@@ -358,14 +814,27 @@ def mask_vals(f, maskdef, metakeys = 'time layer level latitude longitude time_b
         mask = eval(mval, None, f.variables)
     else:
         maskexpr = 'np.ma.masked_%s(var[:], %s)' % (mtype, mval)
-    for varkey, var in f.variables.items():
-        if varkey not in metakeys:
-            try:
-                vout = eval(maskexpr)
-                f.variables[varkey] = PseudoNetCDFMaskedVariable(f, varkey, var.dtype.char, var.dimensions, values = vout, **dict([(pk, getattr(var, pk)) for pk in var.ncattrs()]))
-            except Exception as e:
-                warn('Cannot mask %s: %s' % (varkey, str(e)))
-    return f
+        mask = None
+    
+    def maskvar(outf, varkey):
+        var = f.variables[varkey]
+        if varkey in metakeys:
+            return var
+        def maskvalues(view):
+            vmask = None if mask is None else np.broadcast_to(mask, var.shape)[view._item]
+            return eval(maskexpr, globals(), dict(var = view, mask = vmask))
+        
+        fill_value = var.fill_value if hasattr(var, 'fill_value') else np.ma.default_fill_value(np.dtype(var.dtype))
+        nvar = _funcvariable(outf, varkey, var, maskvalues, fill_value = fill_value, **_varprops(var))
+        try:
+            # masks that do not apply fail on the first element
+            nvar[tuple([slice(0, 1)] * nvar.ndim)]
+        except Exception as e:
+            warn('Cannot mask %s: %s' % (varkey, str(e)))
+            return var
+        return nvar
+    
+    return _lazyfile(f, maskvar)
     
 def slice_dim(f, slicedef, fuzzydim = True):
     """
@@ -373,6 +842,10 @@ def slice_dim(f, slicedef, fuzzydim = True):
         slice_dim(f, 'dim,start,stop,stride')
         
     e.g., slice_dim(f, 'layer,0,47,5') would sample every fifth layer starting at 0
+    
+    Returns a new file; f is not modified. Variables are views (see
+    _slicedvariable), so memmaps and netCDF variables only read the
+    requested hyperslab, and assignments modify a copy.
     """
     inf = f
 
@@ -393,24 +866,18 @@ def slice_dim(f, slicedef, fuzzydim = True):
         for dimk in partial_check:
             inf = slice_dim(inf, '%s,%s,%s,%s' % (dimk, dmin, dmax, dstride))
     
-    from PseudoNetCDF.sci_var import Pseudo2NetCDF
-    p2p = Pseudo2NetCDF(verbose = 0)
-    outf = PseudoNetCDFFile()
-    p2p.addDimensions(inf, outf)
-    p2p.addGlobalProperties(inf, outf)
-    
-    for varkey in inf.variables.keys():
+    dimslice = slice(dmin, dmax, dstride)
+    def slicevar(outf, varkey):
         var = inf.variables[varkey]
-        if dimkey not in var.dimensions:
-            p2p.addVariable(inf, outf, varkey)
-        else:
-            axis = list(var.dimensions).index(dimkey)
-            vout = var[...].swapaxes(0, axis)[dmin:dmax:dstride].swapaxes(0, axis)
-        
-            newlen = vout.shape[axis]
-            newdim = outf.createDimension(dimkey, newlen)
-            newdim.setunlimited(unlimited)
-            outf.variables[varkey] = vout
+        item = [slice(None)] * len(var.dimensions)
+        if dimkey in var.dimensions:
+            item[list(var.dimensions).index(dimkey)] = dimslice
+        return _viewvar(outf, varkey, var, item)
+    
+    outf = _lazyfile(inf, slicevar)
+    newlen = len(range(*dimslice.indices(len(inf.dimensions[dimkey]))))
+    newdim = outf.createDimension(dimkey, newlen)
+    newdim.setunlimited(unlimited)
         
     history = getattr(outf, 'history', '')
     history += historydef
@@ -418,10 +885,16 @@ def slice_dim(f, slicedef, fuzzydim = True):
 
     return outf
     
-def _getfunc(a, func):
+def _getfunc(a, func, **kwds):
     """
     Get an approriate function that takes one optional keyword (axis)
+    
+    kwds are passed to functions found by name outside of numpy (e.g.,
+    times and utcoffset for day functions in userfuncs)
     """
+    if isinstance(a, np.ma.MaskedArray) and np.ma.getmask(a) is np.ma.nomask:
+        # ndarray methods are much faster than MaskedArray methods
+        a = np.ma.getdata(a)
     if not hasattr(func, '__call__'):
         if hasattr(a, func):
             outfunc = getattr(a, func)
@@ -430,11 +903,196 @@ def _getfunc(a, func):
         elif hasattr(np, func):
             outfunc = lambda axis = None, keepdims = True: getattr(np, func)(a, axis = axis, keepdims = keepdims)
         else:
-            outfunc = lambda axis = None, keepdims = True: eval(func)(a, axis = axis, keepdims = keepdims)
+            outfunc = lambda axis = None, keepdims = True: eval(func)(a, axis = axis, keepdims = keepdims, **kwds)
     else:
         outfunc = lambda axis = None, keepdims = True: np.apply_along_axis(func1d = func, axis = axis, arr = a, keepdims = keepdims)
     return outfunc
     
+_streamstats = ('sum', 'mean', 'min', 'max', 'var', 'std', 'count')
+
+def _reducestats(var, axis, stats, chunkbytes = 2**26):
+    """
+    Compute several statistics (see _streamstats) of var along axis in
+    one pass. var is read in chunks along axis of about chunkbytes so
+    that only one chunk is in memory at a time. Sums and variances are
+    accumulated in double precision (variance by pairwise merging of
+    chunk means). Masked values are ignored.
+    
+    Returns an OrderedDict of stat: array with a unity axis; results
+    where no values are valid are masked
+    """
+    stats = list(stats)
+    unknown = [stat for stat in stats if stat not in _streamstats]
+    if len(unknown) > 0:
+        raise ValueError('Cannot stream %s; use %s' % (unknown, _streamstats))
+    shape = var.shape
+    dtype = np.dtype(var.dtype)
+    n = shape[axis]
+    otherlen = int(np.prod(shape[:axis] + shape[axis + 1:]))
+    chunklen = int(max(1, min(n, chunkbytes // max(1, otherlen * dtype.itemsize))))
+    dosum = any([stat in stats for stat in ('sum', 'mean', 'var', 'std')])
+    dovar = any([stat in stats for stat in ('var', 'std')])
+    if dtype.kind == 'f':
+        lo, hi = -np.inf, np.inf
+    elif dtype.kind in 'iu':
+        lo, hi = np.iinfo(dtype).min, np.iinfo(dtype).max
+    else:
+        lo, hi = None, None
+    
+    count = total = mean = m2 = vmin = vmax = None
+    for start in range(0, n, chunklen):
+        chunk = var[(slice(None),) * axis + (slice(start, start + chunklen),)]
+        data = np.ma.getdata(chunk)
+        mask = np.ma.getmask(chunk)
+        if mask is np.ma.nomask or lo is None:
+            # plain ndarray kernels when nothing is masked
+            valid = None
+            keepshape = data.shape[:axis] + (1,) + data.shape[axis + 1:]
+            ccount = np.full(keepshape, data.shape[axis], dtype = 'i')
+        else:
+            valid = ~mask
+            ccount = valid.sum(axis = axis, keepdims = True)
+        if 'min' in stats:
+            cmin = (data if valid is None else np.where(valid, data, hi)).min(axis = axis, keepdims = True)
+            vmin = cmin if vmin is None else np.minimum(vmin, cmin)
+        if 'max' in stats:
+            cmax = (data if valid is None else np.where(valid, data, lo)).max(axis = axis, keepdims = True)
+            vmax = cmax if vmax is None else np.maximum(vmax, cmax)
+        if dosum:
+            if valid is not None:
+                data = np.where(valid, data, 0)
+            csum = data.sum(axis = axis, keepdims = True, dtype = 'd')
+        if dovar:
+            cmean = csum / np.maximum(ccount, 1)
+            if valid is None:
+                cm2 = ((data - cmean)**2).sum(axis = axis, keepdims = True)
+            else:
+                cm2 = (np.where(valid, data - cmean, 0)**2).sum(axis = axis, keepdims = True)
+            if mean is None:
+                mean, m2 = cmean, cm2
+            else:
+                newcount = np.maximum(count + ccount, 1)
+                delta = cmean - mean
+                mean = mean + delta * ccount / newcount
+                m2 = m2 + cm2 + delta**2 * count * ccount / newcount
+        if count is None:
+            count = ccount
+            total = csum if dosum else None
+        else:
+            count = count + ccount
+            total = total + csum if dosum else None
+    
+    empty = count == 0
+    out = OrderedDict()
+    for stat in stats:
+        if stat == 'count':
+            out[stat] = count
+            continue
+        elif stat == 'sum':
+            val = total
+        elif stat == 'mean':
+            val = total / np.maximum(count, 1)
+        elif stat == 'var':
+            val = m2 / np.maximum(count, 1)
+        elif stat == 'std':
+            val = np.sqrt(m2 / np.maximum(count, 1))
+        elif stat == 'min':
+            val = vmin
+        elif stat == 'max':
+            val = vmax
+        out[stat] = np.ma.masked_where(empty, val) if empty.any() else val
+    return out
+
+def _weightchunk(weight, ndim, axis, start, stop):
+    """
+    Return weight[start:stop] along axis as an ndarray with ndim
+    dimensions (missing dimensions are leading as in np.array(weight,
+    ndmin = ndim)); weights that do not span axis are returned whole
+    """
+    pad = ndim - len(weight.shape)
+    if axis < pad or weight.shape[axis - pad] == 1:
+        w = weight[...]
+    else:
+        w = weight[(slice(None),) * (axis - pad) + (slice(start, stop),)]
+    w = np.ma.getdata(w)
+    return w.reshape((1,) * pad + w.shape)
+
+def _weightedreduce(var, axis, func, numweight, denweight = None, chunkbytes = 2**26):
+    """
+    Weighted sum or mean of var along axis with the same result as
+    func(var * numweight) / func(denweight), but var and weights are
+    read in chunks along axis and products are written into a reused
+    buffer, so no full-size temporary is created. numweight and
+    denweight follow reduce_dim (leading dimensions may be omitted and
+    only the first var.shape[axis] values along axis are used).
+    
+    Returns an array with a unity axis; masked values of var are
+    ignored
+    """
+    if func not in ('sum', 'mean'):
+        raise ValueError('Weighted reductions are fused only for sum and mean; got %s' % func)
+    shape = var.shape
+    n = shape[axis]
+    ndim = len(shape)
+    otherlen = int(np.prod(shape[:axis] + shape[axis + 1:]))
+    chunklen = int(max(1, min(n, chunkbytes // max(1, otherlen * 8))))
+    buf = None
+    num = count = den = None
+    denspans = False
+    if denweight is not None:
+        den = _weightchunk(denweight, ndim, axis, 0, n)
+        denspans = den.shape[axis] > 1
+        if denspans:
+            den = None
+    for start in range(0, n, chunklen):
+        stop = min(n, start + chunklen)
+        chunk = var[(slice(None),) * axis + (slice(start, stop),)]
+        w = _weightchunk(numweight, ndim, axis, start, stop)
+        pshape = np.broadcast(np.empty(chunk.shape, dtype = 'b'), w).shape
+        if buf is None or buf.shape != pshape:
+            buf = np.empty(pshape, dtype = 'd')
+        np.multiply(np.ma.getdata(chunk), w, out = buf)
+        mask = np.ma.getmask(chunk)
+        if mask is np.ma.nomask:
+            ccount = np.full((1,) * ndim, stop - start, dtype = 'i')
+        else:
+            mask = np.broadcast_to(mask, pshape)
+            buf[mask] = 0
+            ccount = (~mask).sum(axis = axis, keepdims = True)
+        csum = buf.sum(axis = axis, keepdims = True)
+        num = csum if num is None else num + csum
+        count = ccount if count is None else count + ccount
+        if denspans:
+            csum = _weightchunk(denweight, ndim, axis, start, stop).sum(axis = axis, keepdims = True, dtype = 'd')
+            den = csum if den is None else den + csum
+    
+    empty = count == 0
+    if func == 'mean':
+        num = num / np.maximum(count, 1)
+        if denspans:
+            den = den / n
+    if empty.any():
+        num = np.ma.masked_where(np.broadcast_to(empty, num.shape), num)
+    if den is not None:
+        num = num / den
+    return num
+
+def _getutcoffset(f, utcoffsetdef):
+    """
+    Return UTC offset hours from a number (e.g., -5) or a variable key;
+    longitude variables (key starting with lon or units in degrees)
+    give round(longitude / 15)
+    """
+    try:
+        return float(utcoffsetdef)
+    except ValueError:
+        pass
+    var = f.variables[utcoffsetdef]
+    vals = np.ma.getdata(var[...])
+    if utcoffsetdef.lower().startswith('lon') or getattr(var, 'units', '').strip().startswith('degree'):
+        vals = np.round(vals / 15.)
+    return vals
+
 def reduce_dim(f, reducedef, fuzzydim = True, metakeys = 'time layer level latitude longitude time_bounds latitude_bounds longitude_bounds ROW COL LAY TFLAG ETFLAG'.split()):
     """
     variable dimensions can be reduced using
@@ -443,26 +1101,56 @@ def reduce_dim(f, reducedef, fuzzydim = True, metakeys = 'time layer level latit
     
     e.g., reduce_dim(layer,mean,weight).
     
+    Several statistics (sum, mean, min, max, var, std, count) can be
+    requested at once by joining them with + (e.g., 'TSTEP,mean+max+std');
+    each variable is then read once (see _reducestats) and the output
+    has one variable per statistic named varkey_stat. Metadata variables
+    (metakeys) are reduced with the first statistic and keep their names.
+    
+    Day functions from userfuncs (mda8, daymax, daymin, daymean, daysum,
+    daystd, dayvar) return one value per local day using the file times.
+    They take keywords instead of weights: utcoffset is hours or a
+    variable key (e.g., 'TSTEP,mda8,utcoffset=-5' or
+    'time,mda8,utcoffset=longitude' for longitude / 15) and mincount
+    masks days with fewer values (e.g., 'TSTEP,daymax,mincount=18').
+    Every day with values is returned, including partial first and last
+    days; earlier versions dropped the last day, so use mincount to mask
+    incomplete days instead.
+    
     Weighting is not fully functional.
+    
+    Returns a new file; f is not modified. Variables are reduced as
+    they are read (see _funcvariable), so each hyperslab that is read
+    reads only the matching hyperslab of f, and assignments modify a
+    copy.
     """
     inf = f
     metakeys = [k for k in metakeys if k in inf.variables.keys()]
     historydef = "reduce_dim(f, %s, fuzzydim = %s, metakeys = %s); " % (reducedef, fuzzydim, metakeys)
     import numpy as np
     if hasattr(reducedef, 'split') and hasattr(reducedef, 'count'):
-        commacount = reducedef.count(',')
-        reducevals = reducedef.split(',')
+        allvals = reducedef.split(',')
     else:
-        commacount = len(reducedef)
-        reducevals = reducedef
+        allvals = list(reducedef)
+    # key=value fields are keywords of day functions
+    reducekwds = dict([[p.strip() for p in v.split('=', 1)] for v in allvals if '=' in v])
+    reducevals = [v for v in allvals if '=' not in v]
+    commacount = len(reducevals) - 1
+    if len(reducekwds) > 0 and reducevals[1] not in userfuncs._dayfuncs:
+        raise ValueError('Only day functions (%s) take keywords; got %s' % (', '.join(userfuncs._dayfuncs), reducedef))
+    unknown = set(reducekwds).difference(['utcoffset', 'mincount'])
+    if len(unknown) > 0:
+        raise ValueError('Day function keywords are utcoffset and mincount; got %s' % ', '.join(sorted(unknown)))
+    if commacount > 1 and reducevals[1] in userfuncs._dayfuncs:
+        raise ValueError('Day functions do not support weights; use utcoffset=%s for a UTC offset' % reducevals[2])
     if commacount == 3:
         dimkey, func, numweightkey, denweightkey = reducevals
         numweight = inf.variables[numweightkey]
         denweight = inf.variables[denweightkey]
     elif commacount == 2:
         dimkey, func, numweightkey = reducevals
-        numweight = inf.variables[numweightkey]
         denweightkey = None
+        numweight = inf.variables[numweightkey]
     elif commacount == 1:
         dimkey, func = reducevals
         numweightkey = None
@@ -470,58 +1158,109 @@ def reduce_dim(f, reducedef, fuzzydim = True, metakeys = 'time layer level latit
     if fuzzydim:
         partial_check = [key for key in inf.dimensions if dimkey == key[:len(dimkey)] and key[len(dimkey):].isdigit()]
         for dimk in partial_check:
-            if commacount == 1:
-                inf = reduce_dim(inf, '%s,%s' % (dimk, func),)
-            elif commacount == 2:
-                inf = reduce_dim(inf, '%s,%s,%s' % (dimk, func, numweightkey),)
-            elif commacount == 3:
-                inf = reduce_dim(inf, '%s,%s,%s,%s' % (dimk, func, numweightkey, denweightkey),)
+            inf = reduce_dim(inf, ','.join([dimk] + [str(v) for v in allvals[1:]]),)
     if dimkey not in inf.dimensions:
         warn('%s not in file' % dimkey)
         return inf
-
-    from PseudoNetCDF.sci_var import Pseudo2NetCDF
-    p2p = Pseudo2NetCDF(verbose = 0)
-    outf = PseudoNetCDFFile()
-    p2p.addDimensions(inf, outf)
-    del outf.dimensions[dimkey]
-    p2p.addGlobalProperties(inf, outf)
     
-    #unlimited = inf.dimensions[dimkey].isunlimited()
-    #outf.createDimension(dimkey, 1)
-    #if unlimited:
-    #    outf.dimensions[dimkey].setunlimited(True)
-
-    for varkey in inf.variables.keys():
-        var = inf.variables[varkey]
-        if dimkey not in var.dimensions:
-            p2p.addVariable(inf, outf, varkey)
-            continue
-        
-        axis = list(var.dimensions).index(dimkey)
-        #def addunitydim(var):
-        #    return var[(slice(None),) * (axis + 1) + (None,)]
-        vreshape = var[slice(None)]
-        #vreshape = addunitydim(var)
+    # day functions (e.g., mda8, daymax) bucket by local day using the
+    # file times (time, TFLAG or tau0) and an optional UTC offset
+    dayopts = {}
+    daykwds = {}
+    if 'mincount' in reducekwds:
+        daykwds['mincount'] = int(reducekwds['mincount'])
+    if func in userfuncs._dayfuncs:
+        from PseudoNetCDF.coordutil import gettimes
+        try:
+            times = gettimes(inf)
+            if len(times) != len(inf.dimensions[dimkey]):
+                times = None
+        except Exception:
+            times = None
+        dayopts = dict(times = times, utcoffset = _getutcoffset(inf, reducekwds.get('utcoffset', '0')))
+    
+    if isinstance(func, (str, unicode)) and all([stat in _streamstats for stat in func.split('+')]):
+        stats = func.split('+')
+        func = stats[0]
+    else:
+        stats = None
+    multistat = stats is not None and len(stats) > 1
+    if multistat and numweightkey is not None:
+        raise ValueError('Weighted reductions support only one function; got %s' % '+'.join(stats))
+    
+    def alignitem(shape, item):
+        # item for an array with shape whose leading dimensions may be
+        # omitted (like np.array(weight, ndmin = ndim)); unity
+        # dimensions broadcast
+        pad = len(item) - len(shape)
+        if pad < 0:
+            return (Ellipsis,)
+        return tuple([slice(None) if l == 1 else i for i, l in zip(item[pad:], shape)])
+    
+    def weightview(weight, view):
+        # the part of weight that spans view
+        return _slicedvariable(None, 'weight', weight, alignitem(weight.shape, view._item))
+    
+    def funcvalues(view, axis):
+        if func not in userfuncs._dayfuncs:
+            return _getfunc(view[...], func)(axis = axis, keepdims = True)
+        utcoffset = dayopts['utcoffset']
+        opts = dayopts
+        item = view._item[:axis] + view._item[axis + 1:]
+        if np.ndim(utcoffset) > 0 and len(item) >= np.ndim(utcoffset):
+            opts = dict(dayopts, utcoffset = np.asarray(utcoffset)[alignitem(np.shape(utcoffset), item)])
+        vout = _getfunc(view[...], func, **dict(opts, **daykwds))(axis = axis, keepdims = True)
+        if vout.shape[axis] != outlen:
+            # the offsets of this hyperslab span fewer days than all
+            # offsets; other days are masked
+            start = userfuncs._dayspan(func, view.shape[axis], **opts)[0] - userfuncs._dayspan(func, view.shape[axis], **dayopts)[0]
+            out = np.ma.masked_all(vout.shape[:axis] + (outlen,) + vout.shape[axis + 1:], dtype = vout.dtype)
+            out[(slice(None),) * axis + (slice(start, start + vout.shape[axis]),)] = vout
+            vout = out
+        return vout
+    
+    # statistics of one input hyperslab are computed together and
+    # handed out as each output variable reads that hyperslab
+    statcache = {}
+    def statvalues(varkey, stat, axis, view):
+        cachekey = (varkey, repr(view._item))
+        if cachekey not in statcache:
+            statcache[cachekey] = [_reducestats(view, axis, stats), set(stats)]
+        vals, remaining = statcache[cachekey]
+        remaining.discard(stat)
+        if len(remaining) == 0:
+            del statcache[cachekey]
+        return _unmasked(vals[stat])
+    
+    def reducevalues(varkey, axis, view):
         if not varkey in metakeys:
-            if numweightkey is None:
-                vout = _getfunc(vreshape, func)(axis = axis, keepdims = True)
+            if numweightkey is None and stats is not None:
+                vout = _reducestats(view, axis, [func])[func]
+            elif numweightkey is None:
+                vout = funcvalues(view, axis)
+            elif func in ('sum', 'mean'):
+                vout = _weightedreduce(view, axis, func, weightview(numweight, view), weightview(denweight, view) if denweightkey is not None else None)
             elif denweightkey is None:
-                wvar = var * np.array(numweight, ndmin = var.ndim)[(slice(None),)*axis + (slice(0,var.shape[axis]),)]
+                wvar = view[...] * np.array(weightview(numweight, view), ndmin = view.ndim)[(slice(None),)*axis + (slice(0,view.shape[axis]),)]
                 vout = getattr(wvar[(slice(None),) * (axis + 1) + (None,)], func)(axis = axis)
-                vout.units = vout.units.strip() + ' * ' + numweight.units.strip()
-                if hasattr(vout, 'base_units'):
-                    vout.base_units = vout.base_units.strip() + ' * ' + numweight.base_units.strip()
             else:
-                nwvar = var * np.array(numweight, ndmin = var.ndim)[(slice(None),)*axis + (slice(0,var.shape[axis]),)]
-                vout = getattr(nwvar[(slice(None),) * (axis + 1) + (None,)], func)(axis = axis) / getattr(np.array(denweight, ndmin = var.ndim)[(slice(None),)*axis + (slice(0,var.shape[axis]), None)], func)(axis = axis)
+                nwvar = view[...] * np.array(weightview(numweight, view), ndmin = view.ndim)[(slice(None),)*axis + (slice(0,view.shape[axis]),)]
+                vout = getattr(nwvar[(slice(None),) * (axis + 1) + (None,)], func)(axis = axis) / getattr(np.array(weightview(denweight, view), ndmin = view.ndim)[(slice(None),)*axis + (slice(0,view.shape[axis]), None)], func)(axis = axis)
         else:
             if '_bounds' not in varkey and '_bnds' not in varkey:
-                vout = _getfunc(vreshape, func)(axis = axis, keepdims = True)
+                if stats is not None:
+                    vout = _reducestats(view, axis, [func])[func]
+                else:
+                    vout = funcvalues(view, axis)
             else:
-                vout = _getfunc(vreshape, func)(axis = axis, keepdims = True)
-                vmin = _getfunc(vreshape, 'min')(axis = axis, keepdims = True)
-                vmax = _getfunc(vreshape, 'max')(axis = axis, keepdims = True)
+                if stats is not None:
+                    vals = _reducestats(view, axis, set([func, 'min', 'max']))
+                    vout, vmin, vmax = np.ma.array(vals[func]), vals['min'], vals['max']
+                else:
+                    vreshape = view[...]
+                    vout = funcvalues(view, axis)
+                    vmin = _getfunc(vreshape, 'min')(axis = axis, keepdims = True)
+                    vmax = _getfunc(vreshape, 'max')(axis = axis, keepdims = True)
                 if 'lon' in varkey or 'time' in varkey:
                     try:
                         vout[..., [0, 3]] = vmin[..., [0, 3]]
@@ -532,12 +1271,57 @@ def reduce_dim(f, reducedef, fuzzydim = True, metakeys = 'time layer level latit
                     nmin = vout.shape[-1] // 2
                     vout[..., :nmin] = vmin[..., :nmin]
                     vout[..., nmin:] = vmax[..., nmin:]
-        if dimkey not in outf.dimensions:
-             outdim = outf.createDimension(dimkey, vout.shape[axis])
-             outdim.setunlimited(inf.dimensions[dimkey].isunlimited())
-        nvar = outf.variables[varkey] = PseudoNetCDFMaskedVariable(outf, varkey, var.dtype.char, var.dimensions, values = vout)
-        for k in var.ncattrs():
-            setattr(nvar, k, getattr(var, k))
+        return _unmasked(vout)
+    
+    def reducevar(outf, varkey):
+        if multistat and varkey not in inf.variables:
+            srckey, stat = varkey.rsplit('_', 1)
+        else:
+            srckey, stat = varkey, None
+        var = inf.variables[srckey]
+        if dimkey not in var.dimensions:
+            return _viewvar(outf, varkey, var)
+        
+        axis = list(var.dimensions).index(dimkey)
+        shape = list(var.shape)
+        shape[axis] = len(outf.dimensions[dimkey])
+        props = _varprops(var)
+        props.setdefault('fill_value', var.fill_value if hasattr(var, 'fill_value') else np.ma.default_fill_value(np.dtype(var.dtype)))
+        if stat is None:
+            return _funcvariable(outf, varkey, var, lambda view: reducevalues(srckey, axis, view), axis = axis, shape = shape, **props)
+        nvar = _funcvariable(outf, varkey, var, lambda view: statvalues(srckey, stat, axis, view), axis = axis, shape = shape, **props)
+        if stat == 'count':
+            nvar.units = 'count'
+        elif stat == 'var' and hasattr(var, 'units'):
+            nvar.units = '(%s)**2' % var.units.strip()
+        return nvar
+
+    outf = _lazyfile(inf, reducevar)
+    if multistat:
+        outkeys = []
+        for varkey, var in inf.variables.items():
+            if dimkey in var.dimensions and varkey not in metakeys:
+                outkeys.extend(['%s_%s' % (varkey, stat) for stat in stats])
+            else:
+                outkeys.append(varkey)
+        outf.variables = _lazyvariables(outf, reducevar, outkeys)
+    
+    # numpy reductions and weighted reductions keep a unity
+    # dimension; other functions (e.g., daymax) must be evaluated
+    # once to learn the output length
+    if func in userfuncs._dayfuncs:
+        outlen = userfuncs._dayspan(func, len(inf.dimensions[dimkey]), **dayopts)[1]
+    elif numweightkey is not None or (isinstance(func, (str, unicode)) and (hasattr(np, func) or hasattr(np.ma, func) or hasattr(np.ndarray, func))):
+        outlen = 1
+    else:
+        for varkey in inf.variables.keys():
+            var = inf.variables[varkey]
+            if dimkey in var.dimensions:
+                axis = list(var.dimensions).index(dimkey)
+                outlen = reducevalues(varkey, axis, _viewvar(None, varkey, var)).shape[axis]
+                break
+    outdim = outf.createDimension(dimkey, outlen)
+    outdim.setunlimited(inf.dimensions[dimkey].isunlimited())
 
     history = getattr(outf, 'history', '')
     history += historydef
@@ -581,6 +1365,173 @@ def pncfunc(func, ifile1, coordkeys = [], verbose = 0):
         outvar.fill_value = -999
     return tmpfile
 
+class _slicedvariable(PseudoNetCDFLazyVariable):
+    """
+    Variable with values var[item] for a tuple of slices item (see
+    slice_dim); indexing composes the index with item, so only the
+    requested hyperslab of var is read (see _readslab)
+    """
+    _copyonwrite = True
+    def __init__(self, parent, name, var, item, **props):
+        self._parent = parent
+        self._name = name
+        self._var = var
+        self._item = tuple(item)
+        self.dimensions = tuple(var.dimensions)
+        self.shape = tuple([len(range(n)[i]) for n, i in zip(var.shape, self._item)])
+        self.dtype = np.dtype(var.dtype)
+        if hasattr(var, 'fill_value') and 'fill_value' not in props:
+            self.fill_value = var.fill_value
+        for k, v in props.items():
+            setattr(self, k, v)
+    
+    def _getitem(self, item):
+        item = self._expanditem(item)
+        if len(item) != self.ndim or not _isbasic(item):
+            return self[...][item]
+        return self._wrap(_readslab(self._var, _composeitem(self._var.shape, self._item, item)))
+
+class _funcvariable(PseudoNetCDFLazyVariable):
+    """
+    Variable with values func(view) computed when indexed (see
+    mask_vals, mesh_dim, convolve_dim and reduce_dim), where view is a
+    _slicedvariable of var that spans the requested index along every
+    dimension except axis. func returns values with the dimensions of
+    var and may change the length of axis (see shape). Values are not
+    kept, so reading one hyperslab (e.g., in Pseudo2NetCDF) reads and
+    computes only that hyperslab.
+    
+    axis - dimension that func transforms (e.g., reduces); None for
+           elementwise functions
+    shape - shape of the result (default: var.shape)
+    """
+    _copyonwrite = True
+    def __init__(self, parent, name, var, func, axis = None, shape = None, **props):
+        self._parent = parent
+        self._name = name
+        self._var = var
+        self._func = func
+        self._axis = axis
+        self.dimensions = tuple(var.dimensions)
+        self.shape = tuple(var.shape if shape is None else shape)
+        self.dtype = np.dtype(var.dtype)
+        if hasattr(var, 'fill_value') and 'fill_value' not in props:
+            self.fill_value = var.fill_value
+        for k, v in props.items():
+            setattr(self, k, v)
+    
+    def _getitem(self, item):
+        item = self._expanditem(item)
+        if len(item) != self.ndim or not _isbasic(item):
+            return self[...][item]
+        srcitem = []
+        outitem = []
+        for ii, (n, i) in enumerate(zip(self.shape, item)):
+            if ii == self._axis:
+                srcitem.append(slice(None))
+                outitem.append(i)
+            elif isinstance(i, slice):
+                srcitem.append(i)
+                outitem.append(slice(None))
+            else:
+                i = range(n)[i]
+                srcitem.append(slice(i, i + 1))
+                outitem.append(0)
+        view = _slicedvariable(None, self._name, self._var, srcitem)
+        values = self._func(view)[tuple(outitem)]
+        return self._wrap(_castvalues(values, self.dtype))
+
+_opufuncs = {'+': np.add, '-': np.subtract, '*': np.multiply, '/': np.true_divide,
+             '//': np.floor_divide, '%': np.remainder, '**': np.power,
+             '&': np.bitwise_and, '|': np.bitwise_or, '^': np.bitwise_xor,
+             '<<': np.left_shift, '>>': np.right_shift, '<': np.less,
+             '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal,
+             '==': np.equal, '!=': np.not_equal}
+
+class _binopvariable(PseudoNetCDFLazyVariable):
+    """
+    Variable with values func(var1[item], var2[item]) computed when
+    indexed (see pncbo and pncbfunc). Reads that span many elements of
+    the first dimension are computed one slab of about chunkbytes at a
+    time into a single output array; numeric operators (ufunc) write
+    each slab directly into that array.
+    
+    ufunc - applied to unmasked data of var1 and var2; invalid results
+            are masked (pncbo)
+    func - applied to var1 and var2 values; invalid or masked results
+           are filled with fill_value (pncbfunc)
+    """
+    chunkbytes = 2**26
+    _copyonwrite = True
+    def __init__(self, parent, name, var1, var2, ufunc = None, func = None, fill_value = -999, **props):
+        self._parent = parent
+        self._name = name
+        self._var1 = var1
+        self._var2 = var2
+        self._ufunc = ufunc
+        self._func = func
+        self.dimensions = tuple(var1.dimensions)
+        self.shape = tuple(var1.shape)
+        self.dtype = self._resultdtype(var1, var2)
+        self.fill_value = fill_value
+        for k, v in props.items():
+            setattr(self, k, v)
+    
+    def _resultdtype(self, var1, var2):
+        """
+        Return the dtype of the result (e.g., bool for comparisons and
+        float64 for int / int) from one element of each operand dtype
+        """
+        dtype1, dtype2 = np.dtype(var1.dtype), np.dtype(var2.dtype)
+        try:
+            with np.errstate(all = 'ignore'):
+                return np.asarray(self._apply(np.ones(1, dtype = dtype1), np.ones(1, dtype = dtype2), cast = False)).dtype
+        except Exception:
+            return np.result_type(dtype1, dtype2)
+    
+    def _apply(self, val1, val2, out = None, cast = True):
+        if self._ufunc is not None:
+            val1, val2 = np.ma.getdata(val1), np.ma.getdata(val2)
+            if out is not None and out.shape == np.broadcast(val1, val2).shape:
+                return self._ufunc(val1, val2, out = out)
+            val = self._ufunc(val1, val2)
+        else:
+            val = np.ma.filled(np.ma.masked_invalid(self._func(val1, val2)), self.fill_value)
+        if out is None:
+            return np.asarray(val).astype(self.dtype) if cast else val
+        out[...] = val
+        return out
+    
+    def _finish(self, val):
+        if self._ufunc is not None and val.dtype.kind in 'fc' and not np.isfinite(val).all():
+            return np.ma.masked_invalid(val)
+        return val
+    
+    def _getitem(self, item):
+        var1, var2 = self._var1, self._var2
+        if tuple(var1.shape) != tuple(var2.shape):
+            # broadcasting operands are evaluated whole
+            return self._finish(self._apply(var1[...], var2[...])[item])
+        item = self._expanditem(item)
+        if self.ndim == 0 or len(item) != self.ndim or not isinstance(item[0], slice) or \
+           not all([isinstance(i, (int, np.integer, slice)) for i in item]):
+            return self._finish(self._apply(var1[item], var2[item]))
+        rows = range(self.shape[0])[item[0]]
+        rowbytes = self.dtype.itemsize * int(np.prod(self.shape[1:]))
+        chunklen = int(max(1, self.chunkbytes // max(1, rowbytes)))
+        if len(rows) <= chunklen:
+            return self._finish(self._apply(var1[item], var2[item]))
+        out = None
+        for start in range(0, len(rows), chunklen):
+            slab = rows[start:start + chunklen]
+            stop = slab.stop if slab.stop >= 0 else None
+            slabitem = (slice(slab.start, stop, slab.step),) + item[1:]
+            val1, val2 = var1[slabitem], var2[slabitem]
+            if out is None:
+                out = np.empty((len(rows),) + np.shape(val1)[1:], dtype = self.dtype)
+            self._apply(val1, val2, out = out[start:start + len(slab)])
+        return self._finish(out)
+
 def pncbo(op, ifile1, ifile2, coordkeys = [], verbose = 0):
     """
     Perform binary operation (op) on all variables in ifile1
@@ -589,31 +1540,36 @@ def pncbo(op, ifile1, ifile2, coordkeys = [], verbose = 0):
     rfile = ifile1 <op> ifile2
     
     op can be any valid operator (e.g., +, -, /, *, **, &, ||)
+    
+    Variables are computed when read, one slab at a time (see
+    _binopvariable), so neither file is copied.
     """
-    from PseudoNetCDF.sci_var import Pseudo2NetCDF
-    # Copy infile1 to a temporary PseudoNetCDFFile
-    p2p = Pseudo2NetCDF()
-    p2p.verbose = verbose
-    tmpfile = PseudoNetCDFFile()
-    p2p.addGlobalProperties(ifile1, tmpfile)
-    p2p.addDimensions(ifile1, tmpfile)
+    if op.strip() in _opufuncs:
+        ufunc = _opufuncs[op.strip()]
+    else:
+        ufunc = lambda val1, val2: eval('val1 %s val2' % op)
     
-    # For each variable, assign the new value
-    # to the tmpfile variables.
+    binopkeys = []
     for k in ifile1.variables.keys():
-        in1var = ifile1.variables[k]
         if k not in ifile2.variables.keys() or k in coordkeys:
             warn('%s not found in ifile2' % k)
-            p2p.addVariable(ifile1, tmpfile, k)
         else:
-            in2var = ifile2.variables[k]
-            propd = dict([(ak, getattr(in1var, ak)) for ak in in1var.ncattrs()])
-            unit1 = getattr(in1var, 'units', 'unknown')
-            unit2 = getattr(in2var, 'units', 'unknown')
-            propd['units'] = '(%s) %s (%s)' % (unit1, op, unit2)
-            outval = np.ma.masked_invalid(eval('in1var[...] %s in2var[...]' % op).view(np.ndarray))
-            outvar = tmpfile.createVariable(k, in1var.dtype.char, in1var.dimensions, fill_value = -999, values = outval)
-    return tmpfile
+            binopkeys.append(k)
+    
+    def binopvar(outf, k):
+        in1var = ifile1.variables[k]
+        if k not in binopkeys:
+            return in1var
+        in2var = ifile2.variables[k]
+        propd = dict([(ak, getattr(in1var, ak)) for ak in in1var.ncattrs() if ak not in ('_FillValue', 'fill_value')])
+        unit1 = getattr(in1var, 'units', 'unknown')
+        unit2 = getattr(in2var, 'units', 'unknown')
+        propd['units'] = '(%s) %s (%s)' % (unit1, op, unit2)
+        return _binopvariable(outf, k, in1var, in2var, ufunc = ufunc, **propd)
+    
+    outf = _lazyfile(ifile1, binopvar)
+    outf._sourcefiles = (ifile1, ifile2)
+    return outf
 
 def pncbfunc(func, ifile1, ifile2, coordkeys = [], verbose = 0):
     """
@@ -623,32 +1579,24 @@ def pncbfunc(func, ifile1, ifile2, coordkeys = [], verbose = 0):
     rfile = ifile1 <op> ifile2
     
     op can be any valid operator (e.g., +, -, /, *, **, &, ||)
-    """
-    from PseudoNetCDF.sci_var import Pseudo2NetCDF
-    
-    # Copy infile1 to a temporary PseudoNetCDFFile
-    p2p = Pseudo2NetCDF()
-    p2p.verbose = verbose
-    tmpfile = PseudoNetCDFFile()
-    p2p.convert(ifile1, tmpfile)
     
-    # For each variable, assign the new value
-    # to the tmpfile variables.
-    for k in tmpfile.variables.keys():
-        if k in coordkeys: continue
-        outvar = tmpfile.variables[k]
+    Variables are computed when read, one slab at a time (see
+    _binopvariable), so neither file is copied.
+    """
+    def bfuncvar(outf, k):
         in1var = ifile1.variables[k]
+        if k in coordkeys:
+            return in1var
         if k not in ifile2.variables.keys():
             warn('%s not found in ifile2' % k)
-            continue
+            return in1var
         in2var = ifile2.variables[k]
-        outval = np.ma.filled(np.ma.masked_invalid(func(in1var[...], in2var[...])), -999)
-        if outvar.ndim > 0:
-            outvar[:] = outval
-        else:
-            outvar.itemset(outval)
-        outvar.fill_value = -999
-    return tmpfile
+        propd = dict([(ak, getattr(in1var, ak)) for ak in in1var.ncattrs() if ak not in ('_FillValue', 'fill_value')])
+        return _binopvariable(outf, k, in1var, in2var, func = func, **propd)
+    
+    outf = _lazyfile(ifile1, bfuncvar)
+    outf._sourcefiles = (ifile1, ifile2)
+    return outf
 
 def _namemangler(k):
     k = k.replace('$', 'dollar')
@@ -657,53 +1605,81 @@ def _namemangler(k):
     k = k.replace(')', 'rparen')
     return k
 
-def pncexpr(expr, ifile, verbose = 0):
+_exprcache = {}
+_exprconstants = {}
+
+def _compileexpr(expr):
+    """
+    Return (code, symbol names, assigned names) for expr; results are
+    cached so that applying the same expression to many files compiles
+    and parses its symbol table only once
+    """
+    if expr not in _exprcache:
+        from symtable import symtable
+        comp = compile(expr, 'none', 'exec')
+        symbols = symtable(expr, '<pncexpr>', 'exec').get_symbols()
+        names = [symbol.get_name() for symbol in symbols]
+        assigned = [symbol.get_name() for symbol in symbols if symbol.is_assigned()]
+        _exprcache[expr] = comp, names, assigned
+    return _exprcache[expr]
+
+def _getexprnamespace(ifile):
+    """
+    Return a new namespace for pncexpr with np, ifile and the
+    scipy.constants names (imported once)
+    """
+    if len(_exprconstants) == 0:
+        exec('from scipy.constants import *', None, _exprconstants)
+    vardict = dict(_exprconstants)
+    vardict['ifile'] = ifile
+    vardict['np'] = np
+    return vardict
+
+def pncexpr(expr, ifile, verbose = 0, chunksize = None):
     """
     Evaluate an arbitrary expression in the context of ifile.variables
     and add the result to the file with appropriate units.
+    
+    Only variables named in expr are read (and copied); other variables
+    are passed through from ifile when requested. Compiled expressions
+    are cached across calls.
+    
+    chunksize - if not None, evaluate the expression on chunksize
+                elements of the leading dimension at a time. This is only
+                valid for elementwise expressions, where each output
+                element depends only on inputs at the same leading index.
     """
-    from PseudoNetCDF.sci_var import Pseudo2NetCDF
-    from symtable import symtable
+    comp, names, assignednames = _compileexpr(expr)
     
-    # Copy file to temporary PseudoNetCDF file
-    comp = compile(expr, 'none', 'exec')
-
-                    
-    #varkeys = [key for key in comp.co_names if key in ifile.variables]
-    #getvarpnc(ifile, varkeys)
-    varpnc = tmpfile = getvarpnc(ifile, None)
-
     # Get NetCDF variables as a dictionary with 
     # names mangled to allow special characters
     # in the names
-    vardict = dict([(_namemangler(k), varpnc.variables[k]) for k in varpnc.variables.keys()])
-    # Compile the expr
-    symtbl = symtable(expr, '<pncexpr>', 'exec')
-    symbols = symtbl.get_symbols()
-    for symbol in symbols:
-        key = symbol.get_name()
-        if key in vardict:
-            tmpvar = vardict[key]
-            break
+    mangled = dict([(_namemangler(k), k) for k in ifile.variables.keys()])
+    varkeys = [mangled[name] for name in names if name in mangled]
+    if chunksize is None:
+        varpnc = getvarpnc(ifile, varkeys)
+    else:
+        varpnc = ifile
+    tmpfile = _lazyfile(ifile, lambda outf, k: varpnc.variables[k] if k in varpnc.variables else ifile.variables[k])
+    
+    if len(varkeys) > 0:
+        tmpvar = varpnc.variables[varkeys[0]]
     else:
         tmpvar = PseudoNetCDFVariable(None, 'temp', 'f', ())
     
     propd = dict([(k, getattr(tmpvar, k)) for k in tmpvar.ncattrs()])
     dimt = tmpvar.dimensions
-    # Add all used constants as properties
-    # of the output file
-    vardict['ifile'] = ifile
-    vardict['np'] = np
-    exec('from scipy.constants import *', None, vardict)
-    oldkeys = set(vardict.keys())
     
-    # Assign expression to new variable.
-    exec(comp, None, vardict)
+    if chunksize is None:
+        vardict = _getexprnamespace(ifile)
+        vardict.update([(_namemangler(k), varpnc.variables[k]) for k in varkeys])
+        
+        # Assign expression to new variable.
+        exec(comp, None, vardict)
+    else:
+        vardict = _exprchunks(comp, assignednames, ifile, varkeys, dimt, chunksize)
     
-    #newkeys = set(vardict.keys())
-    #assignedkeys = [k for k in newkeys.difference(oldkeys) if k[:1] != '_']
-    assignedkeys = [s.get_name() for s in symbols if s.is_assigned()]
-    assignedkeys = [k for k in assignedkeys if k in vardict]
+    assignedkeys = [k for k in assignednames if k in vardict]
     for key in assignedkeys:
         val = vardict[key]
         # if the output variable has no dimensions, there is likely a problem
@@ -714,7 +1690,65 @@ def pncexpr(expr, ifile, verbose = 0):
             tmpfile.createVariable(key, val.dtype.char, dimt, values = val, **propd)
     
     return tmpfile
+
+def _exprchunks(comp, assignednames, ifile, varkeys, dimt, chunksize):
+    """
+    Execute comp on chunks of the leading dimension (dimt[0]) of
+    variables in varkeys and return a namespace with assigned names
+    holding whole arrays; each chunk is read (and copied) only when it
+    is evaluated
+    """
+    if len(dimt) == 0:
+        raise ValueError('Chunked expressions require a variable with dimensions')
+    leaddim = dimt[0]
+    n = len(ifile.dimensions[leaddim])
+    out = {}
+    outdims = {}
+    outattrs = {}
+    for start in range(0, n, chunksize):
+        stop = min(n, start + chunksize)
+        vardict = _getexprnamespace(ifile)
+        for varkey in varkeys:
+            var = ifile.variables[varkey]
+            if var.dimensions[:1] == (leaddim,):
+                var = var[start:stop]
+            else:
+                var = var[...]
+            # expressions may assign in place (e.g., O3[:] *= 2), so
+            # each chunk is a copy rather than a view of ifile
+            if isinstance(var, np.ndarray):
+                var = var.copy()
+            vardict[_namemangler(varkey)] = var
+        exec(comp, None, vardict)
+        for key in assignednames:
+            if key not in vardict or key in out and out[key] is None:
+                continue
+            val = vardict[key]
+            if np.ndim(val) == 0 or np.shape(val)[0] != stop - start:
+                # not elementwise along leading dimension; keep last value
+                out[key] = None
+                continue
+            if key not in out:
+                if np.ma.isMaskedArray(val):
+                    out[key] = np.ma.zeros((n,) + val.shape[1:], dtype = val.dtype)
+                else:
+                    out[key] = np.zeros((n,) + val.shape[1:], dtype = val.dtype)
+                outdims[key] = getattr(val, 'dimensions', None)
+                outattrs[key] = dict([(k, getattr(val, k)) for k in getattr(val, 'ncattrs', lambda: [])()])
+            out[key][start:stop] = val
     
+    result = {}
+    for key, val in out.items():
+        if val is None:
+            warn('%s is not elementwise along %s; it was not kept' % (key, leaddim))
+            continue
+        dims = outdims[key]
+        if dims is None or len(dims) != val.ndim:
+            result[key] = val
+        else:
+            result[key] = PseudoNetCDFMaskedVariable(None, key, val.dtype.char, dims, values = val, **outattrs[key])
+    return result
+
 def seqpncbo(ops, ifiles, coordkeys = []):
     for op in ops:
         ifile1, ifile2 = ifiles[:2]
@@ -724,28 +1758,67 @@ def seqpncbo(ops, ifiles, coordkeys = []):
     return ifiles
 
 def mesh_dim(f, mesh_def):
-    dimkey, meshfactor, aggfunc = mesh_def.split(',')
+    """
+    Coarsen or refine dimension dimkey using 'dim,factor,function'
+    
+    factor > 1 - coarsen by aggregating blocks of factor elements with
+                 function (e.g., ROW,3,mean); blocks are reduced in one
+                 call on a reshaped view (no copies)
+    factor < 1 - refine by 1/factor; mean and repeat repeat values, sum
+                 spreads values (repeat * factor), and other functions
+                 are called as function(values, 1/factor, axis)
+    
+    Returns a new file (or f if factor is 1); f is not modified.
+    Variables are computed as they are read (see _funcvariable) and
+    assignments modify a copy.
+    """
+    dimkey, meshfactor, aggfunc = mesh_def.split(',', 2)
     meshfactor = float(meshfactor)
-    spread=lambda a, n, axis: a.repeat(n, axis) * meshfactor
-    try:
+    aggname = aggfunc.strip()
+    if hasattr(np, aggname):
+        aggfunc = getattr(np, aggname)
+    else:
         aggfunc = eval(aggfunc)
-    except:
-        aggfunc = getattr(np, aggfunc)
     if meshfactor < 1.:
-        oldres = int(1./meshfactor)
-        assert(1./meshfactor == oldres)
-        newres = 1
+        factor = int(round(1. / meshfactor))
+        assert(np.allclose(1. / meshfactor, factor))
+        dimlen = len(f.dimensions[dimkey]) * factor
     elif meshfactor > 1.:
-        newres = int(meshfactor)
-        assert(meshfactor == newres)
-        oldres = 1
-    from PseudoNetCDF.MetaNetCDF import newresolution
-    nrf = newresolution(f, dimension = dimkey, oldres = oldres, newres = newres, repeat_method = aggfunc, condense_method = aggfunc)
-    f.dimensions[dimkey] = nrf.dimensions[dimkey]
-    for k, v in f.variables.items():
-        if dimkey in v.dimensions:
-            f.variables[k] = nrf.variables[k]
-    return f
+        factor = int(meshfactor)
+        assert(meshfactor == factor)
+        dimlen = len(f.dimensions[dimkey])
+        if dimlen % factor != 0:
+            raise ValueError('%s length (%d) must be a multiple of %d' % (dimkey, dimlen, factor))
+        dimlen = dimlen // factor
+    else:
+        return f
+    
+    def meshvalues(view, axis):
+        vals = view[...]
+        if meshfactor > 1.:
+            blocks = vals.reshape(vals.shape[:axis] + (vals.shape[axis] // factor, factor) + vals.shape[axis + 1:])
+            values = aggfunc(blocks, axis + 1)
+        elif aggname in ('mean', 'repeat'):
+            values = vals.repeat(factor, axis)
+        elif aggname == 'sum':
+            values = vals.repeat(factor, axis) * meshfactor
+        else:
+            values = aggfunc(vals, factor, axis)
+        return _unmasked(values)
+    
+    def meshvar(outf, k):
+        var = f.variables[k]
+        if dimkey not in var.dimensions:
+            return _viewvar(outf, k, var)
+        axis = list(var.dimensions).index(dimkey)
+        shape = list(var.shape)
+        shape[axis] = dimlen
+        return _funcvariable(outf, k, var, lambda view: meshvalues(view, axis), axis = axis, shape = shape, **_varprops(var))
+    
+    outf = _lazyfile(f, meshvar)
+    outdim = outf.createDimension(dimkey, dimlen)
+    outdim.setunlimited(f.dimensions[dimkey].isunlimited())
+    return outf
 
 def add_attr(f, attr_def):
     pieces = attr_def.split(',')
@@ -769,29 +1842,96 @@ def add_attr(f, attr_def):
     else:
         raise KeyError('mode must be either a c m o or d')
 
+def _convolveaxis(values, weights, axis, mode = 'full', fftlen = 64):
+    """
+    Same as np.convolve(weights, x, mode) for every 1-D slice x of
+    values along axis, but vectorized: kernels are applied along axis
+    with scipy.ndimage.convolve1d or, for fftlen or more weights,
+    scipy.signal.fftconvolve (without scipy, as a weighted sum of
+    shifted arrays). Outputs that depend on masked inputs are masked.
+    """
+    weights = np.asarray(weights)
+    n = values.shape[axis]
+    k = len(weights)
+    mask = np.ma.getmask(values)
+    data = np.ma.getdata(values)
+    if mask is not np.ma.nomask:
+        data = np.where(mask, 0, data)
+    nfull = n + k - 1
+    outtype = np.result_type(data.dtype, weights.dtype)
+    try:
+        from scipy import ndimage
+        from scipy.signal import fftconvolve
+    except ImportError:
+        ndimage = fftconvolve = None
+    if fftconvolve is not None and k >= fftlen:
+        wshape = [1] * data.ndim
+        wshape[axis] = k
+        full = fftconvolve(data.astype('d'), weights.reshape(wshape).astype('d'), mode = 'full', axes = axis)
+    elif ndimage is not None:
+        # zero padding makes the 'constant' boundary equal full mode
+        pad = [(0, 0)] * data.ndim
+        pad[axis] = (k - 1, k - 1)
+        full = ndimage.convolve1d(np.pad(data, pad, 'constant'), weights, axis = axis, output = outtype, mode = 'constant')
+        fstart = (k - 1) // 2
+        full = full[(slice(None),) * axis + (slice(fstart, fstart + nfull),)]
+    else:
+        outshape = list(data.shape)
+        outshape[axis] = nfull
+        full = np.zeros(outshape, dtype = outtype)
+        before = (slice(None),) * axis
+        for wi, w in enumerate(weights):
+            full[before + (slice(wi, wi + n),)] += w * data
+    
+    if mode == 'full':
+        start, stop = 0, nfull
+    elif mode == 'same':
+        start = (min(n, k) - 1) // 2
+        stop = start + max(n, k)
+    elif mode == 'valid':
+        start, stop = min(n, k) - 1, max(n, k)
+    else:
+        raise ValueError('mode must be full, same, or valid; got %s' % mode)
+    
+    outslice = (slice(None),) * axis + (slice(start, stop),)
+    out = full[outslice]
+    if mask is not np.ma.nomask:
+        nmasked = _convolveaxis(np.asarray(mask, dtype = 'd'), (weights != 0).astype('d'), axis, mode = mode)
+        out = np.ma.masked_where(nmasked > 0.5, out)
+    return out
+
 def convolve_dim(f, convolve_def):
+    """
+    Convolve values along a dimension using 'dim,mode,wgt1,wgt2,...wgtN'
+    with np.convolve modes (full, same, valid); see _convolveaxis
+    
+    Returns a new file; f is not modified. Variables are computed as
+    they are read (see _funcvariable) and assignments modify a copy.
+    """
     convolve_parts = convolve_def.split(',')
     dimkey = convolve_parts.pop(0)
     mode = convolve_parts.pop(0)
     weights = np.array(convolve_parts, dtype = 'f')
-    outf = PseudoNetCDFFile()
-    from PseudoNetCDF.pncgen import Pseudo2NetCDF
-    p2p = Pseudo2NetCDF(verbose = 0)
-    p2p.addGlobalProperties(f, outf)
-    p2p.addDimensions(f, outf)
+    def convolvevalues(view, axis):
+        vals = view[...]
+        values = _convolveaxis(vals, weights, axis, mode = mode)
+        if isinstance(vals, np.ma.MaskedArray):
+            values = np.ma.masked_invalid(values)
+        return _unmasked(values)
+    
+    def convolvevar(outf, vark):
+        var = f.variables[vark]
+        if dimkey not in var.dimensions:
+            return _viewvar(outf, vark, var)
+        axis = list(var.dimensions).index(dimkey)
+        shape = list(var.shape)
+        shape[axis] = len(outf.dimensions[dimkey])
+        return _funcvariable(outf, vark, var, lambda view: convolvevalues(view, axis), axis = axis, shape = shape, **_varprops(var))
+    
+    outf = _lazyfile(f, convolvevar)
     dim = outf.dimensions[dimkey]
     dim = outf.createDimension(dimkey, len(np.convolve(weights, np.arange(len(dim)), mode = mode)))
     dim.setunlimited(f.dimensions[dimkey].isunlimited())
-    for vark, var in f.variables.items():
-        lconvolve = dimkey in var.dimensions
-        p2p.addVariable(f, outf, vark, data = not lconvolve)
-        if lconvolve:
-            axisi = list(var.dimensions).index(dimkey)
-            values = np.apply_along_axis(func1d = lambda x_: np.convolve(weights, x_, mode = mode), axis = axisi, arr = var[:])
-            if isinstance(var[:], np.ma.MaskedArray):
-                values = np.ma.masked_invalid(values)
-            
-            outf.variables[vark][:] = values
     return outf
 
 def merge(fs):
@@ -814,11 +1954,87 @@ def merge(fs):
     
     return outf
 
+class _stackedvariable(PseudoNetCDFLazyVariable):
+    """
+    Variable that concatenates a variable from several files along
+    axis without reading it; indexing reads only the requested slices
+    of each file (see stack_files)
+    """
+    _copyonwrite = True
+    def __init__(self, parent, name, fs, axis):
+        var = fs[0].variables[name]
+        self._parent = parent
+        self._name = name
+        self._files = fs
+        self._axis = axis
+        self.dimensions = tuple(var.dimensions)
+        lens = np.array([len(f_.dimensions[self.dimensions[axis]]) for f_ in fs])
+        self._ends = lens.cumsum()
+        self._starts = self._ends - lens
+        shape = list(var.shape)
+        shape[axis] = int(self._ends[-1])
+        self.shape = tuple(shape)
+        self.dtype = var.dtype
+        if hasattr(var, 'fill_value'):
+            self.fill_value = var.fill_value
+        for k in var.ncattrs():
+            setattr(self, k, getattr(var, k))
+    
+    def _getitem(self, item):
+        item = self._expanditem(item)
+        axis = self._axis
+        sitem = item[axis]
+        isint = lambda i: isinstance(i, (int, np.integer))
+        isbasic = lambda i: isint(i) or isinstance(i, slice)
+        others = item[:axis] + item[axis + 1:]
+        if len(item) != self.ndim or any([i is None for i in item]) or \
+           np.ndim(sitem) > 1 or (not isbasic(sitem) and not all([isbasic(i) for i in others])):
+            # Selections that mix advanced indices read all values
+            pieces = [f_.variables[self._name][...] for f_ in self._files]
+            if any([np.ma.getmask(p) is not np.ma.nomask for p in pieces]):
+                return np.ma.concatenate(pieces, axis = axis)[item]
+            return np.concatenate([np.ma.getdata(p) for p in pieces], axis = axis)[item]
+        elif not all([isbasic(i) for i in others]):
+            # Select along the stacked axis first and then the others
+            if isint(sitem):
+                first, stacked = [sitem], 0
+            else:
+                first, stacked = sitem, slice(None)
+            return self[(slice(None),) * axis + (first,)][item[:axis] + (stacked,) + item[axis + 1:]]
+        
+        idx = np.arange(self.shape[axis])[sitem]
+        fileidx = np.searchsorted(self._ends, idx, side = 'right')
+        if np.ndim(idx) == 0:
+            var = self._files[fileidx].variables[self._name]
+            return var[item[:axis] + (int(idx - self._starts[fileidx]),) + item[axis + 1:]]
+        
+        outaxis = axis - len([i for i in item[:axis] if isint(i)])
+        pieces = []
+        for run in np.split(np.arange(len(idx)), np.flatnonzero(np.diff(fileidx)) + 1):
+            if len(run) == 0:
+                continue
+            fi = fileidx[run[0]]
+            local = idx[run] - self._starts[fi]
+            steps = np.diff(local)
+            if len(local) == 1:
+                local = slice(int(local[0]), int(local[0]) + 1)
+            elif steps[0] > 0 and (steps == steps[0]).all():
+                local = slice(int(local[0]), int(local[-1]) + 1, int(steps[0]))
+            pieces.append(self._files[fi].variables[self._name][item[:axis] + (local,) + item[axis + 1:]])
+        if len(pieces) == 0:
+            return self._files[0].variables[self._name][item[:axis] + (slice(0, 0),) + item[axis + 1:]]
+        elif any([np.ma.getmask(p) is not np.ma.nomask for p in pieces]):
+            return np.ma.concatenate(pieces, axis = outaxis)
+        else:
+            return np.concatenate(pieces, axis = outaxis)
+
 def stack_files(fs, stackdim, coordkeys = []):
     """
     Create files with dimensions extended by stacking.
     
-    Currently, there is no sanity check...
+    Variables with stackdim are not read; they map indices onto the
+    input files so that only requested slices are read (see
+    _stackedvariable). Currently, there is no sanity check...
     
     """
     f = PseudoNetCDFFile()
@@ -839,20 +2055,19 @@ def stack_files(fs, stackdim, coordkeys = []):
     f.createDimension(stackdim, sum([len(dims[stackdim]) for dims in dimensions]))
     p2p.addGlobalProperties(tmpf, f)
     for tmpf in fs:
-        for varkey, var in tmpf.variables.items():
+        for varkey in tmpf.variables.keys():
+            if varkey in f.variables:
+                if not isinstance(f.variables[varkey], _stackedvariable) and not varkey in coordkeys:
+                    warn('Got duplicate variables for %s without stackable dimension; first value retained' % varkey)
+                continue
+            var = tmpf.variables[varkey]
             if not stackdim in var.dimensions:
-                if varkey in f.variables:
-                    if not varkey in coordkeys:
-                        warn('Got duplicate variables for %s without stackable dimension; first value retained' % varkey)
-                else:
-                    p2p.addVariable(tmpf, f, varkey, data = True)
+                p2p.addVariable(tmpf, f, varkey, data = True)
             else:
-                if not varkey in f.variables.keys():
-                    axisi = list(var.dimensions).index(stackdim)
-                    values = np.ma.concatenate([f_.variables[varkey][:] for f_ in fs], axis = axisi)
-                    p2p.addVariable(tmpf, f, varkey, data = False)
-                    f.variables[varkey][:] = values
-        
+                axisi = list(var.dimensions).index(stackdim)
+                f.variables[varkey] = _stackedvariable(f, varkey, fs, axisi)
+    
+    f._sourcefiles = tuple(fs)
     return f
 
 def splitdim(inf, olddim, newdims, newshape):
@@ -891,3 +2106,554 @@ def splitdim(inf, olddim, newdims, newshape):
             p2n.addVariable(inf, outf, vk)
     
     return outf
+
+def _testfile():
+    """
+    Return a file with O3 and NO (TSTEP, LAY, ROW, COL) and layer (LAY)
+    for tests
+    """
+    tncf = PseudoNetCDFFile()
+    tncf.createDimension('TSTEP', 24).setunlimited(True)
+    tncf.createDimension('LAY', 4)
+    tncf.createDimension('ROW', 5)
+    tncf.createDimension('COL', 6)
+    tncf.createVariable('O3', 'f', ('TSTEP', 'LAY', 'ROW', 'COL'), values = np.arange(24 * 4 * 5 * 6, dtype = 'f').reshape(24, 4, 5, 6), units = 'ppb')
+    tncf.createVariable('NO', 'f', ('TSTEP', 'LAY', 'ROW', 'COL'), values = np.arange(24 * 4 * 5 * 6, dtype = 'f').reshape(24, 4, 5, 6)[::-1], units = 'ppb')
+    tncf.createVariable('layer', 'f', ('LAY',), values = np.arange(4, dtype = 'f'), units = 'model layer')
+    return tncf
+
+def _loggedfile(inf, accessed):
+    """
+    Return a file with the dimensions of inf whose variables are the
+    variables of inf; keys are appended to accessed when requested
+    """
+    def getvar(k):
+        accessed.append(k)
+        return inf.variables[k]
+    lazyf = PseudoNetCDFFile()
+    for dk, dv in inf.dimensions.items():
+        lazyf.createDimension(dk, len(dv)).setunlimited(dv.isunlimited())
+    lazyf.variables = PseudoNetCDFVariables(getvar, list(inf.variables.keys()))
+    return lazyf
+
+class TestLazyTransforms(unittest.TestCase):
+    def runTest(self):
+        pass
+    def setUp(self):
+        self.testfile = _testfile()
+    
+    def testLazySliceReduce(self):
+        tncf = self.testfile
+        accessed = []
+        lazyf = _loggedfile(tncf, accessed)
+        outf = reduce_dim(slice_dim(lazyf, 'TSTEP,2,10,2'), 'LAY,mean')
+        self.assertEqual(accessed, [])
+        self.assertEqual(len(outf.dimensions['TSTEP']), 4)
+        self.assertEqual(len(outf.dimensions['LAY']), 1)
+        self.assertEqual(outf.dimensions['TSTEP'].isunlimited(), True)
+        self.assert_('O3' in outf.variables)
+        o3 = outf.variables['O3']
+        self.assertEqual(accessed, ['O3'])
+        self.assertEqual(o3.dimensions, ('TSTEP', 'LAY', 'ROW', 'COL'))
+        self.assertEqual(o3.units, 'ppb')
+        self.assert_((o3 == tncf.variables['O3'][2:10:2].mean(1, keepdims = True)).all())
+        self.assert_(outf.variables['O3'] is o3)
+        self.assertEqual(accessed, ['O3'])
+
+    def testMask(self):
+        tncf = self.testfile
+        outf = mask_vals(tncf, 'less,10')
+        o3 = outf.variables['O3']
+        self.assertEqual(o3[...].mask.sum(), 10)
+        self.assert_(outf.variables['layer'] is tncf.variables['layer'])
+
+    def testStreamedCopy(self):
+        import os
+        from tempfile import mkdtemp
+        from shutil import rmtree
+        from PseudoNetCDF.pncgen import pncgen
+        tncf = self.testfile
+        reads = []
+        def logged(view):
+            reads.append(view._item)
+            return view[...]
+        def loggedvar(outf, k):
+            var = tncf.variables[k]
+            return _funcvariable(outf, k, var, logged, **_varprops(var))
+        srcf = _lazyfile(tncf, loggedvar)
+        outf = reduce_dim(mask_vals(slice_dim(srcf, 'TSTEP,0,20'), 'greater,2000'), 'LAY,mean')
+        tmpdir = mkdtemp()
+        try:
+            ofile = pncgen(outf, os.path.join(tmpdir, 'streamed.nc'), format = 'NETCDF4_CLASSIC', verbose = 0, chunksize = 4)
+            check = np.ma.masked_greater(tncf.variables['O3'][:20], 2000).mean(1, keepdims = True)
+            self.assert_(np.ma.allclose(ofile.variables['O3'][:], check))
+            self.assert_(np.ma.getmaskarray(ofile.variables['O3'][:])[-1].all())
+            ofile.close()
+        finally:
+            rmtree(tmpdir)
+        # the source is read one output hyperslab at a time and no
+        # values are kept
+        self.assertEqual(max([len(range(24)[item[0]]) for item in reads if len(item) == 4]), 4)
+        for var in outf.variables.values():
+            self.assert_(isinstance(var, PseudoNetCDFLazyVariable) and var._copy is None)
+    
+
+    def testCopyOnWrite(self):
+        tncf = self.testfile
+        o3 = tncf.variables['O3'][...].copy()
+        outfs = [slice_dim(tncf, 'TSTEP,0,12'), mask_vals(tncf, 'less,10'),
+                 reduce_dim(tncf, 'TSTEP,mean'), mesh_dim(tncf, 'TSTEP,2,mean'),
+                 convolve_dim(tncf, 'TSTEP,valid,0.5,0.5'), pncbo('+', tncf, tncf)]
+        for outf in outfs:
+            outo3 = outf.variables['O3']
+            check = outo3[...]
+            outo3[0] = -1
+            outo3.long_name = 'changed'
+            self.assert_(outf.variables['O3'] is outo3)
+            self.assert_((outo3[0] == -1).all())
+            self.assert_((outo3[1:] == check[1:]).all())
+            self.assertEqual(outf.variables['O3'].long_name, 'changed')
+        outf = slice_dim(tncf, 'TSTEP,0,12')
+        outf.variables['layer'][:] = 0
+        self.assert_((tncf.variables['O3'][...] == o3).all())
+        self.assert_((tncf.variables['layer'][...] == np.arange(4)).all())
+        self.assert_(not hasattr(tncf.variables['O3'], 'long_name'))
+    
+
+    def testNegativeStride(self):
+        import os
+        from tempfile import mkdtemp
+        from shutil import rmtree
+        from PseudoNetCDF.pncgen import pncgen
+        from PseudoNetCDF.netcdf import NetCDFFile
+        tncf = self.testfile
+        tmpdir = mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'source.nc')
+            pncgen(tncf, path, format = 'NETCDF4_CLASSIC', verbose = 0).close()
+            ncf = NetCDFFile(path)
+            check = tncf.variables['O3'][::-2]
+            outf = slice_dim(ncf, 'TSTEP,None,None,-2')
+            o3 = outf.variables['O3']
+            self.assertEqual(o3.shape, (12, 4, 5, 6))
+            self.assert_((o3[:] == check).all())
+            self.assert_((o3[7:1:-2, 0, ::-3] == check[7:1:-2, 0, ::-3]).all())
+            self.assert_((slice_dim(outf, 'LAY,None,None,-1').variables['O3'][2] == check[2, ::-1]).all())
+            self.assert_((reduce_dim(outf, 'LAY,max').variables['O3'][...] == check.max(1, keepdims = True)).all())
+            ncf.close()
+        finally:
+            rmtree(tmpdir)
+
+class TestGetvarpnc(unittest.TestCase):
+    def runTest(self):
+        pass
+    def setUp(self):
+        self.testfile = _testfile()
+    
+    def testCopyOnWrite(self):
+        from tempfile import NamedTemporaryFile
+        tncf = self.testfile
+        o3 = tncf.variables['O3']
+        with NamedTemporaryFile() as tmpf:
+            o3.array().tofile(tmpf.name)
+            mmf = PseudoNetCDFFile()
+            for dk, dv in tncf.dimensions.items():
+                mmf.createDimension(dk, len(dv))
+            data = np.memmap(tmpf.name, dtype = 'f', mode = 'r', shape = o3.shape)
+            mmf.createVariable('O3', 'f', o3.dimensions, values = data[:, ::2], units = 'ppb')
+            outf = getvarpnc(mmf, ['O3'])
+            outo3 = outf.variables['O3']
+            self.assert_((outo3 == o3[:, ::2]).all())
+            outo3[:] = 0
+            self.assert_((mmf.variables['O3'] == o3[:, ::2]).all())
+            self.assert_((np.fromfile(tmpf.name, dtype = 'f') == o3.ravel()).all())
+        outf = getvarpnc(tncf, ['NO'])
+        outf.variables['NO'][:] = 0
+        self.assert_((tncf.variables['NO'] != 0).any())
+
+class TestExtract(unittest.TestCase):
+    def runTest(self):
+        pass
+    
+    def testNearest(self):
+        tncf = PseudoNetCDFFile()
+        tncf.createDimension('time', 2)
+        tncf.createDimension('latitude', 4)
+        tncf.createDimension('longitude', 5)
+        lat = tncf.createVariable('latitude', 'd', ('latitude',), values = np.array([-30., -10., 10., 30.]), units = 'degrees_north')
+        lon = tncf.createVariable('longitude', 'd', ('longitude',), values = np.array([-175., -100., 0., 100., 170.]), units = 'degrees_east')
+        tncf.createVariable('O3', 'f', ('time', 'latitude', 'longitude'), values = np.arange(40, dtype = 'f').reshape(2, 4, 5), units = 'ppb')
+        _lonlatindexcache.clear()
+        outf = extract(tncf, ['-95,12', '2,-29', '171,31'])
+        self.assertEqual(outf.variables['O3'].dimensions, ('time', 'points'))
+        self.assert_((outf.variables['O3'][0] == np.array([11, 2, 19])).all())
+        self.assert_((outf.variables['latitude'] == np.array([10., -30., 30.])).all())
+        self.assertEqual(len(_lonlatindexcache), 1)
+        query = list(_lonlatindexcache.values())[0]
+        outf = extract(tncf, ['-95,12'])
+        self.assert_(list(_lonlatindexcache.values())[0] is query)
+        self.assertEqual(query([-95.], [12.]).dtype, np.dtype('intp'))
+        # Across the date line, only great circle distance is nearest
+        outf = extract(tncf, ['178,29'], method = 'nn')
+        self.assertEqual(outf.variables['longitude'][0], 170)
+        outf = extract(tncf, ['178,29'], method = 'gc')
+        self.assertEqual(outf.variables['longitude'][0], -175)
+        self.assertEqual(len(_lonlatindexcache), 2)
+
+    def testLinear(self):
+        from scipy.interpolate import LinearNDInterpolator
+        tncf = PseudoNetCDFFile()
+        tncf.createDimension('time', 2)
+        tncf.createDimension('latitude', 4)
+        tncf.createDimension('longitude', 5)
+        lat = np.array([-30., -10., 10., 30.])
+        lon = np.array([-100., -50., 0., 50., 100.])
+        tncf.createVariable('latitude', 'd', ('latitude',), values = lat, units = 'degrees_north')
+        tncf.createVariable('longitude', 'd', ('longitude',), values = lon, units = 'degrees_east')
+        o3 = np.arange(40, dtype = 'd').reshape(2, 4, 5)**2
+        tncf.createVariable('O3', 'd', ('time', 'latitude', 'longitude'), values = o3, units = 'ppb')
+        outf = extract(tncf, ['-95,12', '2,-29', '45.5,0', '150,0'], method = 'linear')
+        lons, lats = np.meshgrid(lon, lat)
+        interp = LinearNDInterpolator(np.array([lons.ravel(), lats.ravel()]).T, o3.reshape(2, -1).T)
+        check = interp(np.array([[-95., 2., 45.5, 150.], [12., -29., 0., 0.]]).T).T
+        outo3 = outf.variables['O3']
+        self.assertEqual(outo3.shape, (2, 4))
+        self.assert_(np.isnan(outo3[:, -1]).all())
+        self.assert_(np.allclose(outo3[:, :-1], check[:, :-1]))
+        # weights are reused for the same grid and points
+        interp = _lonlatinterpolator(lons, lats, [-95., 2., 45.5, 150.], [12., -29., 0., 0.])
+        ninterp = len(_lonlatinterpcache)
+        outf = extract(tncf, ['-95,12', '2,-29', '45.5,0', '150,0'], method = 'linear')
+        self.assert_(_lonlatinterpolator(lons, lats, [-95., 2., 45.5, 150.], [12., -29., 0., 0.]) is interp)
+        self.assertEqual(len(_lonlatinterpcache), ninterp)
+        self.assert_(np.allclose(outf.variables['O3'][:, :-1], check[:, :-1]))
+
+class TestStackFiles(unittest.TestCase):
+    def runTest(self):
+        pass
+    def setUp(self):
+        self.testfile = _testfile()
+    
+    def testStackFiles(self):
+        tncf = self.testfile
+        accessed = []
+        fs = [_loggedfile(slice_dim(tncf, 'TSTEP,%d,%d' % (start, stop)), accessed) for start, stop in [(0, 5), (5, 6), (6, 24)]]
+        outf = stack_files(fs, 'TSTEP')
+        self.assertEqual(len(outf.dimensions['TSTEP']), 24)
+        o3 = outf.variables['O3']
+        self.assertEqual(o3.shape, (24, 4, 5, 6))
+        self.assertEqual(o3.units, 'ppb')
+        del accessed[:]
+        check = tncf.variables['O3']
+        self.assert_((o3[:, 0, 2, 3] == check[:, 0, 2, 3]).all())
+        self.assertEqual(accessed, ['O3'] * 3)
+        del accessed[:]
+        self.assert_((o3[5] == check[5]).all())
+        self.assertEqual(accessed, ['O3'])
+        for item in [Ellipsis, (slice(3, 20, 4), 1), (slice(None, None, -2), Ellipsis, 3),
+                     ([1, 7, 6, 23], slice(None), 0), (slice(4, 7), [0, 2], 1, [3, 4]),
+                     ([2, 8], [0, 1])]:
+            self.assert_((o3[item] == check[item]).all())
+        self.assert_(((o3 * 2)[...] == check * 2).all())
+        self.assertEqual(o3.mean(), check.mean())
+        outf = slice_dim(outf, 'TSTEP,-1')
+        self.assert_((outf.variables['O3'][:] == check[-1:]).all())
+
+class TestReduceStats(unittest.TestCase):
+    def runTest(self):
+        pass
+    def setUp(self):
+        self.testfile = _testfile()
+    
+    def testStats(self):
+        tncf = self.testfile
+        check = tncf.variables['O3'][:]
+        outf = reduce_dim(tncf, 'TSTEP,mean+max+std+count')
+        self.assertEqual(len(outf.dimensions['TSTEP']), 1)
+        self.assertEqual([k for k in outf.variables.keys() if k.startswith('O3')], ['O3_mean', 'O3_max', 'O3_std', 'O3_count'])
+        self.assertEqual(outf.variables['O3_max'].shape, (1, 4, 5, 6))
+        self.assert_(np.allclose(outf.variables['O3_mean'], check.mean(0)))
+        self.assert_((outf.variables['O3_max'] == check.max(0)).all())
+        self.assert_(np.allclose(outf.variables['O3_std'], check.std(0)))
+        self.assert_((outf.variables['O3_count'] == 24).all())
+        self.assert_((outf.variables['layer'] == tncf.variables['layer']).all())
+        masked = np.ma.masked_greater(check, 1000)
+        vals = _reducestats(masked, 0, ['mean', 'var', 'min', 'count'], chunkbytes = 480)
+        for stat in ['mean', 'var', 'min', 'count']:
+            self.assert_(np.ma.allclose(vals[stat], getattr(masked, stat)(axis = 0, keepdims = True)))
+        vals = _reducestats(np.ma.masked_greater(check, -1), 0, ['mean', 'count'])
+        self.assert_(np.ma.getmaskarray(vals['mean']).all())
+        self.assert_((vals['count'] == 0).all())
+
+    def testBounds(self):
+        tncf = PseudoNetCDFFile()
+        tncf.createDimension('time', 4).setunlimited(True)
+        tncf.createDimension('nv', 2)
+        tncf.createVariable('time', 'd', ('time',), values = np.arange(4) + .5, units = 'hours since 2010-07-01 00:00:00 UTC')
+        tncf.createVariable('time_bounds', 'd', ('time', 'nv'), values = np.arange(4)[:, None] + np.array([0, 1]), units = 'hours since 2010-07-01 00:00:00 UTC')
+        for func in ['mean', 'max', 'std', 'sum', 'mean+max']:
+            outf = reduce_dim(tncf, 'time,%s' % func)
+            self.assert_((outf.variables['time_bounds'][:] == [[0, 4]]).all(), func)
+
+class TestWeightedReduce(unittest.TestCase):
+    def runTest(self):
+        pass
+    def setUp(self):
+        self.testfile = _testfile()
+    
+    def testWeightedReduce(self):
+        tncf = self.testfile
+        o3 = tncf.variables['O3'][:]
+        no = tncf.variables['NO'][:]
+        area = np.arange(1, 31, dtype = 'f').reshape(5, 6)
+        tncf.createVariable('AREA', 'f', ('ROW', 'COL'), values = area, units = 'm**2')
+        outf = reduce_dim(tncf, 'LAY,sum,AREA')
+        self.assert_(np.allclose(outf.variables['O3'], (o3 * area).sum(1, keepdims = True)))
+        outf = reduce_dim(tncf, 'LAY,mean,NO,NO')
+        check = (o3 * no).mean(1, keepdims = True) / no.mean(1, keepdims = True)
+        self.assert_(np.allclose(outf.variables['O3'], check))
+        self.assertEqual(outf.variables['O3'].shape, (24, 1, 5, 6))
+        masked = np.ma.masked_greater(o3, 1000)
+        out = _weightedreduce(masked, 0, 'sum', no, chunkbytes = 480)
+        self.assert_(np.ma.allclose(out, (masked * no).sum(0, keepdims = True)))
+
+class TestDayReduce(unittest.TestCase):
+    def runTest(self):
+        pass
+    def setUp(self):
+        self.testfile = _testfile()
+    
+    def testDayReduce(self):
+        tncf = self.testfile
+        o3 = tncf.variables['O3'][:]
+        outf = reduce_dim(tncf, 'TSTEP,daymax')
+        self.assert_((outf.variables['O3'] == o3.max(0, keepdims = True)).all())
+    
+    def testTrailingDay(self):
+        # partial last days are kept unless mincount masks them
+        tncf = _testfile()
+        tncf = stack_files([tncf, slice_dim(tncf, 'TSTEP,0')], 'TSTEP')
+        o3 = tncf.variables['O3'][:]
+        outf = reduce_dim(tncf, 'TSTEP,daymax')
+        self.assertEqual(len(outf.dimensions['TSTEP']), 2)
+        self.assert_((outf.variables['O3'][1] == o3[24]).all())
+        outf = reduce_dim(tncf, 'TSTEP,daymax,mincount=18')
+        self.assert_((outf.variables['O3'][0] == o3[:24].max(0)).all())
+        self.assert_(np.ma.getmaskarray(outf.variables['O3'][1]).all())
+    
+    def testUTCOffset(self):
+        tncf = self.testfile
+        o3 = tncf.variables['O3'][:]
+        outf = reduce_dim(tncf, 'TSTEP,daymax,utcoffset=-5')
+        self.assert_((outf.variables['O3'][0] == o3[:5].max(0)).all())
+        self.assert_((outf.variables['O3'][1] == o3[5:].max(0)).all())
+        # the third field is a weight, which day functions do not take
+        self.assertRaises(ValueError, reduce_dim, tncf, 'TSTEP,daymax,-5')
+        self.assertRaises(ValueError, reduce_dim, tncf, 'TSTEP,mean,utcoffset=-5')
+        # offsets by column give the same days when read by column
+        tncf.createVariable('UTCOFFSET', 'f', ('COL',), values = np.array([0, -5, -8, -8, 0, -5], dtype = 'f'), units = 'hours')
+        outf = reduce_dim(tncf, 'TSTEP,daymax,utcoffset=UTCOFFSET')
+        check = daymax(o3, axis = 0, utcoffset = tncf.variables['UTCOFFSET'][:])
+        o3max = outf.variables['O3']
+        self.assertEqual(o3max.shape, (2, 4, 5, 6))
+        self.assert_(np.ma.allclose(o3max[...], check))
+        for col in range(6):
+            self.assert_(np.ma.allclose(o3max[:, :, :, col], check[..., col]))
+            self.assert_((np.ma.getmaskarray(o3max[:, :, :, col]) == np.ma.getmaskarray(check[..., col])).all())
+
+class TestExpr(unittest.TestCase):
+    def runTest(self):
+        pass
+    def setUp(self):
+        self.testfile = _testfile()
+    
+    def testExpr(self):
+        tncf = self.testfile
+        accessed = []
+        lazyf = _loggedfile(tncf, accessed)
+        expr = 'O3x2 = O3 * 2\nO3x2.units = "ppb"\nTOT = O3 + NO'
+        outf = pncexpr(expr, lazyf)
+        self.assertEqual(sorted(set(accessed)), ['NO', 'O3'])
+        self.assert_((outf.variables['O3x2'] == tncf.variables['O3'][:] * 2).all())
+        self.assert_((outf.variables['TOT'] == tncf.variables['O3'][:] + tncf.variables['NO'][:]).all())
+        self.assertEqual(list(outf.variables.keys()), ['O3', 'NO', 'layer', 'O3x2', 'TOT'])
+        chunkf = pncexpr(expr, tncf, chunksize = 5)
+        for key in ['O3x2', 'TOT']:
+            self.assertEqual(chunkf.variables[key].dimensions, ('TSTEP', 'LAY', 'ROW', 'COL'))
+            self.assert_((chunkf.variables[key] == outf.variables[key]).all())
+        self.assertEqual(chunkf.variables['O3x2'].units, 'ppb')
+        # in-place expressions do not modify the input file
+        o3 = tncf.variables['O3'][:].copy()
+        layer = tncf.variables['layer'][:].copy()
+        chunkf = pncexpr('O3[:] *= 2\nO3x2 = O3 * 1\nlayer[:] += 1\nL = layer * 1', tncf, chunksize = 5)
+        self.assert_((chunkf.variables['O3x2'] == o3 * 2).all())
+        self.assert_((tncf.variables['O3'][:] == o3).all())
+        self.assert_((tncf.variables['layer'][:] == layer).all())
+
+class TestBinaryOps(unittest.TestCase):
+    def runTest(self):
+        pass
+    def setUp(self):
+        self.testfile = _testfile()
+    
+    def testBinaryOps(self):
+        tncf = self.testfile
+        o3 = tncf.variables['O3'][:]
+        no = tncf.variables['NO'][:]
+        chunkbytes = _binopvariable.chunkbytes
+        _binopvariable.chunkbytes = 480 * 5
+        try:
+            outf = pncbo('-', tncf, tncf, coordkeys = ['layer'])
+            diff = outf.variables['O3']
+            self.assertEqual(diff.units, '(ppb) - (ppb)')
+            self.assert_((diff[...] == 0).all())
+            outf = seqpncbo(['/', '*'], [tncf, tncf, tncf])[0]
+            ratio = outf.variables['NO']
+            self.assertEqual(ratio.shape, (24, 4, 5, 6))
+            check = no / no * no
+            self.assert_(np.ma.getmaskarray(ratio[...])[-1].any())
+            self.assert_(np.ma.allclose(ratio[...], np.ma.masked_invalid(check)))
+            self.assert_(np.ma.allclose(ratio[2:20:3, 1], np.ma.masked_invalid(check[2:20:3, 1])))
+            self.assert_(np.ma.allclose(ratio[::-1], np.ma.masked_invalid(check[::-1])))
+            outf = pncbfunc(lambda a, b: a / b, tncf, tncf, coordkeys = ['layer'])
+            ratio = outf.variables['O3'][...]
+            self.assertEqual(ratio[0, 0, 0, 0], -999)
+            self.assert_((ratio.ravel()[1:] == 1).all())
+            # results have the dtype of the operation, not of ifile1
+            less = pncbo('<', tncf, tncf).variables['O3']
+            self.assertEqual(less.dtype, np.dtype('bool'))
+            self.assertEqual(less[...].dtype, np.dtype('bool'))
+            self.assert_(not less[...].any())
+            tncf.createVariable('COUNT', 'i', ('TSTEP',), values = np.arange(1, 25, dtype = 'i'))
+            half = pncbo('/', tncf, pncbo('+', tncf, tncf)).variables['COUNT']
+            self.assertEqual(half.dtype, np.dtype('d'))
+            self.assertEqual(half.typecode(), 'd')
+            self.assert_((half[...] == .5).all())
+            self.assert_((half[2:10] == .5).all())
+        finally:
+            _binopvariable.chunkbytes = chunkbytes
+
+class TestConvolveMesh(unittest.TestCase):
+    def runTest(self):
+        pass
+    def setUp(self):
+        self.testfile = _testfile()
+    
+    def testConvolveMesh(self):
+        tncf = self.testfile
+        outf = convolve_dim(tncf, 'TSTEP,valid,0.5,0.5')
+        self.assertEqual(len(outf.dimensions['TSTEP']), 23)
+        o3 = tncf.variables['O3']
+        self.assert_((outf.variables['O3'] == (o3[1:] + o3[:-1]) / 2.).all())
+        outf = mesh_dim(tncf, 'TSTEP,2,mean')
+        self.assertEqual(len(outf.dimensions['TSTEP']), 12)
+        self.assert_((outf.variables['O3'] == o3.reshape(12, 2, 4, 5, 6).mean(1)).all())
+        outf = mesh_dim(tncf, 'COL,3,sum')
+        self.assertEqual(outf.variables['O3'].shape, (24, 4, 5, 2))
+        self.assert_((outf.variables['O3'] == o3[:].reshape(24, 4, 5, 2, 3).sum(-1)).all())
+        outf = mesh_dim(tncf, 'ROW,0.5,sum')
+        self.assertEqual(len(outf.dimensions['ROW']), 10)
+        self.assert_((outf.variables['O3'] == o3[:].repeat(2, 2) * 0.5).all())
+        masked = np.ma.masked_greater(o3[:], 2000)
+        values = _convolveaxis(masked, [1 / 3.] * 3, 0, mode = 'same')
+        check = np.apply_along_axis(lambda x: np.convolve([1 / 3.] * 3, x, mode = 'same'), 0, o3[:])
+        self.assert_(np.allclose(values[:16], check[:16]))
+        self.assert_(np.ma.getmaskarray(values)[17:].all())
+        values = _convolveaxis(o3[:], np.ones(100) / 100., 0, mode = 'full')
+        check = np.apply_along_axis(lambda x: np.convolve(np.ones(100) / 100., x, mode = 'full'), 0, o3[:])
+        self.assert_(np.allclose(values, check))
+
+class TestUnmaskedFastPath(unittest.TestCase):
+    def runTest(self):
+        pass
+    
+    def testUnmaskedFastPath(self):
+        # a file without fill values gives the same results as the same
+        # data wrapped as masked arrays with nothing masked
+        shape = (24, 10, 10, 10)
+        dims = ('TSTEP', 'LAY', 'ROW', 'COL')
+        files = []
+        for masked in (False, True):
+            f = PseudoNetCDFFile()
+            for dk, dl in zip(dims, shape):
+                f.createDimension(dk, dl)
+            for vk, scale in [('O3', 1.), ('NO2', .5)]:
+                vals = np.arange(np.prod(shape), dtype = 'f').reshape(*shape) * scale + 1
+                if masked:
+                    vals = np.ma.array(vals, mask = np.zeros(shape, dtype = 'bool'))
+                f.createVariable(vk, 'f', dims, values = vals, units = 'ppm')
+            f.createVariable('TFLAG', 'i', ('TSTEP',), values = np.arange(24, dtype = 'i'), units = '<YYYYDDD,HHMMSS>')
+            files.append(f)
+        outs = []
+        for f in files:
+            outs.append([reduce_dim(f, 'TSTEP,mean').variables['O3'][...],
+                         reduce_dim(f, 'LAY,max').variables['NO2'][...],
+                         pncbo('/', f, f).variables['O3'][...]])
+        for fast, slow in zip(*outs):
+            self.assertEqual(np.ma.getmask(fast) is np.ma.nomask, True)
+            self.assert_(np.allclose(fast, slow))
+        # reduced values keep the declared dtype
+        outf = reduce_dim(files[0], 'TSTEP,sum')
+        for vk in ['O3', 'TFLAG']:
+            self.assertEqual(outf.variables[vk].dtype, files[0].variables[vk].dtype)
+            self.assertEqual(outf.variables[vk].typecode(), files[0].variables[vk].dtype.char)
+        self.assertEqual(outf.variables['TFLAG'][0], np.arange(24).sum())
+
+class TestInterpWeights(unittest.TestCase):
+    def runTest(self):
+        pass
+    def setUp(self):
+        self.testfile = _testfile()
+    
+    def testInterpWeights(self):
+        tncf = self.testfile
+        o3 = tncf.variables['O3'][:]
+        newlayer = np.array([-1., .5, 1.25, 2.5, 4.])
+        weights = interpweights(tncf.variables['layer'][:], newlayer)
+        self.assertEqual(weights[0].shape, (5, 2))
+        self.assert_(interpweights(tncf.variables['layer'][:], newlayer) is weights)
+        check = np.apply_along_axis(lambda x: np.interp(newlayer, np.arange(4), x), 1, o3)
+        dense = np.zeros((5, 4))
+        np.add.at(dense, (np.arange(5)[:, None], weights[0]), weights[1])
+        # (index, weight) pairs are applied sparsely; dense weights use
+        # broadcasting
+        for w in [weights, dense]:
+            outf = interpvars(tncf, w, 'LAY', loginterp = ['NO'])
+            self.assertEqual(outf.variables['O3'].shape, (24, 5, 5, 6))
+            self.assert_(np.allclose(outf.variables['O3'][:], check))
+        self.assertRaises(ValueError, interpvars, tncf, (weights[0] + 1, weights[1]), 'LAY')
+        # decreasing coordinates with one set of weights per column
+        oldpres = 1000. - np.arange(4)[:, None, None] * np.array([100., 110.])[None, :, None] * np.ones((1, 2, 3))
+        newpres = np.array([950., 800., 720.])[:, None, None] * np.ones((1, 2, 3))
+        vals = np.arange(24, dtype = 'd').reshape(4, 2, 3)
+        out = applyweights(vals, interpweights(oldpres, newpres))
+        self.assertEqual(out.shape, (3, 2, 3))
+        self.assert_(np.allclose(out[:, 1, 2], np.interp(newpres[::-1, 1, 2], oldpres[::-1, 1, 2], vals[::-1, 1, 2])[::-1]))
+        masked = np.ma.masked_greater(vals, 11)
+        out = applyweights(masked, interpweights(oldpres, newpres))
+        self.assert_(np.ma.getmaskarray(out)[2].all())
+        self.assert_(not np.ma.getmaskarray(out)[0].any())
+        # the cache keeps only the most recent weights that fit in
+        # _interpweightcachebytes
+        global _interpweightcachebytes, _interpweightcacheused
+        cachebytes = _interpweightcachebytes
+        try:
+            _interpweightcache.clear()
+            _interpweightcacheused = 0
+            first = interpweights(oldpres, newpres)
+            nbytes = sum([w.nbytes for w in first])
+            _interpweightcachebytes = nbytes * 2
+            second = interpweights(oldpres, newpres + 1)
+            self.assert_(interpweights(oldpres, newpres) is first)
+            third = interpweights(oldpres, newpres + 2)
+            self.assertEqual(len(_interpweightcache), 2)
+            self.assertEqual(_interpweightcacheused, nbytes * 2)
+            self.assert_(interpweights(oldpres, newpres) is first)
+            self.assert_(interpweights(oldpres, newpres + 1) is not second)
+            _interpweightcachebytes = nbytes - 1
+            interpweights(oldpres, newpres + 3)
+            self.assertEqual(len(_interpweightcache), 2)
+        finally:
+            _interpweightcachebytes = cachebytes
+            _interpweightcache.clear()
+            _interpweightcacheused = 0
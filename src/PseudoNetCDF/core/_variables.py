@@ -1,7 +1,51 @@
 from warnings import warn
+import unittest
+from collections import OrderedDict
+try:
+    from types import MappingProxyType
+except ImportError:
+    MappingProxyType = dict
 
 import numpy as np
 
+# Variable metadata is an immutable mapping shared by a variable and its
+# slices and views; setting or deleting an attribute replaces the mapping
+_emptyattrs = MappingProxyType(OrderedDict())
+
+def _updateattrs(attrs, k, v = None, delete = False):
+    """
+    Return a new immutable mapping with k set to v (or deleted)
+    """
+    newattrs = OrderedDict(attrs)
+    if delete:
+        del newattrs[k]
+    else:
+        newattrs[k] = v
+    return MappingProxyType(newattrs)
+
+def _setattrs(obj, attrs):
+    """
+    Set the shared metadata of obj and copy it into obj.__dict__, which
+    numpy copies to views of other types (e.g., np.ma.masked_less(var))
+    """
+    objd = obj.__dict__
+    for k in objd.get('_attrs', _emptyattrs):
+        if k not in attrs:
+            objd.pop(k, None)
+    objd['_attrs'] = attrs
+    objd.update(attrs)
+
+def _mergeattrs(attrs, other):
+    """
+    Return attrs updated with other; when attrs is empty, other is
+    returned so that the mapping is shared
+    """
+    if len(attrs) == 0:
+        return other
+    newattrs = OrderedDict(attrs)
+    newattrs.update(other)
+    return MappingProxyType(newattrs)
+
 class PseudoNetCDFVariable(np.ndarray):
     """
     PseudoNetCDFVariable presents the Scientific.IO.NetCDF.NetCDFVariable interface,
@@ -9,6 +53,7 @@ class PseudoNetCDFVariable(np.ndarray):
     without adding it to the parent file
     """
     __array_priority__ = 10000000.
+    _attrs = _emptyattrs
     def xarray(self, iscoord = False):
         """
 Experimental function
@@ -104,19 +149,34 @@ Notes:
         """
         return self.view(type = np.ndarray)
     
+    def __getattr__(self, k):
+        """
+        User-defined attributes are read from the shared metadata
+        """
+        try:
+            return self._attrs[k]
+        except KeyError:
+            raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, k))
+    
     def __setattr__(self, k, v):
         """
         Set attributes (aka properties) and identify user-defined attributes.
         """
-        if k[:1] != '_' and \
-           not k in ('dimensions', 'typecode'):
-            if k not in self._ncattrs:
-                self._ncattrs += (k, )
-        object.__setattr__(self, k, v)
+        if k == '_attrs':
+            _setattrs(self, v)
+            return
+        if k[:1] == '_' or k in ('dimensions', 'typecode'):
+            object.__setattr__(self, k, v)
+            return
+        _setattrs(self, _updateattrs(self._attrs, k, v))
+        if hasattr(type(self), k):
+            # array properties (e.g., fill_value) are also set
+            object.__setattr__(self, k, v)
     
     def __delattr__(self, k):
-        if k in self._ncattrs:
-            self._ncattrs = tuple([k_ for k_ in self._ncattrs if k_ != k])
+        if k in self._attrs:
+            _setattrs(self, _updateattrs(self._attrs, k, delete = True))
+            return
         object.__delattr__(self, k)
 
     def setncattr(self, k, v):
@@ -127,7 +187,7 @@ Notes:
         Returns a tuple of attributes that have been user defined
         """
         
-        return self._ncattrs
+        return tuple(self._attrs)
     
     def __new__(subtype,parent,name,typecode,dimensions,**kwds):
         """
@@ -163,7 +223,7 @@ Notes:
 
         result.typecode = lambda: typecode
         result.dimensions = tuple(dimensions)
-        result._ncattrs = ()
+        result._attrs = _emptyattrs
         result._parent= parent
         result._name = name
         for k,v in kwds.items():
@@ -172,20 +232,15 @@ Notes:
 
     def __array_finalize__(self, obj):
         if obj is None: return
-        _parent = getattr(obj, '_parent', object())
-        object.__setattr__(self, '_parent', _parent)
-        _name = getattr(obj, '_name', 'unknown')
-        object.__setattr__(self, '_name', _name)
-        ntypecode = getattr(obj, 'typecode', lambda: self.dtype.char)
-        object.__setattr__(self, 'typecode', ntypecode)
-        ndimensions = getattr(obj, 'dimensions', lambda: self.dtype.char)
-        object.__setattr__(self, 'dimensions', ndimensions)
-        nncattrs = getattr(obj, '_ncattrs', getattr(self, '_ncattrs', ()))
-        object.__setattr__(self, '_ncattrs', nncattrs) 
-        if hasattr(obj, '_ncattrs'):
-            for k in nncattrs:
-                if not hasattr(self, k):
-                    object.__setattr__(self, k, getattr(obj, k))
+        # slices and views reference the metadata of obj; nothing is copied
+        objd = getattr(obj, '__dict__', {})
+        selfd = self.__dict__
+        selfd['_parent'] = objd['_parent'] if '_parent' in objd else object()
+        selfd['_name'] = objd.get('_name', 'unknown')
+        selfd['typecode'] = objd['typecode'] if 'typecode' in objd else (lambda: self.dtype.char)
+        selfd['dimensions'] = objd['dimensions'] if 'dimensions' in objd else (lambda: self.dtype.char)
+        attrs = selfd['_attrs'] = objd.get('_attrs', selfd.get('_attrs', _emptyattrs))
+        selfd.update(attrs)
         
     def swapaxes(self, a1, a2):
         out = np.ndarray.swapaxes(self, a1, a2)
@@ -240,7 +295,7 @@ class PseudoNetCDFMaskedVariable(PseudoNetCDFVariable, np.ma.MaskedArray):
             result=np.ma.zeros(shape, dtype = 'S1' if typecode == 'c' else typecode, fill_value = kwds.get('fill_value', None))
 
         result=result.view(subtype)
-        result._ncattrs = ()
+        result._attrs = _emptyattrs
         result._parent = parent
         result._name = name
         result.typecode = lambda: typecode
@@ -259,46 +314,48 @@ class PseudoNetCDFMaskedVariable(PseudoNetCDFVariable, np.ma.MaskedArray):
         np.ma.MaskedArray.__array_finalize__(self, obj)
     
     def _update_from(self, obj):
+        objd = getattr(obj, '__dict__', {})
+        selfd = self.__dict__
         dt = self.dtype.char
-        self.typecode = getattr(obj, 'typecode', lambda: ('c' if dt == 'S' else dt))
-        self.dimensions = getattr(obj, 'dimensions', getattr(self, 'dimensions', ()))
-        self._ncattrs = getattr(obj, '_ncattrs', getattr(self, '_ncattrs', ()))
-        self._fill_value = getattr(obj, '_fill_value', getattr(self, '_fill_value', -999))
-        if hasattr(obj, '_ncattrs'):
-            for k in obj._ncattrs:
-                if k in ('fill_value',): continue
-                setattr(self, k, getattr(obj, k))
+        selfd['typecode'] = objd['typecode'] if 'typecode' in objd else (lambda: ('c' if dt == 'S' else dt))
+        selfd['dimensions'] = objd.get('dimensions', selfd.get('dimensions', ()))
+        attrs = objd.get('_attrs', selfd.get('_attrs', _emptyattrs))
+        selfd['_fill_value'] = getattr(obj, '_fill_value', getattr(self, '_fill_value', -999))
         np.ma.MaskedArray._update_from(self, obj)
-                
+        _setattrs(self, attrs)
+    
     def __getitem__(self, item):
+        if self.dtype.fields is None and self.dtype.kind != 'O':
+            # unmasked elements are returned like ndarray elements
+            dout = self._data[item]
+            if not isinstance(dout, np.ndarray):
+                mask = self._mask
+                if mask is np.ma.nomask or not mask[item]:
+                    return dout
         out = np.ma.MaskedArray.__getitem__(self, item)
         try: out._fill_value = self._fill_value
         except: pass
-        out = out.view(PseudoNetCDFMaskedVariable)
+        if not isinstance(out, PseudoNetCDFMaskedVariable):
+            out = out.view(PseudoNetCDFMaskedVariable)
         if np.isscalar(out): return out
-        if hasattr(self, 'dimensions'):
-            out.dimensions = self.dimensions
-        if hasattr(self, '_ncattrs'):
-            for k in self._ncattrs:
-                setattr(out, k, getattr(self, k))
-        else:
-            self._ncattrs = ()
+        out.dimensions = self.dimensions
+        out._attrs = self._attrs
         return out
 
     def __setattr__(self, k, v):
         """
         Set attributes (aka properties) and identify user-defined attributes.
         """
-        if k[:1] != '_' and \
-           not k in ('dimensions', 'typecode'):
-            if k not in self._ncattrs:
-                self._ncattrs += (k, )
-        np.ma.MaskedArray.__setattr__(self, k, v)
-
-    def __delattr__(self, k):
-        if k in self._ncattrs:
-            self._ncattrs = tuple([k_ for k_ in self._ncattrs if k_ != k])
-        object.__delattr__(self, k)
+        if k == '_attrs':
+            _setattrs(self, v)
+            return
+        if k[:1] == '_' or k in ('dimensions', 'typecode'):
+            np.ma.MaskedArray.__setattr__(self, k, v)
+            return
+        _setattrs(self, _updateattrs(self._attrs, k, v))
+        if hasattr(type(self), k):
+            # array properties (e.g., fill_value) are also set
+            np.ma.MaskedArray.__setattr__(self, k, v)
 
     def swapaxes(self, a1, a2):
         out = np.ma.masked_array.swapaxes(self, a1, a2)
@@ -314,7 +371,7 @@ class PseudoNetCDFMaskedVariable(PseudoNetCDFVariable, np.ma.MaskedArray):
         Returns a tuple of attributes that have been user defined
         """
         
-        return self._ncattrs
+        return tuple(self._attrs)
 
     def getValue(self):
         """
@@ -357,3 +414,178 @@ def PseudoIOAPIVariable(parent,name,typecode,dimensions,**kwds):
 
     return retval
     
+
+class PseudoNetCDFLazyVariable(np.lib.mixins.NDArrayOperatorsMixin):
+    """
+    Base for variables that compute values only for the requested
+    index (e.g., readers that read only the requested records or
+    results of slice_dim). Subclasses set _parent, _name, dimensions,
+    shape, dtype and attributes and provide _getitem(item), which
+    returns values for item (see _wrap). Array methods and operators
+    read all values.
+    """
+    # names of user-defined attributes (see __setattr__)
+    _ncattrs = ()
+    # results of functions (e.g., slice_dim or pncbo) set _copyonwrite,
+    # so the first assignment keeps a private copy of all values (_copy)
+    # that later reads use; views of file data cannot be modified
+    _copyonwrite = False
+    _copy = None
+    def __setattr__(self, k, v):
+        if k[:1] != '_' and \
+           not k in ('dimensions', 'typecode', 'shape', 'dtype', 'fill_value'):
+            if k not in self._ncattrs:
+                object.__setattr__(self, '_ncattrs', self._ncattrs + (k,))
+        object.__setattr__(self, k, v)
+    
+    def __delattr__(self, k):
+        if k in self._ncattrs:
+            object.__setattr__(self, '_ncattrs', tuple([k_ for k_ in self._ncattrs if k_ != k]))
+        object.__delattr__(self, k)
+    
+    def __getattr__(self, k):
+        # Array methods and properties (e.g., mean) read all values
+        if k[:1] != '_' and hasattr(np.ndarray, k):
+            return getattr(self[...], k)
+        raise AttributeError(k)
+    
+    def ncattrs(self):
+        return self._ncattrs
+    
+    def setncattr(self, k, v):
+        return setattr(self, k, v)
+    
+    def typecode(self):
+        return 'c' if self.dtype.char == 'S' else self.dtype.char
+    
+    @property
+    def ndim(self):
+        return len(self.shape)
+    
+    def __len__(self):
+        return self.shape[0]
+    
+    def __array__(self, dtype = None):
+        return np.asarray(self[...], dtype = dtype)
+    
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwds):
+        inputs = tuple([i[...] if isinstance(i, PseudoNetCDFLazyVariable) else i for i in inputs])
+        return getattr(ufunc, method)(*inputs, **kwds)
+    
+    def __getitem__(self, item):
+        if self._copy is not None:
+            return self._wrap(self._copy[item])
+        return self._getitem(item)
+    
+    def __setitem__(self, item, value):
+        if not self._copyonwrite:
+            raise TypeError('%s is computed when read and cannot be modified; use getvarpnc to get a copy' % self._name)
+        if self._copy is None:
+            values = self._getitem(Ellipsis)
+            if isinstance(values, np.ma.MaskedArray):
+                values = np.ma.array(values, copy = True, subok = False)
+            else:
+                values = np.array(values, copy = True)
+            object.__setattr__(self, '_copy', values)
+        self._copy[item] = value
+    
+    def _wrap(self, values):
+        """
+        Return array values as a PseudoNetCDFVariable (or, with masked
+        values, PseudoNetCDFMaskedVariable) with the dimensions and
+        attributes of this variable (like slices of file variables);
+        scalars are returned as is
+        """
+        if not isinstance(values, np.ndarray):
+            return values
+        props = dict([(k, getattr(self, k)) for k in self._ncattrs])
+        if isinstance(values, np.ma.MaskedArray):
+            if 'fill_value' in self.__dict__:
+                props['fill_value'] = self.fill_value
+            return PseudoNetCDFMaskedVariable(self._parent, self._name, values.dtype.char, self.dimensions, values = values, **props)
+        return PseudoNetCDFVariable(self._parent, self._name, values.dtype.char, self.dimensions, values = values, **props)
+    
+    def _expanditem(self, item):
+        """
+        Return item as a tuple with Ellipsis expanded and one entry per
+        dimension (unless item has more entries or None)
+        """
+        if not isinstance(item, tuple):
+            item = (item,)
+        ellipses = [ii for ii, i in enumerate(item) if i is Ellipsis]
+        if len(ellipses) > 0:
+            ei = ellipses[0]
+            item = item[:ei] + (slice(None),) * (self.ndim - len(item) + 1) + item[ei + 1:]
+        return item + (slice(None),) * (self.ndim - len(item))
+
+
+class PseudoNetCDFVariableTest(unittest.TestCase):
+    def runTest(self):
+        pass
+    
+    def setUp(self):
+        from ._files import PseudoNetCDFFile
+        self.tncf = tncf = PseudoNetCDFFile()
+        for dk, dl in zip(('TSTEP', 'LAY', 'ROW', 'COL'), (24, 4, 5, 6)):
+            tncf.createDimension(dk, dl)
+        vals = np.arange(24 * 4 * 5 * 6, dtype = 'f').reshape(24, 4, 5, 6)
+        tncf.createVariable('O3', 'f', ('TSTEP', 'LAY', 'ROW', 'COL'), values = vals, units = 'ppb', long_name = 'O3')
+        tncf.createVariable('NO', 'f', ('TSTEP', 'LAY', 'ROW', 'COL'), values = np.ma.masked_less(vals, 10), units = 'ppb', long_name = 'NO')
+    
+    def testSharedAttrs(self):
+        for vark in ['O3', 'NO']:
+            var = self.tncf.variables[vark]
+            row = var[1, 2]
+            self.assertEqual(row.ncattrs(), ('units', 'long_name'))
+            self.assert_(row._attrs is var._attrs)
+            self.assertEqual(row.dimensions, var.dimensions)
+            row.units = 'ppm'
+            row.scale = 1.
+            self.assertEqual(row.ncattrs(), ('units', 'long_name', 'scale'))
+            self.assertEqual(var.units, 'ppb')
+            self.assert_(not hasattr(var, 'scale'))
+            del row.long_name
+            self.assertEqual(row.ncattrs(), ('units', 'scale'))
+            self.assertEqual(var.long_name, 'O3' if vark == 'O3' else 'NO')
+            self.assertRaises(AttributeError, getattr, row, 'long_name')
+        
+        no = self.tncf.variables['NO']
+        self.assertEqual(no[1, 2, 3, 4], no.data[1, 2, 3, 4])
+        self.assert_(np.isscalar(no[1, 2, 3, 4]))
+        self.assert_(np.ma.getmaskarray(no[0, 0, 0, 0]))
+        no.fill_value = -1.
+        self.assertEqual(no.fill_value, -1.)
+        self.assert_('fill_value' in no.ncattrs())
+
+    def testViewAttrs(self):
+        # plain ndarray and MaskedArray views keep the attributes
+        for vark in ['O3', 'NO']:
+            var = self.tncf.variables[vark]
+            self.assertEqual(np.ma.masked_less(var[:], 1).units, 'ppb')
+            self.assertEqual(np.ma.masked_less(var[1, 2], 1).long_name, vark)
+            row = var[1]
+            row.units = 'ppm'
+            del row.long_name
+            masked = np.ma.masked_less(row, 1)
+            self.assertEqual(masked.units, 'ppm')
+            self.assert_(not hasattr(masked, 'long_name'))
+            self.assertEqual(np.ma.masked_less(var[:], 1).long_name, vark)
+    
+    def testLazyVariable(self):
+        class squares(PseudoNetCDFLazyVariable):
+            def __init__(self, parent, name):
+                self._parent = parent
+                self._name = name
+                self.dimensions = ('TSTEP',)
+                self.shape = (len(parent.dimensions['TSTEP']),)
+                self.dtype = np.dtype('i')
+                self.units = 'none'
+            def _getitem(self, item):
+                return self._wrap(np.arange(self.shape[0])[item] ** 2)
+        var = squares(self.tncf, 'SQ')
+        self.assertEqual(var.ncattrs(), ('units',))
+        self.assert_((var[1:3] == [1, 4]).all())
+        self.assertEqual(var[1:3].units, 'none')
+        self.assertEqual(var[2], 4)
+        self.assertEqual((var + 1).sum(), (np.arange(var.shape[0]) ** 2 + 1).sum())
+        self.assertRaises(TypeError, var.__setitem__, 0, 1)
@@ -1,7 +1,8 @@
 from __future__ import print_function
 import sys
 if (sys.version_info > (3, 0)):
-   openf = open
+   # universal newlines are the default; the U mode was removed in 3.11
+   openf = lambda path, mode, encoding: open(path, mode.replace('U', ''), encoding = encoding)
 else:
    openf = lambda path, mode, encoding: open(path, mode)
 
@@ -2,14 +2,40 @@ from __future__ import print_function
 import sys
 from warnings import warn
 from types import MethodType
+from threading import Lock
+import unittest
 from PseudoNetCDF.netcdf import NetCDFFile, NetCDFVariable
-from .sci_var import PseudoNetCDFFile
+from .core._variables import _mergeattrs
+from .sci_var import PseudoNetCDFFile, PseudoNetCDFVariable
 from .sci_var import get_ncf_object
 import numpy as np
 if sys.version_info > (3,):
     long = int
 
 
+def _inmemory(nfile):
+    """
+    True when nfile is a PseudoNetCDFFile whose sync does nothing (i.e.,
+    an in-memory target); headers are then copied in bulk without sync
+    or flush
+    """
+    sync = getattr(type(nfile), 'sync', None)
+    return isinstance(nfile, PseudoNetCDFFile) and \
+           getattr(sync, '__func__', sync) is getattr(PseudoNetCDFFile.sync, '__func__', PseudoNetCDFFile.sync)
+
+def _threadsafe(pfile):
+    """
+    True when variables of pfile can be read from several threads at
+    once. Readers opt in with PseudoNetCDFFile.threadsafe; results of
+    functions (e.g., slice_dim, reduce_dim or stack_files) list the
+    files they read in _sourcefiles and are thread safe when all of
+    those files are. Anything else (e.g., netCDF files) is read serially.
+    """
+    sources = getattr(pfile, '_sourcefiles', None)
+    if type(pfile) is PseudoNetCDFFile and sources is not None:
+        return all([_threadsafe(f) for f in sources])
+    return getattr(type(pfile), 'threadsafe', False)
+
 class Pseudo2NetCDF:
     """
     Pseudo2NetCDF is a base class for conversion.  Properties and methods can
@@ -27,9 +53,24 @@ class Pseudo2NetCDF:
     special_properties = ['_fillvalue', '_FillValue']
     unlimited_dimensions = []
     create_variable_kwds = {}
-    def __init__(self, datafirst = False, verbose = 1):
+    chunkbytes = 2**26
+    def __init__(self, datafirst = False, verbose = 1, chunksize = None, complevel = 0, workers = 1):
+        """
+        datafirst - write each variable's data when it is defined
+                    (ignored when variables are populated by workers)
+        verbose - print progress
+        chunksize - records of the first dimension to copy at a time;
+                    None uses as many as fit in chunkbytes
+        complevel - zlib compression level (0-9) for netCDF4 outputs
+        workers - threads that read and decode variables concurrently
+                  (only for readers with threadsafe = True; others are
+                  read serially)
+        """
         self.datafirst = datafirst
         self.verbose = verbose
+        self.chunksize = chunksize
+        self.complevel = complevel
+        self.workers = workers
     def convert(self,pfile,npath=None, inmode = 'r', outmode = 'w', format = 'NETCDF4'):
         pfile = get_ncf_object(pfile, inmode)
         nfile = get_ncf_object(npath, outmode, format = format)
@@ -42,6 +83,41 @@ class Pseudo2NetCDF:
         nfile.sync()
         return nfile
         
+    def _keepattrs(self, keys, ignore, regex, special = ()):
+        """
+        Return the attribute keys that are not ignored (by name or regex)
+        or that are special; attribute names repeat across variables, so
+        decisions are cached by (regex, ignore list, name) for this
+        converter (see _keepcache)
+        """
+        cache = self._keepcache().setdefault((regex.pattern, tuple(ignore), tuple(special)), {})
+        out = []
+        for k in keys:
+            keep = cache.get(k)
+            if keep is None:
+                keep = cache[k] = (k not in ignore and regex.match(k) is None) or k in special
+            if keep:
+                out.append(k)
+        return out
+    
+    def _classattrs(self, cls):
+        """
+        Return the set of attribute names defined by cls (e.g., array
+        properties that must be set rather than shared)
+        """
+        key = ('class', cls)
+        cache = self._keepcache()
+        if key not in cache:
+            cache[key] = frozenset(dir(cls))
+        return cache[key]
+    
+    def _keepcache(self):
+        """
+        Return the attribute filter cache of this converter; it is
+        discarded with the converter, so it does not grow across runs
+        """
+        return self.__dict__.setdefault('_keepcachedict', {})
+    
     def addDimensions(self,pfile,nfile):
         for d in pfile.dimensions.keys():
             self.addDimension(pfile, nfile, d)
@@ -61,10 +137,26 @@ class Pseudo2NetCDF:
         else:
             nd = nfile.createDimension(d,v)
 
-        nfile.sync()
+        if not _inmemory(nfile):
+            nfile.sync()
     
     def addGlobalProperties(self,pfile,nfile):
-        for k in [k for k in pfile.ncattrs() if k not in self.ignore_global_properties and self.ignore_global_re.match(k)==None]:
+        keys = self._keepattrs(pfile.ncattrs(), self.ignore_global_properties, self.ignore_global_re)
+        if _inmemory(nfile):
+            # one update of the attribute dictionary; class attributes
+            # (e.g., properties) are still set one at a time
+            classattrs = self._classattrs(type(nfile))
+            props = [(k, getattr(pfile, k)) for k in keys]
+            props = [(k, v) for k, v in props if not isinstance(v, MethodType)]
+            bulk = [(k, v) for k, v in props if k not in classattrs]
+            nfile.__dict__.update(bulk)
+            existing = set(nfile._ncattrs)
+            nfile._ncattrs += tuple([k for k, v in bulk if k not in existing])
+            for k, v in props:
+                if k in classattrs:
+                    setattr(nfile, k, v)
+            return
+        for k in keys:
             value=getattr(pfile,k)
             if not isinstance(value, MethodType):
                 try:
@@ -78,7 +170,15 @@ class Pseudo2NetCDF:
                     warn("Could not add %s to file; %s: %s" % (k, type(e), e))
 
     def addVariableProperties(self,pvar,nvar):
-        for a in [k for k in pvar.ncattrs() if (k not in self.ignore_variable_properties and self.ignore_variable_re.match(k)==None) or k in self.special_properties]:
+        keys = self._keepattrs(pvar.ncattrs(), self.ignore_variable_properties, self.ignore_variable_re, self.special_properties)
+        if isinstance(pvar, PseudoNetCDFVariable) and isinstance(nvar, PseudoNetCDFVariable) and \
+           len(keys) == len(pvar._attrs) and \
+           self._classattrs(type(nvar)).isdisjoint(keys) and \
+           not any([isinstance(v, MethodType) for v in pvar._attrs.values()]):
+            # in-memory variables share the immutable attribute mapping
+            nvar._attrs = _mergeattrs(nvar._attrs, pvar._attrs)
+            return
+        for a in keys:
             value=getattr(pvar,a)
             if isinstance(nvar, NetCDFVariable) and a == '_FillValue':
                 continue
@@ -114,10 +214,31 @@ class Pseudo2NetCDF:
         elif hasattr(pvar, '_FillValue'):
             create_variable_kwds['fill_value'] = pvar._FillValue
         
+        if getattr(nfile, 'data_model', '').startswith('NETCDF4') and len(pvar.dimensions) > 0:
+            # netCDF4 chunks match the hyperslabs written by addVariableData
+            chunklen = min(self.getChunkLength(pvar), max(1, pvar.shape[0]))
+            create_variable_kwds.setdefault('chunksizes', (chunklen,) + tuple([max(1, l) for l in pvar.shape[1:]]))
+            if self.complevel > 0:
+                create_variable_kwds.setdefault('zlib', True)
+                create_variable_kwds.setdefault('complevel', self.complevel)
+        
+        if data and _inmemory(nfile) and not isinstance(pvar, NetCDFVariable):
+            # in-memory targets get a filled copy of the values when the
+            # variable is created (no zeros, hyperslabs, sync or flush)
+            vals = pvar[...]
+            if isinstance(vals, np.ma.MaskedArray):
+                vals = vals.filled(create_variable_kwds.get('fill_value', getattr(pvar, 'missing_value', -9999)))
+            vals = np.array(vals, dtype = 'S1' if typecode == 'c' else typecode)
+            nvar = nfile.createVariable(k, typecode, pvar.dimensions, values = vals, **create_variable_kwds)
+            self.addVariableProperties(pvar, nvar)
+            return
+        
         nvar=nfile.createVariable(k,typecode,pvar.dimensions, **create_variable_kwds)
         self.addVariableProperties(pvar,nvar)
         if data:
             self.addVariableData(pfile, nfile, k)
+        if _inmemory(nfile):
+            return
         nfile.sync()
         try:
             nfile.flush()
@@ -125,37 +246,102 @@ class Pseudo2NetCDF:
             pass
         del pvar,nvar
 
-    def addVariableData(self, pfile, nfile, k):
+    def getChunkLength(self, pvar):
+        """
+        Return the number of records of the first dimension of pvar
+        to copy at a time
+        """
+        if self.chunksize is not None:
+            return max(1, int(self.chunksize))
+        try:
+            itemsize = np.dtype(pvar.dtype).itemsize
+        except TypeError:
+            itemsize = 8
+        recordbytes = itemsize * int(np.prod(pvar.shape[1:]))
+        return int(max(1, self.chunkbytes // max(1, recordbytes)))
+    
+    def addVariableData(self, pfile, nfile, k, lock = None):
+        """
+        Copy values of k from pfile to nfile in hyperslabs of the first
+        dimension (see getChunkLength) so that memory use is bounded;
+        nfile is only used while holding lock (if provided)
+        """
         from numpy.ma import MaskedArray
         from numpy import ndarray, isscalar
-        nvar = nfile.variables[k]
+        if lock is None:
+            lock = Lock()
         pvar = pfile.variables[k]
-        if isscalar(nvar) or nvar.ndim == 0:
+        with lock:
+            nvar = nfile.variables[k]
+            scalar = isscalar(nvar) or nvar.ndim == 0
+            if not scalar:
+                fill_value = getattr(nvar, 'fill_value', getattr(nvar, '_FillValue', getattr(pvar, 'missing_value', -9999)))
+        if scalar:
             if isinstance(pvar, NetCDFVariable):
                 pvar = pvar[...]
-            nvar[...] = pvar
-        elif isinstance(pvar[...], MaskedArray):
-            nvar[:] = pvar[...].filled(getattr(nvar, 'fill_value', getattr(nvar, '_FillValue', getattr(pvar, 'missing_value', -9999))))
-        else:
-            nvar[:] = pvar[...]
+            with lock:
+                nvar[...] = pvar
+            return
+        
+        nrecords = pvar.shape[0]
+        chunklen = self.getChunkLength(pvar)
+        for start in range(0, nrecords, chunklen):
+            end = min(start + chunklen, nrecords)
+            vals = pvar[start:end]
+            if isinstance(vals, MaskedArray):
+                vals = vals.filled(fill_value)
+            with lock:
+                nvar[start:end] = vals
         
+    def addVariablesData(self, pfile, nfile, keys):
+        """
+        Populate variables (keys) using workers threads that read and
+        decode concurrently; writes to nfile are serialized
+        """
+        try:
+            from concurrent.futures import ThreadPoolExecutor
+        except ImportError:
+            warn('concurrent.futures is not available; populating variables serially')
+            ThreadPoolExecutor = None
+        
+        lock = Lock()
+        def populate(k):
+            if self.verbose:
+                with lock:
+                    print("Populating", k, file = sys.stdout)
+            self.addVariableData(pfile, nfile, k, lock = lock)
+        
+        if ThreadPoolExecutor is None:
+            for k in keys:
+                populate(k)
+        else:
+            with ThreadPoolExecutor(self.workers) as executor:
+                for result in executor.map(populate, keys):
+                    pass
 
     def addVariables(self,pfile,nfile):
+        # only readers that opt in (see _threadsafe) are read by
+        # several workers
+        parallel = self.workers > 1 and _threadsafe(pfile)
+        if _inmemory(nfile):
+            # values are copied as each variable is defined
+            for k in pfile.variables.keys():
+                if self.verbose: print("Adding", k, file = sys.stdout)
+                self.addVariable(pfile,nfile,k)
+            return
         for k in pfile.variables.keys():
             if self.verbose: print("Defining", k, file = sys.stdout)
-            self.addVariable(pfile,nfile,k, data = self.datafirst)
+            self.addVariable(pfile,nfile,k, data = self.datafirst and not parallel)
         nfile.sync()
-        if not self.datafirst:
+        if parallel:
+            self.addVariablesData(pfile, nfile, list(pfile.variables.keys()))
+            nfile.sync()
+        elif not self.datafirst:
             for k in pfile.variables.keys():
                 if self.verbose: print("Populating", k, file = sys.stdout)
                 self.addVariableData(pfile,nfile,k)
             nfile.sync()
 
-from PseudoNetCDF.camxfiles import Writers as CAMxWriters
-import PseudoNetCDF.geoschemfiles as geoschemwriters
-import PseudoNetCDF.icarttfiles.ffi1001 as icarttwriters
-
-from PseudoNetCDF.textfiles import ncf2csv
 def pywriter(ifile, outpath, data = True):
     print("""# Import Libraries and Functions
 from netCDF4 import Dataset
@@ -201,9 +387,15 @@ outfile = Dataset(outpath, 'w')
             print("var[:] = %s" % (repr(v[:].view(type = vtype))))
 
 
-def pncgen(ifile,outpath, inmode = 'r', outmode = 'w', format = 'NETCDF4_CLASSIC', verbose = 1):
+def pncgen(ifile,outpath, inmode = 'r', outmode = 'w', format = 'NETCDF4_CLASSIC', verbose = 1, chunksize = None, complevel = 0, workers = 1):
+    """
+    ifile - file to write
+    outpath - path for output
+    format - NETCDF3_CLASSIC, NETCDF4_CLASSIC, NETCDF4 or a registered writer
+    chunksize, complevel, workers - see Pseudo2NetCDF (netCDF formats only)
+    """
     if format[:6] == 'NETCDF':
-        p2n = Pseudo2NetCDF()
+        p2n = Pseudo2NetCDF(chunksize = chunksize, complevel = complevel, workers = workers)
         p2n.verbose = verbose
         return p2n.convert(ifile, outpath, inmode = inmode, outmode = outmode, format = format)
 
@@ -218,6 +410,9 @@ def pncgen(ifile,outpath, inmode = 'r', outmode = 'w', format = 'NETCDF4_CLASSIC
         writer = writerdict[format]
         return writer(ifile, outpath)
     else:
+        from PseudoNetCDF.camxfiles import Writers as CAMxWriters
+        import PseudoNetCDF.geoschemfiles as geoschemwriters
+        import PseudoNetCDF.icarttfiles.ffi1001 as icarttwriters
         for writers in [CAMxWriters, geoschemwriters, icarttwriters]:
             writer = getattr(writers, 'ncf2%s' % format, None)
             if not writer is None:
@@ -235,7 +430,102 @@ def main():
     if len(ifiles) != 1:
         raise IOError('pncgen can output only 1 file; user requested %d' % len(ifiles))
     ifile, = ifiles
-    return pncgen(ifile, options.outpath, outmode = options.mode, format = options.outformat, verbose = options.verbose), options
+    return pncgen(ifile, options.outpath, outmode = options.mode, format = options.outformat, verbose = options.verbose, chunksize = options.chunksize, complevel = options.complevel, workers = options.workers), options
 
 if __name__ == '__main__':
     main()
+
+class TestPncgen(unittest.TestCase):
+    def runTest(self):
+        pass
+    def setUp(self):
+        from PseudoNetCDF.testcase import self_described_paths
+        self.path = self_described_paths['uamiv']
+    
+    def testChunkedCopy(self):
+        import os
+        from tempfile import mkdtemp
+        from shutil import rmtree
+        from PseudoNetCDF._getreader import pncopen
+        ifile = pncopen(self.path, format = 'uamiv', addcf = False)
+        tmpdir = mkdtemp()
+        try:
+            outpath = os.path.join(tmpdir, 'chunked.nc')
+            ofile = pncgen(ifile, outpath, format = 'NETCDF4_CLASSIC', verbose = 0, chunksize = 2, complevel = 1)
+            for k, ivar in ifile.variables.items():
+                ovar = ofile.variables[k]
+                self.assert_((ovar[...] == ivar[...]).all())
+                if ivar.ndim > 0 and ivar.shape[0] > 1:
+                    self.assertEqual(ovar.chunking()[0], 2)
+                    self.assertEqual(ovar.filters()['complevel'], 1)
+            ofile.close()
+        finally:
+            rmtree(tmpdir)
+
+    def testParallelCopy(self):
+        import os
+        from tempfile import mkdtemp
+        from shutil import rmtree
+        from PseudoNetCDF._getreader import pncopen
+        ifile = pncopen(self.path, format = 'uamiv', addcf = False)
+        tmpdir = mkdtemp()
+        try:
+            outpath = os.path.join(tmpdir, 'parallel.nc')
+            ofile = pncgen(ifile, outpath, format = 'NETCDF3_CLASSIC', verbose = 0, chunksize = 1, workers = 4)
+            for k, ivar in ifile.variables.items():
+                self.assert_((ofile.variables[k][...] == ivar[...]).all())
+            ofile.close()
+        finally:
+            rmtree(tmpdir)
+
+    def testThreadsafe(self):
+        import os
+        from tempfile import mkdtemp
+        from shutil import rmtree
+        from PseudoNetCDF._getreader import pncopen
+        from PseudoNetCDF.core._functions import slice_dim, reduce_dim, stack_files
+        ifile = pncopen(self.path, format = 'uamiv', addcf = False)
+        self.assertEqual(_threadsafe(ifile), True)
+        self.assertEqual(_threadsafe(reduce_dim(slice_dim(ifile, 'TSTEP,0,2'), 'TSTEP,mean')), True)
+        self.assertEqual(_threadsafe(PseudoNetCDFFile()), False)
+        tmpdir = mkdtemp()
+        try:
+            ncfile = pncgen(ifile, os.path.join(tmpdir, 'source.nc'), format = 'NETCDF4_CLASSIC', verbose = 0)
+            # netCDF files and functions of them are read serially
+            self.assertEqual(_threadsafe(ncfile), False)
+            self.assertEqual(_threadsafe(reduce_dim(slice_dim(ncfile, 'TSTEP,0,2'), 'TSTEP,mean')), False)
+            self.assertEqual(_threadsafe(stack_files([ifile, ncfile], 'TSTEP')), False)
+            outf = slice_dim(ncfile, 'TSTEP,0,2')
+            ofile = pncgen(outf, os.path.join(tmpdir, 'sliced.nc'), format = 'NETCDF3_CLASSIC', verbose = 0, workers = 4)
+            self.assert_((ofile.variables['O3'][...] == ifile.variables['O3'][:2]).all())
+            ofile.close()
+            ncfile.close()
+        finally:
+            rmtree(tmpdir)
+
+    def testInMemoryCopy(self):
+        # Headers of in-memory targets are copied in bulk and variable
+        # attributes are shared
+        ifile = PseudoNetCDFFile()
+        ifile.createDimension('TSTEP', 24).setunlimited(True)
+        ifile.createDimension('RXN', 2)
+        ifile.NAME = 'IRR'
+        ifile._private = 1
+        for i in range(2000):
+            ifile.createVariable('IRR_%d' % i, 'f', ('TSTEP', 'RXN'), values = np.ones((24, 2), dtype = 'f') * i, units = 'ppm/h', long_name = ('IRR_%d' % i).ljust(16))
+        ifile.createVariable('MASKED', 'f', ('TSTEP', 'RXN'), values = np.ma.masked_less(np.arange(48, dtype = 'f').reshape(24, 2), 2), units = 'ppm')
+        ofile = Pseudo2NetCDF(verbose = 0).convert(ifile, PseudoNetCDFFile())
+        self.assertEqual(ofile.ncattrs(), ('NAME',))
+        self.assert_(ofile.dimensions['TSTEP'].isunlimited())
+        ivar = ifile.variables['IRR_3']
+        ovar = ofile.variables['IRR_3']
+        self.assert_(ovar._attrs is ivar._attrs)
+        self.assert_((ovar[...] == 3).all())
+        ovar[:] = 0
+        ovar.units = 'ppb/h'
+        self.assert_((ivar[...] == 3).all())
+        self.assertEqual(ivar.units, 'ppm/h')
+        masked = ofile.variables['MASKED']
+        self.assertEqual(masked[0, 0], np.float32(ifile.variables['MASKED'].fill_value))
+        self.assertEqual(masked[1, 0], 2)
+        self.assertEqual(masked.units, 'ppm')
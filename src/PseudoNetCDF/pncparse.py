@@ -1,31 +1,52 @@
 from __future__ import print_function, unicode_literals
 import os
 import sys
+import unittest
 from warnings import warn
 from argparse import ArgumentParser, Action, RawDescriptionHelpFormatter
-from .cmaqfiles import *
-from .camxfiles.Memmaps import *
-from .camxfiles.Readers import irr as irr_read, ipr as ipr_read
-from .net_balance import mrgaloft, sum_reader, net_reader, ctb_reader
-from ._getreader import anyfile, getreaderdict
+from ._getreader import anyfile, getreaderdict, _loadreader
 from ._getwriter import getwriterdict
-from .icarttfiles.ffi1001 import ffi1001, ncf2ffi1001
-from .geoschemfiles import *
-from .noaafiles import *
 from .conventions.ioapi import *
-from .aermodfiles import *
 from PseudoNetCDF import PseudoNetCDFFile
 from PseudoNetCDF.netcdf import NetCDFFile
 
-allreaders = getreaderdict()
-allwriters = getwriterdict()
-globals().update(allreaders)
-_readernames = [(k.count('.') if k[:1] != '_' else 9999, k) for k in getreaderdict().keys()]
-_readernames.sort()
-_readernames = [k for c, k in _readernames]
-_writernames = [(k.count('.'), k) for k in getwriterdict().keys()]
-_writernames.sort()
-_writernames = [k for c, k in _writernames]
+# Modules whose public names can be used in format expressions; they
+# are imported only when a format is not a registered reader name
+_formatmodules = [('.cmaqfiles', None), ('.camxfiles.Memmaps', None),
+                  ('.net_balance', ['mrgaloft', 'sum_reader', 'net_reader', 'ctb_reader']),
+                  ('.icarttfiles.ffi1001', ['ffi1001', 'ncf2ffi1001']),
+                  ('.geoschemfiles', None), ('.noaafiles', None),
+                  ('.aermodfiles', None)]
+
+def _getreadernames():
+    readernames = [(k.count('.') if k[:1] != '_' else 9999, k) for k in getreaderdict().keys()]
+    readernames.sort()
+    return [k for c, k in readernames]
+
+def _getwriternames():
+    writernames = [(k.count('.'), k) for k in getwriterdict().keys()]
+    writernames.sort()
+    return [k for c, k in writernames]
+
+def _getformat(file_format):
+    """
+    Return the reader registered as file_format or evaluate file_format
+    as an expression of reader names (e.g., irr_read)
+    """
+    try:
+        return _loadreader(file_format)
+    except KeyError:
+        pass
+    from importlib import import_module
+    namespace = dict(getreaderdict())
+    for modname, keys in _formatmodules:
+        mod = import_module(modname, __package__)
+        if keys is None:
+            keys = getattr(mod, '__all__', [k for k in dir(mod) if k[:1] != '_'])
+        namespace.update([(k, getattr(mod, k)) for k in keys])
+    from .camxfiles.Readers import irr as irr_read, ipr as ipr_read
+    namespace.update(irr_read = irr_read, ipr_read = ipr_read)
+    return eval(file_format, globals(), namespace)
 
 try:
     from netCDF4 import Dataset as netcdf, MFDataset
@@ -77,7 +98,7 @@ class _HelpListFormats(Action):
         print('The formats listed below are available for the following options')
         print('-f FORMAT or --format FORMAT or --help-format FORMAT')
         print('where FORMAT is one of the options below')
-        print('\t' + '\n\t'.join(_readernames))
+        print('\t' + '\n\t'.join(_getreadernames()))
         print('**Some readers are listed twice (e.g., without dotted form)')
         setattr(namespace, 'help', True)
 
@@ -101,7 +122,7 @@ class _HelpFormat(Action):
         print('the input path must be specified using keyword')
         print('arguments.')
         print('')
-        helpformat = allreaders[file_format]
+        helpformat = _loadreader(file_format)
         try:
             import inspect
             print('Example:')
@@ -188,9 +209,9 @@ def add_basic_options(parser):
     parser.add_argument("-s", "--slice", dest = "slice", type = str, action = "append", default = [], metavar = 'dim,start[,stop[,step]]',
                         help = "Variables have dimensions (time, layer, lat, lon), which can be subset using dim,start,stop,stride (e.g., --slice=layer,0,47,5 would sample every fifth layer starting at 0)")
 
-    parser.add_argument("-r", "--reduce", dest = "reduce", type = str, action = "append", default = [], metavar = 'dim,function[,weight]', help = "Variable dimensions can be reduced using dim,function,weight syntax (e.g., --reduce=layer,mean,weight). Weighting is not fully functional.")
+    parser.add_argument("-r", "--reduce", dest = "reduce", type = str, action = "append", default = [], metavar = 'dim,function[,weight][,key=value]', help = "Variable dimensions can be reduced using dim,function,weight syntax (e.g., --reduce=layer,mean,weight). Statistics (sum, mean, min, max, var, std, count) can be combined with + to compute all in one pass (e.g., --reduce=TSTEP,mean+max+std produces O3_mean, O3_max and O3_std). Day functions (mda8, daymax, daymin, daymean, daysum, daystd, dayvar) return one value per local day from file times, including partial first and last days (earlier versions dropped the last day); they take utcoffset (hours or a variable like longitude) and mincount (days with fewer values are masked) keywords instead of weights (e.g., --reduce=TSTEP,mda8,utcoffset=-5,mincount=18). Weighting is not fully functional.")
 
-    parser.add_argument("--mesh", dest = "mesh", type = str, action = "append", default = [], metavar = 'dim,weight,function', help = "Variable dimensions can be meshed using dim,function,weight syntax (e.g., --mesh=time,0.5,mean).")
+    parser.add_argument("--mesh", dest = "mesh", type = str, action = "append", default = [], metavar = 'dim,factor,function', help = "Variable dimensions can be meshed using dim,factor,function syntax; factors greater than 1 aggregate blocks (e.g., --mesh=ROW,3,mean) and factors less than 1 refine (e.g., --mesh=time,0.5,mean repeats values and sum spreads them).")
     
     parser.add_argument("-c", "--convolve", dest = "convolve", type = str, action = "append", default = [], metavar = 'dim,mode,wgt1,wgt2,...wgtN', help = "Variable dimension is reduced by convolve function (dim,mode,wgt1,wgt2,...wgtN)")    
 
@@ -200,8 +221,8 @@ def add_basic_options(parser):
     parser.add_argument("--extract-file", dest = "extractfile", action = "append", default = [],
                         help = "pncparse options for file")
 
-    parser.add_argument("--extractmethod", dest = "extractmethod", type = str, default = 'nn', choices = ['nn', 'linear', 'cubic', 'quintic', 'KDTree'],
-                        help = "Method for extraction")
+    parser.add_argument("--extractmethod", dest = "extractmethod", type = str, default = 'nn', choices = ['nn', 'gc', 'linear', 'cubic', 'quintic', 'KDTree'],
+                        help = "Method for extraction (nn and KDTree: nearest in degrees; gc: nearest along great circles)")
 
     
     parser.add_argument("--op-typ", dest = "operators", type = str, action = 'append', default = [], help = "Operator for binary file operations. Binary file operations use the first two files, then the result and the next file, etc. Use " + " or ".join(['//', '<=', '%%', 'is not', '>>', '&', '==', '!=', '+', '*', '-', '/', '<', '>=', '**', '>', '<<', '|', 'is', '^']))
@@ -210,6 +231,8 @@ def add_basic_options(parser):
 
     parser.add_argument("--exprscript", dest = "expressionscripts", type = str, action = 'append', default = [], help = "Generic expressions to execute in the context of the file.")
 
+    parser.add_argument("--expr-chunk-size", dest = "exprchunksize", type = int, default = None, help = "Evaluate --expr and --exprscript on this many elements of the leading dimension at a time; only valid for elementwise expressions.")
+
 def add_2d_options(parser):
     parser.add_argument('--swapaxes', action = 'store_true', help = 'Swap x-y axes')
 
@@ -251,10 +274,16 @@ def add_dump_options(parser):
 def add_output_options(parser):
     parser.add_argument("-O", "--clobber", dest = "clobber", action = 'store_true', default = False, help = "Overwrite existing file if necessary.")
 
-    parser.add_argument("--out-format", dest = "outformat", default = "NETCDF4_CLASSIC", help = "File output format (e.g., NETCDF3_CLASSIC, NETCDF4_CLASSIC, NETCDF4;pncgen only)", type = str, choices = 'NETCDF3_CLASSIC NETCDF4_CLASSIC NETCDF4'.split() + _writernames)
+    parser.add_argument("--out-format", dest = "outformat", default = "NETCDF4_CLASSIC", help = "File output format (e.g., NETCDF3_CLASSIC, NETCDF4_CLASSIC, NETCDF4;pncgen only)", type = str, choices = 'NETCDF3_CLASSIC NETCDF4_CLASSIC NETCDF4'.split() + _getwriternames())
 
     parser.add_argument("--mode", dest = "mode", type = str, default = "w", help = "File mode for writing (w, a or r+ or with unbuffered writes ws, as, or r+s; pncgen only).", choices = 'w a r+ ws as r+s'.split())
 
+    parser.add_argument("--chunk-size", dest = "chunksize", type = int, default = None, help = "Records of the first dimension to copy at a time (default: as many as fit in 64MB; pncgen only)")
+
+    parser.add_argument("--complevel", dest = "complevel", type = int, default = 0, help = "zlib compression level (0-9) for NETCDF4 and NETCDF4_CLASSIC outputs (pncgen only)", choices = range(10))
+
+    parser.add_argument("--workers", dest = "workers", type = int, default = 1, help = "Threads that read and decode variables concurrently for thread-safe readers (e.g., uamiv); writes are serialized (pncgen only)")
+
     parser.add_argument('outpath', default = None, type = str, help='path to a output file formatted as --out-format')
 
 def add_interactive_options(parser):
@@ -489,7 +518,7 @@ def do_actions(outargs):
         if len(outargs.ifiles) != 1:
             raise IOError('pncgen can output only 1 file; user requested %d' % len(outargs.ifiles))
         ifile, = outargs.ifiles
-        pncgen(ifile, outargs.outpath, outmode = outargs.mode, format = outargs.outformat, verbose = outargs.verbose)
+        pncgen(ifile, outargs.outpath, outmode = outargs.mode, format = outargs.outformat, verbose = outargs.verbose, chunksize = outargs.chunksize, complevel = outargs.complevel, workers = outargs.workers)
     elif outargs.subcommand == 'eval':
         from .pnceval import pnceval
         if len(outargs.ifiles) != 2:
@@ -611,11 +640,12 @@ def pncprep(args):
     fs = getfiles(ipaths, args)
     fs = subsetfiles(fs, args)
     fs = seqpncbo(args.operators, fs, coordkeys = args.coordkeys)
+    exprchunksize = getattr(args, 'exprchunksize', None)
     for expr in args.expressions:
-        fs = [pncexpr(expr, f) for f in fs]
+        fs = [pncexpr(expr, f, chunksize = exprchunksize) for f in fs]
     for script in args.expressionscripts:
         expr = open(script).read()
-        fs = [pncexpr(expr, f) for f in fs]
+        fs = [pncexpr(expr, f, chunksize = exprchunksize) for f in fs]
     args.ifiles = fs
     if getattr(args, 'cdlname', None) is None:
         try:
@@ -660,11 +690,7 @@ def getfiles(ipaths, args):
             f = ipath
         elif isinstance(ipath, (str,)) :
             try:
-                allreaders = getreaderdict()
-                if file_format in allreaders:
-                    f = allreaders[file_format](ipath, **format_options)
-                else:
-                    f = eval(file_format)(ipath, **format_options)
+                f = _getformat(file_format)(ipath, **format_options)
             except Exception as e:
                 oute = IOError('Unable to open path with %s(path, **%s)\n\tpath="%s"\n\terror="%s"' % (file_format, str(format_options), ipath, str(e)))
                 raise oute# from e
@@ -675,11 +701,10 @@ def getfiles(ipaths, args):
         history = getattr(f, 'history', getattr(f, 'HISTORY', ''))
         history += ' '.join(args.inputargs) + ';'
         laddconv = args.fromconv is not None and args.toconv is not None
-        lslice = len(args.slice + args.reduce) > 0
         lexpr = len(args.expressions) > 0
         if args.variables is not None:
             f = getvarpnc(f, args.variables, coordkeys = args.coordkeys)
-        elif laddconv or lslice or lexpr:
+        elif laddconv or lexpr:
             f = getvarpnc(f, None)
         for opts in args.attribute:
             add_attr(f, opts)
@@ -704,3 +729,29 @@ def getfiles(ipaths, args):
     if args.merge:
         fs = [merge(fs)]
     return fs
+
+class TestGetfiles(unittest.TestCase):
+    def runTest(self):
+        pass
+    def setUp(self):
+        from PseudoNetCDF.testcase import camxfiles_paths
+        self.path = camxfiles_paths['uamiv']
+    
+    def testMaskConventions(self):
+        # conventions are added to the masked file, which is a new file
+        # whose variables can be modified
+        import numpy as np
+        from warnings import catch_warnings, simplefilter
+        from PseudoNetCDF.camxfiles.uamiv.Memmap import uamiv
+        with catch_warnings(record = True) as warnings:
+            simplefilter('always')
+            (f,), args = pncparse(has_ofile = False, args = ['-f', 'uamiv', '--mask=greater,0.03', '--from-conv=ioapi', '--to-conv=cf', self.path])
+        self.assertEqual([str(w.message) for w in warnings if 'Cannot' in str(w.message)], [])
+        self.assertEqual(f.Conventions, 'CF-1.6')
+        self.assert_('time' in f.variables)
+        o3 = uamiv(self.path).variables['O3'][...]
+        masked = f.variables['O3'][...]
+        self.assert_((np.ma.getmaskarray(masked) == (o3 > 0.03)).all())
+        f.variables['O3'][:] = 0
+        self.assert_((f.variables['O3'][...] == 0).all())
+        self.assert_((uamiv(self.path).variables['O3'][...] == o3).all())
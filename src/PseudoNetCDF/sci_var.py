@@ -13,7 +13,7 @@ are attached and the arrays implement the Scientific.IO.NetCDF.NetCDFVariable
 interfaces.
 """
 
-__all__ = ['PseudoNetCDFFile', 'PseudoNetCDFDimension', 'PseudoNetCDFVariableConvertUnit', 'PseudoNetCDFFileMemmap', 'PseudoNetCDFVariable', 'PseudoNetCDFMaskedVariable', 'PseudoIOAPIVariable', 'PseudoNetCDFVariables', 'Pseudo2NetCDF', 'reduce_dim', 'slice_dim', 'getvarpnc', 'interpvars', 'extract', 'pncbo', 'seqpncbo', 'pncexpr']
+__all__ = ['PseudoNetCDFFile', 'PseudoNetCDFDimension', 'PseudoNetCDFVariableConvertUnit', 'PseudoNetCDFFileMemmap', 'PseudoNetCDFVariable', 'PseudoNetCDFMaskedVariable', 'PseudoNetCDFLazyVariable', 'PseudoIOAPIVariable', 'PseudoNetCDFVariables', 'Pseudo2NetCDF', 'reduce_dim', 'slice_dim', 'getvarpnc', 'interpvars', 'interpweights', 'applyweights', 'extract', 'pncbo', 'seqpncbo', 'pncexpr']
 
 HeadURL="$HeadURL$"
 ChangeDate = "$LastChangedDate$"
@@ -23,8 +23,8 @@ __version__ = RevisionNum
 
 from .core._files import PseudoNetCDFFile, PseudoNetCDFFileMemmap, PseudoNetCDFVariables, OrderedDict
 from .core._dimensions import PseudoNetCDFDimension
-from .core._variables import PseudoNetCDFVariable, PseudoNetCDFMaskedVariable, PseudoIOAPIVariable
-from .core._functions import interpvars, extract, mask_vals, slice_dim, reduce_dim, mesh_dim, pncbo, pncexpr, seqpncbo, getvarpnc, add_attr, stack_files, convolve_dim, manglenames, removesingleton, merge, extract_from_file, pncrename, splitdim
+from .core._variables import PseudoNetCDFVariable, PseudoNetCDFMaskedVariable, PseudoNetCDFLazyVariable, PseudoIOAPIVariable
+from .core._functions import interpvars, interpweights, applyweights, extract, mask_vals, slice_dim, reduce_dim, mesh_dim, pncbo, pncexpr, seqpncbo, getvarpnc, add_attr, stack_files, convolve_dim, manglenames, removesingleton, merge, extract_from_file, pncrename, splitdim
 from .core._util import get_ncf_object, get_dimension_length
 from .core._transforms import PseudoNetCDFVariableConvertUnit
 from PseudoNetCDF.pncgen import Pseudo2NetCDF
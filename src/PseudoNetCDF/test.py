@@ -9,6 +9,24 @@ addTestCasesFromModule(sci_var)
 from . import ArrayTransforms
 addTestCasesFromModule(ArrayTransforms)
 
+from .core import _variables
+addTestCasesFromModule(_variables)
+
+from .core import _functions
+addTestCasesFromModule(_functions)
+
+from . import userfuncs
+addTestCasesFromModule(userfuncs)
+
+from . import MetaNetCDF
+addTestCasesFromModule(MetaNetCDF)
+
+from . import pncgen
+addTestCasesFromModule(pncgen)
+
+from . import pncparse
+addTestCasesFromModule(pncparse)
+
 from . import camxfiles
 addTestCasesFromModule(camxfiles.wind.Memmap)
 addTestCasesFromModule(camxfiles.humidity.Memmap)
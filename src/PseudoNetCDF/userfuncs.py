@@ -1,5 +1,149 @@
+__all__ = ['mda8', 'daymax', 'daymin', 'daymean', 'daysum', 'daystd', 'dayvar']
+
+import unittest
 import numpy as np
-def mda8(arr, axis = None, keepdims = True):
+
+_dayfuncs = ('mda8', 'daymax', 'daymin', 'daymean', 'daysum', 'daystd', 'dayvar')
+
+def _movingsum(arr, window, axis):
+    """
+    Arguments:
+       arr - array_like (masked values must already be filled)
+       window - number of elements in each sum
+       axis - axis along which to sum
+    Returns:
+       out - float64 sums of window consecutive elements along axis
+             (like np.convolve mode = 'valid') from one cumulative sum
+    """
+    csum = np.cumsum(arr, axis = axis, dtype = 'd')
+    before = (slice(None),) * axis
+    out = csum[before + (slice(window - 1, None),)].copy()
+    out[before + (slice(1, None),)] -= csum[before + (slice(None, -window),)]
+    return out
+
+def _daynumbers(n, times = None, utcoffset = 0):
+    """
+    Arguments:
+       n - number of time steps
+       times - datetimes (UTC) for each step; if None, steps are hours
+               starting at 0Z
+       utcoffset - hours added to UTC to get local time
+    Returns:
+       out - integer day for each step (days since the first UTC day)
+    """
+    if times is None:
+        hours = np.arange(n, dtype = 'd')
+    else:
+        times = np.asarray(times)
+        first = times[0].replace(hour = 0, minute = 0, second = 0, microsecond = 0)
+        hours = np.array([(t - first).total_seconds() / 3600. for t in times])
+    return np.floor((hours + utcoffset) / 24.).astype('i')
+
+def _dayrange(n, times = None, utcoffset = 0):
+    """
+    Arguments:
+       n, times - see _daynumbers
+       utcoffset - scalar or array of hours added to UTC
+    Returns:
+       firstday, ndays - first day number and number of days spanned
+                         by all offsets
+    """
+    days = [_daynumbers(n, times, uoffset) for uoffset in np.unique(utcoffset)]
+    firstday = min([d[0] for d in days])
+    return firstday, max([d[-1] for d in days]) - firstday + 1
+
+def _dayspan(func, n, times = None, utcoffset = 0):
+    """
+    Arguments:
+       func - name of a day function (see _dayfuncs)
+       n, times, utcoffset - see _dayreduce
+    Returns:
+       firstday, ndays - first day number and length of the day axis
+                         that func will return
+    """
+    if func == 'mda8':
+        n = n - 7
+        if times is not None:
+            times = times[:n]
+    return _dayrange(n, times, utcoffset)
+
+def _dayreduce(stat, arr, axis = None, times = None, utcoffset = 0, mincount = 1):
+    """
+    Arguments:
+       stat - max, min, sum, mean, std or var
+       arr - array_like with time along axis
+       axis - time axis (default 0)
+       times - datetimes (UTC) for each step on axis; if None, steps are
+               hours starting at 0Z
+       utcoffset - hours added to UTC to define the local day; a scalar
+                   or an array that broadcasts to arr without axis
+                   (e.g., longitude / 15.)
+       mincount - days with fewer valid values are masked
+    Returns:
+       out - masked array with one element per local day along axis;
+             days are grouped with ufunc.reduceat so no per-cell
+             Python loop is needed (one pass per distinct utcoffset)
+    """
+    if axis is None:
+        axis = 0
+    axis = axis % np.ndim(arr)
+    valid = ~np.ma.getmaskarray(arr)
+    data = np.moveaxis(np.ma.getdata(arr), axis, 0)
+    valid = np.moveaxis(valid, axis, 0)
+    n = data.shape[0]
+    othershape = data.shape[1:]
+    data = data.reshape(n, -1)
+    valid = valid.reshape(n, -1)
+    utcoffset = np.asarray(utcoffset, dtype = 'd')
+    try:
+        offsets = np.broadcast_to(utcoffset, othershape).ravel()
+    except ValueError:
+        # arrays without the utcoffset dimensions (e.g., time coordinates)
+        # use the typical offset, but keep the same days
+        offsets = np.full(data.shape[1], np.median(utcoffset))
+    firstday, ndays = _dayrange(n, times, utcoffset)
+    uoffsets = np.unique(offsets)
+    daysbyoffset = [_daynumbers(n, times, uoffset) for uoffset in uoffsets]
+    outdtype = data.dtype if stat in ('max', 'min') else np.dtype('d')
+    out = np.zeros((ndays, data.shape[1]), dtype = outdtype)
+    count = np.zeros((ndays, data.shape[1]), dtype = 'i')
+    if data.dtype.kind == 'f':
+        lo, hi = -np.inf, np.inf
+    elif data.dtype.kind in 'iu':
+        lo, hi = np.iinfo(data.dtype).min, np.iinfo(data.dtype).max
+    else:
+        lo, hi = 0, 0
+    for uoffset, days in zip(uoffsets, daysbyoffset):
+        cells = slice(None) if len(uoffsets) == 1 else np.flatnonzero(offsets == uoffset)
+        cdata = data[:, cells]
+        cvalid = valid[:, cells]
+        starts = np.flatnonzero(np.diff(days, prepend = days[0] - 1) != 0)
+        dayi = days[starts] - firstday
+        ccount = np.add.reduceat(cvalid.astype('i'), starts, axis = 0)
+        if stat == 'max':
+            cout = np.maximum.reduceat(np.where(cvalid, cdata, lo), starts, axis = 0)
+        elif stat == 'min':
+            cout = np.minimum.reduceat(np.where(cvalid, cdata, hi), starts, axis = 0)
+        else:
+            filled = np.where(cvalid, cdata, 0).astype('d')
+            cout = np.add.reduceat(filled, starts, axis = 0)
+            if stat != 'sum':
+                cout /= np.maximum(ccount, 1)
+            if stat in ('std', 'var'):
+                anom = np.where(cvalid, filled - np.repeat(cout, np.diff(np.append(starts, n)), axis = 0), 0)
+                cout = np.add.reduceat(anom**2, starts, axis = 0) / np.maximum(ccount, 1)
+                if stat == 'std':
+                    cout = np.sqrt(cout)
+        if len(uoffsets) == 1:
+            out[dayi] = cout
+            count[dayi] = ccount
+        else:
+            out[dayi[:, None], cells[None, :]] = cout
+            count[dayi[:, None], cells[None, :]] = ccount
+    out = np.ma.masked_where(count < max(mincount, 1), out)
+    return np.moveaxis(out.reshape((ndays,) + othershape), 0, axis)
+
+def mda8(arr, axis = None, keepdims = True, times = None, utcoffset = 0, minvalid = 6, mincount = 1):
     """
     Daily-Maximum 8-hour average concentration
        - can be applied to any dimensions, but make sense with time
@@ -8,59 +152,88 @@ def mda8(arr, axis = None, keepdims = True):
        arr - array like
        axis - axis over which to apply mda8
        keepdims - should be true
+       times - datetimes (UTC) of each step; if None, hourly from 0Z
+       utcoffset - hours from UTC to local time (scalar or array; see _dayreduce)
+       minvalid - 8-hour averages with fewer valid hours are masked
+       mincount - days with fewer valid 8-hour averages are masked
+                  (e.g., 18 for 75% completeness); the last day of the
+                  input has at most 17 averages, so such a rule masks it
     Returns:
-       out - maximum of 8 element running average. For masked inptus, only values with 6 or more valid entries are returned
+       out - maximum of 8 element running averages that start in each
+             local day. Averages use cumulative sums (no per-cell loop);
+             for masked inputs, only values with minvalid or more valid
+             entries are used
     """
-    if hasattr(arr, 'mask'):
-        arr_m = np.ma.masked_array(arr)
-        nvalid = np.apply_along_axis(np.convolve, axis = axis, arr = ~np.ma.getarraymask(arr_m), v = [1]*8, mode = 'valid')
-        arra8_m = np.ma.masked_where(nvalid < 6, np.apply_along_axis(np.convolve, axis = axis, arr = arr_m.filled(0), v = [1]*8, mode = 'valid')/nvalid)
-        arrmda8 = np.ma.masked_invalid(daymax(arra8_m, axis = axis))
-    else:
-        arra8 = np.apply_along_axis(np.convolve, axis = axis, arr = arr, v = [1/8.]*8, mode = 'valid')
-        arrmda8 = daymax(arra8, axis = axis)
-    return arrmda8
+    if axis is None:
+        axis = 0
+    axis = axis % np.ndim(arr)
+    valid = ~np.ma.getmaskarray(arr)
+    nvalid = _movingsum(valid, 8, axis)
+    arra8 = np.ma.masked_where(nvalid < minvalid, _movingsum(np.ma.filled(arr, 0), 8, axis) / np.maximum(nvalid, 1))
+    if times is not None:
+        times = np.asarray(times)[:arra8.shape[axis]]
+    return daymax(arra8, axis = axis, times = times, utcoffset = utcoffset, mincount = mincount)
 
-def _dayfunc(func, arr, axis = None, keepdims = True):
+def daymax(arr, axis = None, keepdims = True, times = None, utcoffset = 0, mincount = 1):
     """
-    Arguments:
-       func - function with reduceat property
-       arr - array_like
-       axis - axis overwhich to apply func.reduceat
-       keepdims - must be true
-    Returns:
-       out - array_like with func.reduceat applied at 24 element increments
+    see _dayreduce with max as stat
     """
-    daystartend = np.arange(0, arr.shape[axis], 24)
-    return func.reduceat(arr, daystartend, axis = axis)[(slice(None),)*axis + (slice(-1),)]
+    return _dayreduce('max', arr, axis = axis, times = times, utcoffset = utcoffset, mincount = mincount)
 
-def daymax(arr, axis = None, keepdims = True):
+def daymin(arr, axis = None, keepdims = True, times = None, utcoffset = 0, mincount = 1):
     """
-    see _dayfunc with np.maximum as func
+    see _dayreduce with min as stat
     """
-    return _dayfunc(np.maximum, arr, axis = axis, keepdims = keepdims)
+    return _dayreduce('min', arr, axis = axis, times = times, utcoffset = utcoffset, mincount = mincount)
 
-def daymin(arr, axis = None, keepdims = True):
+def daymean(arr, axis = None, keepdims = True, times = None, utcoffset = 0, mincount = 1):
     """
-    see _dayfunc with np.minimum as func
+    see _dayreduce with mean as stat
     """
-    return _dayfunc(np.minimum, arr, axis = axis, keepdims = keepdims)
+    return _dayreduce('mean', arr, axis = axis, times = times, utcoffset = utcoffset, mincount = mincount)
 
-def daymean(arr, axis = None, keepdims = True):
+def daysum(arr, axis = None, keepdims = True, times = None, utcoffset = 0, mincount = 1):
     """
-    see _dayfunc with np.mean as func
+    see _dayreduce with sum as stat
     """
-    return _dayfunc(np.mean, arr, axis = axis, keepdims = keepdims)
+    return _dayreduce('sum', arr, axis = axis, times = times, utcoffset = utcoffset, mincount = mincount)
 
-def daystd(arr, axis = None, keepdims = True):
+def daystd(arr, axis = None, keepdims = True, times = None, utcoffset = 0, mincount = 1):
     """
-    see _dayfunc with np.std as func
+    see _dayreduce with std as stat
     """
-    return _dayfunc(np.std, arr, axis = axis, keepdims = keepdims)
+    return _dayreduce('std', arr, axis = axis, times = times, utcoffset = utcoffset, mincount = mincount)
 
-def dayvar(arr, axis = None, keepdims = True):
+def dayvar(arr, axis = None, keepdims = True, times = None, utcoffset = 0, mincount = 1):
     """
-    see _dayfunc with np.var as func
+    see _dayreduce with var as stat
     """
-    return _dayfunc(np.var, arr, axis = axis, keepdims = keepdims)
+    return _dayreduce('var', arr, axis = axis, times = times, utcoffset = utcoffset, mincount = mincount)
 
+class TestDayFunctions(unittest.TestCase):
+    def runTest(self):
+        pass
+    
+    def setUp(self):
+        self.o3 = np.random.RandomState(0).rand(48, 2, 3)
+    
+    def testMDA8(self):
+        o3 = self.o3
+        a8 = np.array([[np.convolve(o3[:, j, i], [1 / 8.] * 8, mode = 'valid') for i in range(3)] for j in range(2)]).transpose(2, 0, 1)
+        mda8out = mda8(o3, axis = 0)
+        self.assertEqual(mda8out.shape, (2, 2, 3))
+        self.assert_(np.allclose(mda8out[0], a8[:24].max(0)))
+        self.assert_(np.allclose(mda8out[1], a8[24:].max(0)))
+        mda8out = mda8(o3, axis = 0, mincount = 18)
+        self.assert_(np.allclose(mda8out[0], a8[:24].max(0)))
+        self.assert_(np.ma.getmaskarray(mda8out[1]).all())
+    
+    def testUTCOffset(self):
+        o3 = self.o3
+        offset = np.array([0, -5, -8])
+        daymaxout = daymax(o3, axis = 0, utcoffset = offset)
+        self.assertEqual(daymaxout.shape, (3, 2, 3))
+        self.assert_(np.allclose(daymaxout[1, :, 1], o3[5:29, :, 1].max(0)))
+        self.assert_(np.allclose(daymaxout[0, :, 2], o3[:8, :, 2].max(0)))
+        self.assert_(np.ma.getmaskarray(daymaxout[0, :, 0]).all())
+        self.assert_(np.allclose(daymaxout[2, :, 0], o3[24:, :, 0].max(0)))